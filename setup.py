@@ -48,6 +48,7 @@ setup(
     entry_points={
         'console_scripts': [
             'tmon=tmon.cli:main',
+            'tmond=tmon.daemon:main',
         ],
     },
     install_requires=requirements,
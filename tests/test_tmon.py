@@ -1,12 +1,813 @@
 #!/usr/bin/env python
 
 
-# import pytest
+from array import array
+import io
+import math
+import os
+import random
+import subprocess
+import sys
+import threading
+import time
 
+import pytest
 
-# from tmon import tmon
+import tmon
+
+from tmon import (
+    cli, daemon, downsample, export, fleet, heatmap, raw, replay, rotate
+)
+from tmon.asciichart import plot
+from tmon.downsample import StreamingBucketer
+from tmon.guard import Guard
+from tmon.live import Dashboard
+from tmon.markers import MarkerChannel, PhaseLog, mark
+from tmon.procstat import CPUSampler
+from tmon.scheduler import AdaptiveInterval, Scheduler
+from tmon.sensors import Sensors
+from tmon.series import RingBuffer, Series, ThrottleLog
+from tmon.stats import (
+    LatencyHistogram, RunningCorrelation, RunningStats, TemperatureHistogram
+)
+from tmon.tmon import Report, RepeatReport
 
-# TODO: add tests
 
 def test_dummy():
     assert True
+
+
+def test_cli_zones_leave_the_command(monkeypatch):
+    monkeypatch.setattr('sys.argv', ['tmon', '-z', 'cpu0,gpu*', 'make', '-j'])
+    args = cli.parse_args()
+    assert args['zones'] == ['cpu0', 'gpu*']
+    assert args['command'] == ['make', '-j']
+
+
+@pytest.mark.parametrize('window', ['0', '-5'])
+def test_cli_rejects_empty_windows(monkeypatch, window):
+    monkeypatch.setattr('sys.argv', ['tmon', '--window', window, 'true'])
+    with pytest.raises(SystemExit):
+        cli.parse_args()
+
+
+def test_cli_does_not_import_numpy():
+    code = (
+        "import sys, tmon.cli; "
+        "assert 'numpy' not in sys.modules, 'numpy imported'"
+    )
+    subprocess.run([sys.executable, '-c', code], check=True)
+
+
+def _write(path, value):
+    path.parent.mkdir(parents=True, exist_ok=True)
+    path.write_text("{}\n".format(value))
+
+
+def _fake_zones(root, temps):
+    thermal = root / "sys" / "class" / "thermal"
+    for i, t in enumerate(temps):
+        _write(thermal / "thermal_zone{}".format(i) / "temp", t)
+
+
+def test_sensors_read(tmp_path):
+    _fake_zones(tmp_path, [45000, 51000, 38000])
+    with Sensors(str(tmp_path)) as sensors:
+        assert len(sensors) == 3
+        assert sensors.names == ["thermal_zone0", "thermal_zone1",
+                                 "thermal_zone2"]
+        assert sensors.read() == [45000, 51000, 38000]
+        zone1 = tmp_path / "sys/class/thermal/thermal_zone1/temp"
+        zone1.write_text("60000\n")
+        assert sensors.read() == [45000, 60000, 38000]
+        zone1.write_text("-100000\n")  # parsed in place, see pread_int
+        assert sensors.read()[1] == -100000
+        zone1.write_text("500\n")
+        assert sensors.read()[1] == 500
+        zone1.write_text("60000\n")
+        assert sensors.read()[1] == 60000
+        assert sensors.ticks == 5
+        assert sensors.mean_tick_us > 0
+        # a zone going away keeps the others at their positions
+        zone1.write_text("")
+        zone1.unlink()
+        assert sensors.read() == [45000, raw.MISSING, 38000]
+        assert sensors.names[2] == "thermal_zone2"
+        zone1.write_text("52000\n")
+        assert sensors.read() == [45000, 52000, 38000]
+        assert not sensors.degraded
+        for i in range(3):
+            path = tmp_path / "sys/class/thermal/thermal_zone{}/temp".format(i)
+            path.write_text("")
+            path.unlink()
+        with pytest.raises(OSError):
+            sensors.read()
+
+
+def test_sensors_backends(tmp_path):
+    _fake_zones(tmp_path, [45000])
+    hwmon = tmp_path / "sys/class/hwmon/hwmon0"
+    _write(hwmon / "name", "coretemp")
+    _write(hwmon / "temp2_input", 52000)
+    _write(hwmon / "temp2_label", "Core 0")
+    cpus = tmp_path / "sys/devices/system/cpu"
+    _write(cpus / "cpu0/cpufreq/scaling_cur_freq", 2000000)
+    _write(cpus / "cpu1/cpufreq/scaling_cur_freq", 3000000)
+    rapl = tmp_path / "sys/class/powercap"
+    _write(rapl / "intel-rapl:0/energy_uj", 999000000)
+    _write(rapl / "intel-rapl:0/max_energy_range_uj", 1000000000)
+    _write(rapl / "intel-rapl:0:0/energy_uj", 5)  # subzone, not counted
+    backends = ('rapl', 'cpufreq', 'hwmon', 'thermal')
+    with Sensors(str(tmp_path), backends) as sensors:
+        assert sensors.names == ["coretemp:Core 0", "thermal_zone0"]
+        values = sensors.read()
+        assert values[:sensors.ntemps] == [52000, 45000]
+        assert sensors.summaries(values, 10.0) == {'freq': 2500.0}
+        _write(rapl / "intel-rapl:0/energy_uj", 4000000)  # wrapped around
+        values = sensors.read()
+        assert sensors.summaries(values, 10.5) == {
+            'freq': 2500.0, 'power': pytest.approx(10.0)
+        }
+    with pytest.raises(ValueError):
+        Sensors(str(tmp_path), ('nvml',))
+
+
+def test_throttle(tmp_path):
+    cpus = tmp_path / "sys/devices/system/cpu"
+    for cpu in ("cpu0", "cpu1"):
+        _write(cpus / cpu / "topology/physical_package_id", 0)
+        _write(cpus / cpu / "thermal_throttle/core_throttle_count", 0)
+        _write(cpus / cpu / "thermal_throttle/package_throttle_count", 0)
+    counter = cpus / "cpu1/thermal_throttle/core_throttle_count"
+    log = ThrottleLog()
+    with Sensors(str(tmp_path), ('throttle',)) as sensors:
+        assert len(sensors) == 3  # 2 cores and 1 package
+        for tick in range(10):
+            if tick == 6:
+                counter.write_text("2\n")
+            extras = sensors.summaries(sensors.read(), tick)
+            if 'throttle' in extras:
+                log.push(tick, *extras['throttle'])
+    assert (log.total, list(log.ticks)) == (2, [6])
+    assert log.throttled(0.5) == 0.5
+    assert log.columns(10, 5) == {3}
+    assert log.columns(10, 20) == {6}
+
+
+def test_background_monitor(tmp_path):
+    _fake_zones(tmp_path, [45000, 51000])
+    m = tmon.monitor(interval=0.01, sysfs_root=str(tmp_path))
+    assert isinstance(m, tmon.Monitor)
+    with pytest.raises(RuntimeError):
+        m.report()  # never started
+    with pytest.raises(RuntimeError):
+        m.stop()
+
+    @m
+    def work():
+        time.sleep(0.05)
+        return 42
+
+    assert work() == 42
+    with m:
+        assert m.running
+        work()  # nested, keeps sampling
+        assert m.running
+    assert not m.running
+    assert len(m) == m.stats.count >= 3
+    assert m.stats.max == 51.0
+    assert m.column(1) is m.series.columns[1]
+    assert "max: 51.0 °C" in m.report()
+
+    threads = [threading.Thread(target=work) for _ in range(8)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    assert not m.running and m._depth == 0
+
+    def broken():
+        raise OSError(5, "Input/output error")
+
+    m.start()
+    m.sensors.read = broken
+    time.sleep(0.05)
+    assert not m.running  # the thread is gone
+    with pytest.raises(OSError):
+        m.report()
+    with pytest.raises(OSError):
+        m.stop()
+    assert m._depth == 0
+
+
+def test_tmond_ring(tmp_path):
+    path = str(tmp_path / "ring")
+    assert daemon.attach(path) is None
+    writer = daemon.RingWriter(path, ["cpu", "x86_pkg_temp"], 0.5, 4)
+    try:
+        reader = daemon.attach(path)
+        assert reader.zones == ["cpu", "x86_pkg_temp"]
+        assert reader.read() == [] and reader.latest() is None
+        now = time.monotonic()
+        writer.append(now, [40000, 41000])
+        writer.append(now, [42000])  # a sensor went missing
+        assert reader.read() == [[40000, 41000], [42000, raw.MISSING]]
+        for i in range(6):
+            writer.append(now, [i, i])
+        assert reader.read() == [[3, 3], [4, 4], [5, 5]]
+        assert reader.lost == 3
+        assert reader.latest() == [5, 5]
+        assert reader.alive()
+    finally:
+        writer.close()
+    assert daemon.attach(path) is None
+
+    # a daemon exiting after another one replaced its file leaves it be
+    old = daemon.RingWriter(path, ["cpu"], 0.5, 4)
+    new = daemon.RingWriter(path, ["gpu"], 0.5, 4)
+    old.close()
+    reader = daemon.attach(path)
+    assert reader.zones == ["gpu"]
+    reader.close()
+    new.close()
+    assert daemon.attach(path) is None
+
+
+@pytest.mark.parametrize('pidfd', [True, False])
+def test_child_exit_wakes_up_the_monitor(tmp_path, pidfd):
+    if pidfd and not hasattr(os, 'pidfd_open'):
+        pytest.skip("no pidfd_open")
+    _fake_zones(tmp_path, [45000])
+    # tmon -i 1 sleep 0.2 timed in process, without the start up of Python,
+    # the fallback being the SIGCHLD handler writing to the self-pipe
+    code = (
+        "import os, sys, time\n"
+        "from tmon import cli\n"
+        "if not {pidfd}:\n"
+        "    os.__dict__.pop('pidfd_open', None)\n"
+        "sys.argv = ['tmon', '-i', '1', '-s', '--sysfs-root', {root!r},\n"
+        "            '--output-dir', {root!r}, 'sleep', '0.2']\n"
+        "t0 = time.monotonic()\n"
+        "status = cli.main()\n"
+        "print('elapsed', time.monotonic() - t0, file=sys.stderr)\n"
+        "sys.exit(status)\n"
+    ).format(pidfd=pidfd, root=str(tmp_path))
+    proc = subprocess.run(
+        [sys.executable, '-c', code], stdout=subprocess.PIPE,
+        stderr=subprocess.PIPE, universal_newlines=True, check=True
+    )
+    elapsed = float(proc.stderr.split('elapsed')[-1])
+    assert 0.2 <= elapsed < 0.6
+
+
+def test_scheduler_skips_missed_deadlines():
+    sched = Scheduler(0.01)
+    sched.start()
+    sched.tick()
+    time.sleep(0.035)
+    sched.tick()
+    assert sched.missed >= 2
+    assert sched.timeout() <= 0.01
+    assert sched.jitter[1] >= 0.025
+
+
+def test_adaptive_interval():
+    adaptive = AdaptiveInterval(0.1, 10.0, step=0.5)
+    assert adaptive.update([40000], 0.1) == 0.1
+    intervals = [adaptive.update([40000], 0.1) for _ in range(20)]
+    assert intervals[0] == pytest.approx(0.15) and intervals[-1] == 10.0
+    # a 2 °C jump over 10 s calls for 0.5 °C every 2.5 s
+    assert adaptive.update([42000], 10.0) == pytest.approx(2.5)
+    assert adaptive.update([52000], 2.5) == pytest.approx(0.125)
+    assert adaptive.update([62000], 0.125) == 0.1
+    sched = Scheduler(1.0)
+    sched.start()
+    sched.tick()
+    sched.retime(0.01)
+    assert sched.timeout() <= 0.01
+
+    # the report gives the bounds and the mean, not the last interval
+    sched = Scheduler(0.01, 0.2)
+    sched.ticks, sched.first, sched.last = 11, 0.0, 1.0
+    sched.interval = 0.2  # as last retimed
+    assert sched.mean_interval == pytest.approx(0.1)
+    report = Report(RunningStats(), None, "0:00:01", scheduler=sched)
+    report.tick_us = 10.0
+    assert "rate: 10.00 Hz (adaptive interval 0.01-0.2 s, 0.1 s mean)" in \
+        report.sampler()
+
+
+def test_running_stats():
+    data = [48.0, 52.5, 50.0, 61.25, 49.0]
+    stats = RunningStats()
+    for x in data:
+        stats.push(x)
+    mean = sum(data) / len(data)
+    assert stats.count == 5
+    assert (stats.min, stats.max) == (48.0, 61.25)
+    assert math.isclose(stats.mean, mean)
+    assert math.isclose(
+        stats.variance, sum((x - mean)**2 for x in data) / len(data)
+    )
+    f = stats.scaled(1.8, 32)
+    assert math.isclose(f.mean, mean*1.8 + 32)
+    assert math.isclose(f.std, stats.std*1.8)
+
+
+def test_repeat_report():
+    runs = []
+    for wall, temps in ((10.0, [40.0, 60.0]), (12.0, [50.0, 70.0])):
+        stats = RunningStats()
+        for t in temps:
+            stats.push(t)
+        runs.append((stats, wall, 1.5))
+    report = RepeatReport(runs)
+    assert report.runs_table().splitlines()[2].split() == [
+        '2', '12.00', '1.50', '50.0', '60.0', '70.0'
+    ]
+    assert report.aggregate().splitlines() == [
+        "wall: mean 11.00, std 1.00, min 10.00, max 12.00 s",
+        "avg temp: mean 55.00, std 5.00, min 50.00, max 60.00 °C",
+        "max temp: mean 65.00, std 5.00, min 60.00, max 70.00 °C",
+    ]
+
+
+def _state(pid):
+    with open("/proc/{}/stat".format(pid)) as f:
+        return f.read().rsplit(')', 1)[1].split()[0]
+
+
+def test_guard_pauses_and_resumes():
+    proc = subprocess.Popen(["sleep", "5"], preexec_fn=os.setpgrp)
+    try:
+        guard = Guard(80.0)
+        guard.attach(proc.pid)
+        for tick, t in enumerate([70.0, 80.0, 78.0, 74.0, 81.0]):
+            guard.update(tick, t)
+            if tick == 2:
+                time.sleep(0.05)
+                assert _state(proc.pid) == 'T'
+        assert guard.paused
+        guard.resume(5)
+        assert [i[:2] for i in guard.intervals] == [(1, 3), (4, 5)]
+        assert guard.columns(6, 3) == {0, 1, 2}
+        time.sleep(0.05)
+        assert _state(proc.pid) != 'T'
+    finally:
+        proc.kill()
+        proc.wait()
+
+
+def test_phase_markers():
+    with MarkerChannel() as channel:
+        assert mark("load", channel.path)
+        assert mark(" steady\n", channel.path)
+        assert channel.receive() == ["load", "steady"]
+        assert channel.receive() == []
+    assert not mark("gone", channel.path)
+    phases = PhaseLog()
+    for tick, t in enumerate([40.0, 45.0, 50.0, 70.0, 72.0, 44.0]):
+        if tick in (1, 3, 5):
+            phases.start({1: "load", 3: "steady", 5: "load"}[tick], tick)
+        phases.push(t)
+    assert list(phases.stats) == ["load", "steady"]
+    assert phases.stats["load"].count == 3
+    assert phases.stats["steady"].mean == 71.0
+    assert phases.label_line(6, 6) == " |l|s|"
+
+
+def test_marks_of_adaptive_runs():
+    # 10 samples of 0.1 s, then 10 of 0.45 s: the phase starts 1 s into a
+    # 5.5 s run, and ends at 3.25 s
+    phases = PhaseLog()
+    stats = RunningStats()
+    elapsed = array('d')
+    for tick in range(20):
+        dt = 0.1 if tick < 10 else 0.45
+        if tick in (10, 15):
+            phases.start("load" if tick == 10 else "end", tick)
+        t = 60.0 if tick < 15 else 40.0
+        phases.push(t, dt)
+        stats.push(t, dt)
+        elapsed.append((elapsed[-1] if elapsed else 0.0) + dt)
+    assert phases.stats["load"].mean == 60.0
+    position = downsample.time_positions(elapsed, 4000)
+    assert phases.label_line(4000, 40, position) == (
+        " " * 7 + "|load" + " " * 11 + "|end"
+    )
+    report = Report(stats, None, "0:00:05", phases=phases, elapsed=elapsed)
+    assert report._marks(40) == ["   phases " + phases.label_line(
+        4000, 40, position
+    )]
+
+
+def test_binary_raw_roundtrip(tmp_path):
+    path = str(tmp_path / "raw.bin")
+    rows = [[45000, 51000], [46000, 52000], [47000]]
+    with open(path, 'wb') as f:
+        writer = raw.BinaryWriter(f, ['cpu', 'gpu'], 0.5, 1e9, batch=2)
+        for row in rows:
+            writer.write(row)
+        writer.flush()
+    with raw.open_raw(path) as reader:
+        assert reader.zones == ['cpu', 'gpu']
+        assert (reader.interval, reader.start) == (0.5, 1e9)
+        assert len(reader) == 3
+        assert reader.column(0).tolist() == [45000, 46000, 47000]
+        assert reader.column(1).tolist() == [51000, 52000, raw.MISSING]
+    assert list(raw.iter_max(path)) == [51.0, 52.0, 47.0]
+
+
+@pytest.mark.parametrize('fmt,compressor', [
+    ('text', 'gzip'), ('binary', 'lzma')
+])
+def test_rotating_writer(tmp_path, fmt, compressor):
+    writer_cls = raw.WRITERS[fmt]
+    with rotate.RotatingWriter(
+        str(tmp_path), "run-", writer_cls, ['cpu', 'gpu'], 1.0, 0.0,
+        max_bytes=200, compressor=compressor
+    ) as writer:
+        for k in range(100):
+            writer.write([45000 + k, 40000])
+    segments = sorted(writer.segments)
+    assert len(segments) > 1
+    assert sorted(os.listdir(str(tmp_path))) == [
+        os.path.basename(p) for p in segments
+    ]
+    temps = []
+    for path in segments:
+        with raw.open_raw(path) as reader:
+            assert reader.zones == ['cpu', 'gpu']
+            temps.extend(row[0] for row in reader.rows())
+    assert temps == [45000 + k for k in range(100)]
+
+    # only the last segments are kept, the newest samples in them
+    keep = tmp_path / "keep"
+    keep.mkdir()
+    with rotate.RotatingWriter(
+        str(keep), "run-", writer_cls, ['cpu', 'gpu'], 1.0, 0.0,
+        max_bytes=200, compressor=compressor, keep=2
+    ) as writer:
+        for k in range(100):
+            writer.write([45000 + k, 40000])
+    assert len(writer.segments) == 2
+    assert writer.removed == len(segments) - 2
+    assert sorted(os.listdir(str(keep))) == sorted(
+        os.path.basename(p) for p in writer.segments
+    )
+    with raw.open_raw(sorted(writer.segments)[-1]) as reader:
+        assert list(reader.rows())[-1][0] == 45099
+
+
+def test_rotating_writers_with_the_same_prefix(tmp_path):
+    writers = [
+        rotate.RotatingWriter(
+            str(tmp_path), "run-", raw.TextWriter, ['cpu'], 1.0, 0.0,
+            max_bytes=100, compressor='none'
+        ) for _ in range(2)
+    ]
+    for k, writer in enumerate(writers):
+        for _ in range(20):
+            writer.write([40000 + k])
+    segments = [writer.close() for writer in writers]
+    assert not set(segments[0]) & set(segments[1])
+    assert len(os.listdir(str(tmp_path))) == sum(map(len, segments))
+    for k, paths in enumerate(segments):
+        for path in paths:
+            with raw.open_raw(path) as reader:
+                assert {row[0] for row in reader.rows()} == {40000 + k}
+    assert rotate.parse_size('64M') == 64 << 20
+    assert rotate.parse_duration('12h') == 43200
+    with pytest.raises(ValueError):
+        rotate.parse_size('0')
+
+
+def test_fleet_merge(tmp_path):
+    paths = []
+    hosts = [('a', 'text', 0, 40000), ('b', 'binary', 5, 50000)]
+    for host, fmt, shift, temp in hosts:
+        writer_cls = raw.WRITERS[fmt]
+        path = str(tmp_path / (host + writer_cls.suffix))
+        with open(path, writer_cls.mode) as f:
+            writer = writer_cls(f, ['cpu'], 1.0, 1e9 + shift, host=host)
+            mono = writer.clock.mono
+            for k in range(20):
+                writer.write([temp + 1000 * (k % 2)], mono + k + 0.25)
+            writer.flush()
+        paths.append(path)
+        with raw.open_raw(path) as reader:
+            assert reader.host == host
+            mono, wall, row = list(reader.timed_rows())[1]
+            assert row == [temp + 1000]
+            assert abs(wall - (1e9 + shift + 1.25)) < 1e-3
+    streamed, period = fleet.merge(paths, 10, bucket=2.0)
+    assert period == "0:00:24"
+    assert streamed.zones == ['a', 'b'] and streamed.selected == [0, 1]
+    assert streamed.zone_stats[0].max == 41.0
+    assert streamed.zone_stats[1].min == 50.0
+    assert streamed.stats.count == 40
+    # both hosts have a point for every bucket, b's leading ones included
+    assert len(streamed.zone_bucketers[0]) == len(
+        streamed.zone_bucketers[1]
+    ) == len(streamed.bucketer) == 13
+    with pytest.raises(ValueError):
+        fleet.merge([str(tmp_path / 'a.txt')], 10, zones=['gpu'])
+
+    # a day between files makes one point of the empty buckets, not 86400
+    path = str(tmp_path / 'c.txt')
+    with open(path, 'w') as f:
+        writer = raw.TextWriter(f, ['cpu'], 1.0, 1e9 + 86400, host='a')
+        writer.write([60000], writer.clock.mono)
+        writer.flush()
+    t0 = time.monotonic()
+    streamed, period = fleet.merge([paths[0], path], 10, bucket=1.0)
+    assert time.monotonic() - t0 < 0.5
+    assert period == "1 day, 0:00:00"
+    assert len(streamed.bucketer) == 86401
+    assert len(streamed.bucketer.counts) <= 20
+    assert streamed.bucketer.result(10)[-1] == 60.0
+
+
+def test_series_select_and_stats(tmp_path):
+    path = str(tmp_path / "raw.txt")
+    with open(path, 'w') as f:
+        writer = raw.TextWriter(f, ['acpitz', 'cpu0', 'cpu1'], 1.0, 0.0)
+        writer.write([40000, 50000, 52000])
+        writer.write([41000, 58000, 51000])
+    series = Series.load(path)
+    assert series.zones == ['acpitz', 'cpu0', 'cpu1']
+    assert series.select(['cpu*']) == [1, 2]
+    assert series.select(['2', 'acpitz', 'cpu1']) == [2, 0]
+    with pytest.raises(ValueError):
+        series.select(['gpu'])
+    assert series.stats(1).max == 58.0
+    assert series.max([0, 2]).tolist() == [52.0, 51.0]
+
+
+@pytest.mark.parametrize('mode', ['max', 'lttb'])
+def test_downsample_keeps_spikes(mode):
+    series = [45.0] * 139
+    series[77] = 90.0
+    ds = downsample.downsample(series, 70, mode)
+    assert len(ds) == 70
+    assert max(ds) == 90.0
+    lower, upper = downsample.band(series, 70)
+    assert (min(lower), max(upper)) == (45.0, 90.0)
+
+
+def test_plot_overlays_series():
+    chart = plot([[1, 1, 1], [3, 3, 3]], {'height': 2, 'format': '{:.0f} '})
+    assert chart.splitlines() == [
+        ' 3 ┼── ',
+        ' 2 ┤   ',
+        ' 1 ┼── ',
+    ]
+
+
+def test_ring_buffer():
+    ring = RingBuffer(3)
+    for x in [1.0, 2.0, 3.0, 4.0]:
+        ring.append(x)
+    assert list(ring) == [2.0, 3.0, 4.0]
+    assert (len(ring), ring.last, ring.mean) == (3, 4.0, 3.0)
+
+
+def test_dashboard_incremental_columns_match_full_redraw():
+    random.seed(0)
+    live = Dashboard(xsize=10, ysize=6, window=40, stream=io.StringIO())
+    for k in range(200):
+        live.push(random.choice([45.0, 45.0, 46.5, 47.0, 52.0]))
+        if k % 7 == 0:
+            live.draw()
+    live.draw()
+    full = Dashboard(xsize=10, ysize=6, window=40, stream=io.StringIO())
+    full.maxs, full.mins = live.maxs, live.mins
+    full.started = live.started
+    full.draw()
+    assert list(live.cells) == list(full.cells)
+    assert len(live.ring) == 40
+
+    # drawn from the first ticks, the columns widening as the window fills
+    live = Dashboard(xsize=10, ysize=6, window=400, stream=io.StringIO())
+    for t in (45.0, 50.0, 47.0):
+        live.push(t)
+    live.draw()
+    assert live.per_col == 1 and len(live.cells) == 2
+    for k in range(397):
+        live.push(45.0 + k % 3)
+        if k % 13 == 0:
+            live.draw()
+    live.draw()
+    assert live.per_col == 40 and len(live.maxs) == 10
+    assert max(live.maxs) == 50.0 and min(live.mins) == 45.0
+    full = Dashboard(xsize=10, ysize=6, window=400, stream=io.StringIO())
+    full.maxs, full.mins = live.maxs, live.mins
+    full.started = live.started
+    full.draw()
+    assert list(live.cells) == list(full.cells)
+
+
+def test_running_correlation():
+    corr = RunningCorrelation()
+    for x in range(10):
+        corr.push(x, 40.0 + 2.5 * x)
+    assert corr.slope == pytest.approx(2.5)
+    assert corr.r == pytest.approx(1.0)
+    assert RunningCorrelation().slope is None
+
+
+def test_cpu_sampler_counts_descendants():
+    busy = "import time\nt = time.time()\nwhile time.time() - t < 0.3: pass"
+    proc = subprocess.Popen(
+        ["sh", "-c", 'python3 -c "$0"; sleep 0.3', busy]
+    )
+    used = 0.0
+    with CPUSampler() as cpu:
+        cpu.attach(proc.pid)
+        t0 = time.monotonic()
+        cpu.sample(t0)
+        while proc.poll() is None:
+            time.sleep(0.05)
+            now = time.monotonic()
+            usage = cpu.sample(now)
+            if usage is not None:
+                used += usage[0] * (now - t0)
+            t0 = now
+    assert 0.2 < used < 0.5
+
+
+def test_latency_histogram():
+    hist = LatencyHistogram()
+    for us in [0.5, 10, 12, 15, 20, 300]:
+        hist.push(us)
+    assert list(hist.buckets()) == [(0, 1, 1), (8, 16, 3), (16, 32, 1),
+                                    (256, 512, 1)]
+    assert hist.percentile(0.5) == 16
+    assert hist.percentile(1.0) == 512
+    assert hist.max == 300
+
+
+def test_temperature_histogram():
+    hist = TemperatureHistogram()
+    stats = RunningStats()
+    for k in range(100):
+        t = 40.0 + k * 0.1  # 40.0 to 49.9, 2 s each
+        hist.push(t, 2.0)
+        stats.push(t)
+    assert hist.count == 100 and len(hist.counts) == 1900
+    assert hist.percentile(0.5) == pytest.approx(44.95)
+    assert hist.percentile(0.99) == pytest.approx(49.85)
+    assert hist.above(45.0) == (50, 100.0)
+    assert hist.above(100.0) == (0, 0.0)
+    assert sum(n for _, _, n in hist.rows(4)) == 100
+    flat = TemperatureHistogram()
+    for _ in range(10):
+        flat.push(50.0, 1.0)
+    assert flat.percentile(0.5) == flat.percentile(0.99) == 50.0
+    merged = TemperatureHistogram()
+    merged.merge(flat)
+    assert merged.percentile(0.9) == 50.0
+    report = Report(
+        stats, None, "0:03:20", histogram=hist, thresholds=[48.0],
+        show=('percentiles', 'above', 'histogram')
+    )
+    text = report.stats()
+    assert "min:" not in text
+    assert "p50: 45.0, p90: 49.0, p99: 49.9 °C" in text
+    assert "above 48.0 °C: 40.0 s, 20 samples (20.0%)" in text
+    assert "histogram (°C):" in text
+
+
+def test_machine_readable_outputs(tmp_path):
+    stats = RunningStats()
+    hist = TemperatureHistogram()
+    series = Series(['cpu'])
+    for t in [40.0, 50.0, 45.0]:
+        stats.push(t)
+        hist.push(t, 1.0)
+        series.append([round(t * 1000)])
+    latency = LatencyHistogram()
+    latency.push(20.0)
+    overhead = {
+        'ticks': 3, 'interval': 1.0, 'rate': 1.0, 'overruns': 0, 'missed': 0,
+        'read_us': latency.as_dict(), 'jitter_us': latency.as_dict(),
+        'cpu_user_s': 0.01, 'cpu_sys_s': 0.02, 'wall_s': 3.0,
+    }
+    report = Report(
+        stats, None, "0:00:03", fahrenheit=True, histogram=hist,
+        thresholds=[44.0], returncode=2, series=series, overhead=overhead
+    )
+    summary = report.as_dict(2)
+    assert summary['overhead']['read_us']['p99'] == 32
+    assert '"cpu_sys_s": 0.02' in export.to_json(summary)
+    assert summary['exit_code'] == 2 and summary['unit'] == "°F"
+    assert summary['stats']['max'] == pytest.approx(122.0)
+    assert summary['above'] == [
+        {'temp': pytest.approx(111.2), 'samples': 2, 'seconds': 2.0}
+    ]
+    assert summary['series'] == {'max': [104.0, 122.0]}
+    rows = export.to_csv(summary).splitlines()
+    assert rows[0] == "key,value"
+    assert "series.max.1,122.0" in rows and "exit_code,2" in rows
+    assert "overhead.ticks,3" in rows
+
+    path = str(tmp_path / "tmon.prom")
+    prom = export.PromTextfile(path, ['cpu{0}', 'gpu'], every=2)
+    prom.update([45000], stats, 1e9)
+    with open(path) as f:
+        text = f.read()
+    assert 'tmon_temperature_celsius{zone="cpu{0}"} 45.0' in text
+    assert 'tmon_temperature_celsius{zone="gpu"} NaN' in text
+    assert 'tmon_samples_total 3' in text
+    os.unlink(path)
+    prom.update([46000, 40000], stats, 1e9)  # batched
+    assert not os.path.exists(path)
+    prom.update([46000, 40000], stats, 1e9, lambda: overhead)
+    assert os.listdir(str(tmp_path)) == ["tmon.prom"]
+    with open(path) as f:
+        text = f.read()
+    assert 'tmon_sampler_ticks_total 3' in text
+    assert 'tmon_sampler_cpu_seconds_total{mode="system"} 0.02' in text
+
+
+def test_streaming_bucketer_keeps_spikes():
+    bucketer = StreamingBucketer(20)
+    for k in range(1001):
+        bucketer.push(90.0 if k == 777 else 45.0 + k % 3)
+    assert len(bucketer) == 1001
+    assert len(bucketer.counts) <= 40
+    maxs = bucketer.result(20)
+    assert len(maxs) == 20 and max(maxs) == 90.0
+    lower, upper = bucketer.result(20, 'band')
+    assert min(lower) == 45.0
+    assert abs(sum(bucketer.result(20, 'mean')) / 20 - 46.08) < 0.5
+
+
+def test_replay_reduce(tmp_path):
+    path = str(tmp_path / "raw.txt")
+    stats = RunningStats()
+    with open(path, 'w') as f:
+        writer = raw.TextWriter(f, ['cpu', 'gpu'], 1.0, 0.0)
+        for k in range(500):
+            row = [45000 + k, 40000 + 2 * k]
+            writer.write(row)
+            stats.push(max(row) * 0.001)
+    streamed, period = replay.reduce(path, 10, zones=['gpu'])
+    assert period == "0:08:19"
+    assert streamed.stats.count == stats.count
+    assert streamed.stats.max == streamed.zone_stats[1].max == 40.998
+    assert len(streamed.bucketer.result(10)) == 10
+    with pytest.raises(ValueError):
+        replay.reduce(path, 10, zones=['fan'])
+
+
+def test_heatmap():
+    np = pytest.importorskip('numpy')
+    hot = [40000] * 50 + [60000] * 50
+    cold = [30000] * 99 + [raw.MISSING]
+    assert heatmap.bucket([hot], 4) == [[40.0, 40.0, 60.0, 60.0]]
+    assert heatmap.bucket([cold], 4, 'mean')[0][-1] == 30.0
+    data = np.array([hot, cold], dtype=np.int32).T
+    rows = heatmap.bucket_rows(data, 4)
+    assert rows == [[40.0, 40.0, 60.0, 60.0], [30.0] * 4]
+    assert heatmap.bucket_rows(data, 4, selected=[1]) == rows[1:]
+    assert heatmap._bucket(hot, 4, 'max') == rows[0]
+    lines = heatmap.render(rows, ['cpu0', 'package_temp'], 30.0, 60.0)
+    lines = lines.split('\n')
+    assert lines[0] == '     cpu0 ▒▒██'
+    assert lines[1] == '…age_temp ░░░░'
+    assert lines[2].endswith('30.0 .. 60.0')
+    assert '\x1b[38;5;196m' in heatmap.render(rows, ['a', 'b'], color=True)
+
+
+def test_time_weighted_aggregates(tmp_path):
+    stats = RunningStats()
+    stats.push(40.0, 9.0)
+    stats.push(50.0, 1.0)
+    assert stats.count == 2 and stats.mean == pytest.approx(41.0)
+    assert stats.variance == pytest.approx(9.0)
+    bucketer = StreamingBucketer(4, 1.0)
+    bucketer.push(40.0, 6.0)
+    bucketer.push(90.0, 0.5)
+    bucketer.push(50.0, 1.5)
+    # 8 buckets of 1 s, 2 per point
+    assert bucketer.result(4) == [40.0, 40.0, 40.0, 90.0]
+    assert bucketer.result(4, 'mean')[-1] == pytest.approx(60.0)
+    # samples of an adaptive run: 4 s at 40 °C, then 1 s at 60 °C
+    path = str(tmp_path / "adaptive.bin")
+    with open(path, 'wb') as f:
+        writer = raw.BinaryWriter(f, ['cpu'], 0.5, 0.0, ceiling=4.0)
+        t0 = writer.clock.mono
+        writer.write([40000], t0)
+        writer.write([40000], t0 + 4.0)
+        writer.write([60000], t0 + 4.5)
+        writer.write([60000], t0 + 5.0)
+        writer.flush()
+    assert raw.open_raw(path).ceiling == 4.0
+    streamed, period = replay.reduce(path, 10)
+    assert period == "0:00:05"
+    assert streamed.stats.mean == pytest.approx(
+        (40.0 * 4.5 + 60.0 * 1.0) / 5.5
+    )
+    assert streamed.histogram.above(50.0) == (2, pytest.approx(1.0))
+    assert streamed.histogram.percentile(0.5) == pytest.approx(40.05)
@@ -5,3 +5,7 @@
 __author__ = """Goncalo Magno"""
 __email__ = 'goncalo@gmagno.dev'
 __version__ = '0.4.0'
+
+
+# cheap: tmon.background leaves the report machinery to its first report()
+from tmon.background import Monitor, monitor  # noqa: F401, E402
@@ -4,25 +4,76 @@
 changed. For details please check the repo.
 It was copied because asciichartpy is missig from the anaconda channels/repos
 and I did not care to upload it...
+
+The renderer draws into one preallocated byte buffer per chart instead of
+building lists of one character strings for every cell.
 """
 
 # -----------------------------------------------------------------------------
 
 from __future__ import division
+from codecs import charmap_decode
 from math import ceil, floor
+from numbers import Number
 
 # -----------------------------------------------------------------------------
 
+# Cells are drawn as single byte codes into one preallocated bytearray per
+# chart, and decoded to their box drawing characters row by row at the end.
+_GLYPHS = {
+    ' ': ' ', '-': '─', '|': '│', 'J': '╯', 'r': '╭', '7': '╮', 'L': '╰',
+    '#': '░',
+}
+_TABLE = ''.join(_GLYPHS.get(chr(i), chr(i)) for i in range(256))
+_SPACE, _H, _V, _UP0, _UP1, _DOWN0, _DOWN1, _SHADE = map(ord, ' -|Jr7L#')
+
+
+def _draw(buf, width, rows, ys):
+    """Draws the line through `ys` (row indices, 0 at the bottom) into `buf`.
+    """
+    y1 = ys[0]
+    for x in range(len(ys) - 1):
+        y0 = y1
+        y1 = ys[x + 1]
+        if y0 == y1:
+            buf[(rows - y0) * width + x] = _H
+        elif y0 > y1:
+            buf[(rows - y1) * width + x] = _DOWN1
+            buf[(rows - y0) * width + x] = _DOWN0
+            for y in range(y1 + 1, y0):
+                buf[(rows - y) * width + x] = _V
+        else:
+            buf[(rows - y1) * width + x] = _UP1
+            buf[(rows - y0) * width + x] = _UP0
+            for y in range(y0 + 1, y1):
+                buf[(rows - y) * width + x] = _V
+
+
+def column(y0, y1, rows):
+    """Returns, top to bottom, the `rows + 1` cells of the chart column that
+    joins a value at row `y0` to the next one at row `y1` (rows counted from
+    the bottom), as drawn by `plot`.
+    """
+    buf = bytearray(b' ' * (rows + 1))
+    _draw(buf, 1, rows, [y0, y1])
+    return charmap_decode(buf, None, _TABLE)[0]
+
 
 def plot(series, cfg=None):
-    """ Possible cfg parameters are 'minimum', 'maximum', 'offset', 'height' and
-    'format'.
+    """ Possible cfg parameters are 'minimum', 'maximum', 'offset', 'height',
+    'format' and 'lower'.
     cfg is a dictionary, thus dictionary syntax has to be used.
+    `series` is either a single series or a list of series, which are overlaid
+    in order in a single pass.
+    'lower' is a series of the same length as the (first) series; the band
+    between the two is shaded.
     Example: print(plot(series, { 'height' :10 }))
     """
     cfg = cfg or {}
-    minimum = cfg['minimum'] if 'minimum' in cfg else min(series)
-    maximum = cfg['maximum'] if 'maximum' in cfg else max(series)
+    if len(series) and isinstance(series[0], Number):
+        series = [series]
+    minimum = cfg['minimum'] if 'minimum' in cfg else min(map(min, series))
+    maximum = cfg['maximum'] if 'maximum' in cfg else max(map(max, series))
     if minimum > maximum:
         raise ValueError('The minimum value cannot exceed the maximum value.')
 
@@ -34,31 +85,31 @@ def plot(series, cfg=None):
     max2 = ceil(maximum * ratio)
 
     rows = max2 - min2
-    width = len(series) + offset
+    width = max(map(len, series))
     placeholder = cfg['format'] if 'format' in cfg else '{:8.2f} '
 
-    result = [[' '] * width for i in range(rows + 1)]
+    buf = bytearray(b' ' * (width * (rows + 1)))
+    axis = ['┼' if r + min2 == 0 else '┤' for r in range(rows + 1)]
 
-    # axis and labels
-    for y in range(min2, max2 + 1):
-        label = placeholder.format(maximum - ((y - min2) * interval / rows))
-        result[y - min2][max(offset - len(label), 0)] = label
-        result[y - min2][offset - 1] = '┼' if y == 0 else '┤'
+    for s in series:
+        ys = [int(v * ratio) - min2 for v in s]
+        axis[rows - int(s[0] * ratio - min2)] = '┼'  # first value
+        _draw(buf, width, rows, ys)
 
-    y0 = int(series[0] * ratio - min2)
-    result[rows - y0][offset - 1] = '┼'  # first value
+    if 'lower' in cfg:  # shade the band between the lower and upper series
+        for x, (lo, hi) in enumerate(zip(cfg['lower'], series[0])):
+            for y in range(int(lo * ratio) - min2, int(hi * ratio) - min2):
+                i = (rows - y) * width + x
+                if buf[i] == _SPACE:
+                    buf[i] = _SHADE
 
-    for x in range(len(series) - 1):  # plot the line
-        y0 = int(series[x + 0] * ratio) - min2
-        y1 = int(series[x + 1] * ratio) - min2
-        if y0 == y1:
-            result[rows - y0][x + offset] = '─'
-        else:
-            result[rows - y1][x + offset] = '╰' if y0 > y1 else '╭'
-            result[rows - y0][x + offset] = '╮' if y0 > y1 else '╯'
-            start = min(y0, y1) + 1
-            end = max(y0, y1)
-            for y in range(start, end):
-                result[rows - y][x + offset] = '│'
-
-    return '\n'.join([''.join(row) for row in result])
+    # axis and labels
+    lines = []
+    for r in range(rows + 1):
+        label = placeholder.format(maximum - (r * interval / rows))
+        prefix = [' '] * offset
+        prefix[max(offset - len(label), 0)] = label
+        prefix[offset - 1] = axis[r]
+        row, _ = charmap_decode(buf[r * width:(r + 1) * width], None, _TABLE)
+        lines.append(''.join(prefix) + row)
+    return '\n'.join(lines)
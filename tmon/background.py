@@ -0,0 +1,203 @@
+# -*- coding: utf-8 -*-
+
+"""In-process monitoring from a background thread.
+
+    import tmon
+
+    with tmon.monitor(interval=0.1) as m:
+        work()
+    print(m.stats.max, m.report())
+
+    @tmon.monitor(interval=0.1)
+    def work():
+        ...
+"""
+
+from array import array
+import datetime
+import functools
+import threading
+import time
+
+from tmon.scheduler import Scheduler
+from tmon.sensors import Sensors
+from tmon.series import Series
+from tmon.stats import RunningStats
+from tmon.utils import import_numpy
+
+
+class Monitor:
+    """Samples the temperature sensors in a daemon thread while in use as a
+    context manager or while a decorated function runs.
+
+    The thread waits on an `Event` between ticks and a tick is a few preads of
+    already open sensor files, so it holds the GIL for microseconds at a time
+    (ticks may be late by up to `sys.getswitchinterval()` while the monitored
+    code holds it). Samples go to a `Series` (one `array('i')` of millidegrees
+    per zone) and the tick times to an `array('d')`. Samples of all the times
+    the monitor was used, e.g. of every call of a decorated function, add up.
+    `column()` returns the arrays themselves while the monitor is stopped and
+    copies while it runs, as the thread appends to them. Starting and
+    stopping are thread safe, so several threads may use the same monitor.
+    An error reading the sensors stops the sampling and is raised again by
+    `stop()` (i.e. when leaving the outermost use) and by `report()`.
+    """
+
+    def __init__(self, interval=1.0, sysfs_root='/', sensors=('thermal',)):
+        self.interval = interval
+        self.sysfs_root = sysfs_root
+        self.backends = sensors
+        self.series = None
+        self.times = array('d')  # tick times since the first start, in s
+        self.stats = RunningStats()  # of the hottest zone at each tick
+        self.sensors = None
+        self.scheduler = None
+        self.started = None  # wall clock time of the first start
+        self.error = None  # exception that stopped the sampling, if any
+        self._t0 = None
+        self._depth = 0  # nesting level of with blocks and decorated calls
+        self._thread = None
+        self._stop = threading.Event()
+        self._lock = threading.Lock()  # of the samples
+        self._state = threading.Lock()  # of _depth, _thread and sensors
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, *exc):
+        self.stop()
+
+    def __call__(self, func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with self:
+                return func(*args, **kwargs)
+        return wrapper
+
+    @property
+    def running(self):
+        return self._thread is not None and self._thread.is_alive()
+
+    def start(self):
+        """Starts sampling, unless already started by an enclosing use.
+        """
+        with self._state:
+            self._depth += 1
+            if self._depth > 1:
+                return
+            self.sensors = Sensors(self.sysfs_root, self.backends)
+            if self.series is None:
+                self.series = Series(self.sensors.names)
+                self.started = datetime.datetime.now()
+                self._t0 = time.monotonic()
+            self.scheduler = Scheduler(self.interval)
+            self.error = None
+            self._stop.clear()
+            self._thread = threading.Thread(
+                target=self._run, name="tmon", daemon=True
+            )
+            self._thread.start()
+
+    def stop(self):
+        """Stops sampling, when leaving the outermost use.
+        """
+        with self._state:
+            if self._depth == 0:
+                raise RuntimeError("tmon monitor stopped but not started")
+            self._depth -= 1
+            if self._depth > 0:
+                return
+            self._stop.set()
+            self._thread.join()
+            self._thread = None
+            self.sensors.close()
+            if self.error is not None:
+                raise self.error
+
+    def _run(self):
+        sensors, scheduler = self.sensors, self.scheduler
+        ntemps = sensors.ntemps
+        scheduler.start()
+        try:
+            while True:
+                scheduler.tick()
+                tmps = sensors.read()[:ntemps]
+                with self._lock:
+                    self.series.append(tmps)
+                    self.times.append(scheduler.last - self._t0)
+                    self.stats.push(max(tmps) * 0.001)
+                if self._stop.wait(scheduler.next_timeout()):
+                    break
+        except Exception as e:  # kept for the monitored thread to raise
+            self.error = e
+
+    def __len__(self):
+        return len(self.times)
+
+    def _check_started(self):
+        if self.series is None:
+            raise RuntimeError(
+                "tmon monitor has no samples, it was never started"
+            )
+
+    def column(self, i):
+        """Returns the samples of zone `i`, in millidegrees, as an `array('i')`
+        (the array itself while stopped, a copy while running).
+        """
+        self._check_started()
+        with self._lock:
+            col = self.series.columns[i]
+            return array('i', col) if self.running else col
+
+    def numpy(self):
+        """Returns the samples as a `(samples, zones)` NumPy array of degrees
+        and the tick times in seconds, both copies, so they don't change as
+        the monitor goes on sampling. Needs NumPy.
+        """
+        np = import_numpy()
+        if np is None:
+            raise ImportError("tmon.Monitor.numpy() needs NumPy installed")
+        self._check_started()
+        with self._lock:
+            n = len(self.times)
+            temps = np.empty((n, len(self.series.zones)))
+            for i, col in enumerate(self.series.columns):
+                temps[:, i] = np.frombuffer(col, dtype='i4', count=n)
+            times = np.array(self.times)
+        return temps * 0.001, times
+
+    def report(
+        self, xsize=70, ysize=15, ylim=None, fahrenheit=False, zones=None,
+        downsample='max'
+    ):
+        """Returns the report of the samples so far, see `tmon.tmon.Report`.
+        """
+        from tmon.tmon import Report  # the bulk of tmon, only needed here
+        self._check_started()
+        if self.error is not None:
+            raise self.error
+        with self._lock:
+            series = Series(
+                self.series.zones, [array('i', c) for c in self.series.columns]
+            )
+            stats = self._stats_copy()
+            period = self.times[-1] if self.times else 0.0
+        report = Report(
+            stats, None, str(datetime.timedelta(seconds=round(period))),
+            fahrenheit=fahrenheit, tick_us=self.sensors.mean_tick_us,
+            scheduler=self.scheduler, zones=zones, downsample=downsample,
+            series=series
+        )
+        return report.report(xsize, ysize, ylim)
+
+    def _stats_copy(self):
+        ret = RunningStats()
+        ret.merge(self.stats)
+        return ret
+
+
+def monitor(interval=1.0, **kwargs):
+    """Returns a `Monitor`, to use as a context manager or a decorator.
+    """
+    return Monitor(interval, **kwargs)
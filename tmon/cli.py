@@ -8,7 +8,10 @@ import platform
 import textwrap
 import sys
 
-from tmon import tmon
+from tmon import downsample, export, guard, rotate, sensors, tmon
+
+
+MIN_INTERVAL = 0.01
 
 
 class AxisSizeAction(argparse.Action):
@@ -21,6 +24,119 @@ class AxisSizeAction(argparse.Action):
         setattr(namespace, self.dest, values)
 
 
+class IntervalAction(argparse.Action):
+
+    def __call__(self, parser, namespace, values, option_string=None):
+        if values < MIN_INTERVAL:
+            parser.error(
+                "Minimum sampling interval for {0} is {1} s".format(
+                    option_string, MIN_INTERVAL
+                )
+            )
+        setattr(namespace, self.dest, values)
+
+
+class SensorsAction(argparse.Action):
+
+    def __call__(self, parser, namespace, values, option_string=None):
+        names = [v for v in values.split(',') if v]
+        unknown = [v for v in names if v not in sensors.BACKENDS]
+        if unknown or not names:
+            parser.error(
+                "{0} takes a comma separated list of: {1}".format(
+                    option_string, ','.join(sorted(sensors.BACKENDS))
+                )
+            )
+        setattr(namespace, self.dest, tuple(names))
+
+
+class PositiveIntAction(argparse.Action):
+
+    def __call__(self, parser, namespace, values, option_string=None):
+        if values < 1:
+            parser.error("{0} must be at least 1".format(option_string))
+        setattr(namespace, self.dest, values)
+
+
+class GuardAction(argparse.Action):
+
+    def __call__(self, parser, namespace, values, option_string=None):
+        pause, _, resume = values.partition(':')
+        try:
+            guard = float(pause), float(resume) if resume else None
+        except ValueError:
+            parser.error("{0} takes MAX[:RESUME] temperatures".format(
+                option_string
+            ))
+        if guard[1] is not None and guard[1] > guard[0]:
+            parser.error("{0} RESUME must not be above MAX".format(
+                option_string
+            ))
+        setattr(namespace, self.dest, guard)
+
+
+class ZonesAction(argparse.Action):
+
+    def __call__(self, parser, namespace, values, option_string=None):
+        selectors = [v for v in values.split(',') if v]
+        if not selectors:
+            parser.error(
+                "{0} takes a comma separated list of zones".format(
+                    option_string
+                )
+            )
+        setattr(namespace, self.dest, selectors)
+
+
+class StatsAction(argparse.Action):
+
+    def __call__(self, parser, namespace, values, option_string=None):
+        names = [v for v in values.split(',') if v]
+        if not names or any(v not in tmon.STATS for v in names):
+            parser.error(
+                "{0} takes a comma separated list of: {1}".format(
+                    option_string, ','.join(tmon.STATS)
+                )
+            )
+        setattr(namespace, self.dest, tuple(names))
+
+
+class ThresholdsAction(argparse.Action):
+
+    def __call__(self, parser, namespace, values, option_string=None):
+        try:
+            temps = tuple(float(v) for v in values.split(','))
+        except ValueError:
+            parser.error("{0} takes comma separated temperatures".format(
+                option_string
+            ))
+        setattr(namespace, self.dest, temps)
+
+
+class SizeAction(argparse.Action):
+
+    def __call__(self, parser, namespace, values, option_string=None):
+        try:
+            setattr(namespace, self.dest, rotate.parse_size(values))
+        except ValueError:
+            parser.error(
+                "{0} takes a size in bytes, with an optional k, M or G "
+                "suffix".format(option_string)
+            )
+
+
+class DurationAction(argparse.Action):
+
+    def __call__(self, parser, namespace, values, option_string=None):
+        try:
+            setattr(namespace, self.dest, rotate.parse_duration(values))
+        except ValueError:
+            parser.error(
+                "{0} takes a duration in seconds, with an optional s, m, h "
+                "or d suffix".format(option_string)
+            )
+
+
 def parse_args():
     description = textwrap.dedent("""
         Temperature Monitor (tmon v0.4.0) -- executes a program while
@@ -60,6 +176,7 @@ def parse_args():
                 avg: 51.0 °C
                 max: 51.0 °C
 
+                tick: 38.2 µs
                 raw: /tmp/tmon-YYYYMMDD@HHhMMmSS-XXXXXXXX.txt
             ===================
 
@@ -92,6 +209,10 @@ def parse_args():
                 avg: 49.1 °C
                 max: 52.0 °C
 
+                tick: 41.5 µs
+                rate: 1.00 Hz (interval 1 s)
+                jitter: 0.09 ms avg, 0.21 ms max
+                overshoot: 0 overruns, 0 missed ticks
                 raw: /tmp/tmon-YYYYMMDD@HHhMMmSS-XXXXXXXX.txt
             ===================
 
@@ -195,7 +316,239 @@ def parse_args():
             "measured temperatures fall outside the specified range."
         )
     )
+    parser.add_argument(
+        "-i", "--interval", required=False, default=1.0, type=float,
+        metavar='SECONDS', action=IntervalAction, help=(
+            "sampling interval in seconds, down to {} s. Samples are taken "
+            "on a fixed schedule so the period does not drift".format(
+                MIN_INTERVAL
+            )
+        )
+    )
+    parser.add_argument(
+        "--adaptive", required=False, default=None, metavar='DURATION',
+        action=DurationAction, help=(
+            "samples adaptively: the interval shrinks down to --interval "
+            "while the temperature changes fast and grows up to DURATION "
+            "(e.g. 30s or 5m) while it is stable, the stats and chart being "
+            "weighted by time. Ignored with --tmond"
+        )
+    )
+    parser.add_argument(
+        "--raw-format", required=False, default='text',
+        choices=['text', 'binary'], help=(
+            "format of the raw data file: one text line per tick (the "
+            "default) or a compact binary file of int32 records with a header "
+            "holding the sensor names, the interval and the start time"
+        )
+    )
+    parser.add_argument(
+        "-z", "--zones", required=False, metavar='ZONE[,ZONE...]',
+        action=ZonesAction, help=(
+            "comma separated zones to chart and report stats for, each given "
+            "by index, type (e.g. x86_pkg_temp) or glob pattern (e.g. "
+            "'cpu*'). The series of the selected zones are overlaid in the "
+            "chart"
+        )
+    )
+    parser.add_argument(
+        "-d", "--downsample", required=False, default='max',
+        choices=downsample.MODES, help=(
+            "how samples are aggregated into chart columns when there are "
+            "more samples than columns: the max (the default, keeps the "
+            "spikes), min or mean of every column, LTTB, or a min-max band"
+        )
+    )
+    parser.add_argument(
+        "--chart", required=False, default='line', choices=tmon.CHARTS,
+        help=(
+            "chart of the report: a line chart of the hottest zone, or of "
+            "the --zones overlaid (the default), or a heatmap with a row per "
+            "zone (every zone, or the --zones) and a cell per time bucket, "
+            "e.g. for per core sensors of many core machines"
+        )
+    )
+    parser.add_argument(
+        "--color", required=False, action='store_true',
+        help="draws the heatmap in 256-colour ANSI instead of shades"
+    )
+    parser.add_argument(
+        "--live", required=False, action='store_true', help=(
+            "redraws a chart and stats of the last samples in place on "
+            "stderr while the program runs"
+        )
+    )
+    parser.add_argument(
+        "--refresh", required=False, default=0.5, type=float,
+        metavar='SECONDS', help="live mode refresh interval (default 0.5 s)"
+    )
+    parser.add_argument(
+        "--window", required=False, default=600, type=int,
+        metavar='SAMPLES', action=PositiveIntAction, help=(
+            "number of samples kept and shown in live mode (default 600)"
+        )
+    )
+    parser.add_argument(
+        "--alt-screen", required=False, action='store_true',
+        help="draws the live mode dashboard in the terminal alternate screen"
+    )
+    parser.add_argument(
+        "--overhead", required=False, action='store_true', help=(
+            "adds a sampler overhead section to the report: CPU time used by "
+            "%(prog)s and histograms of the sensor read latency and of the "
+            "tick lateness against schedule"
+        )
+    )
+    parser.add_argument(
+        "--stats", required=False, default=tmon.DEFAULT_STATS,
+        metavar='SECTION[,SECTION...]', action=StatsAction, help=(
+            "sections of the temperature stats in the report: minmax (min, "
+            "avg and max), percentiles (p50, p90 and p99), above (time spent "
+            "above the --above temperatures) and histogram (0.1 degree bins "
+            "grouped in rows). Default: minmax,percentiles,above"
+        )
+    )
+    parser.add_argument(
+        "--above", required=False, default=(), metavar='TEMP[,TEMP...]',
+        action=ThresholdsAction, help=(
+            "temperatures to report the time spent at or above of, in °F "
+            "with -f"
+        )
+    )
+    parser.add_argument(
+        "--output", required=False, default='text', choices=export.FORMATS,
+        help=(
+            "format of the report: text (the default), or JSON or CSV "
+            "(key,value rows) holding the stats, the series downsampled to "
+            "--xsize points, the sampling and the exit status of the program"
+        )
+    )
+    parser.add_argument(
+        "--prom-textfile", required=False, metavar='PATH', help=(
+            "writes gauges of the run (last temperature of every zone, max "
+            "and mean temperatures, samples) to PATH, a node_exporter "
+            "textfile (e.g. .../textfile/tmon.prom), replaced atomically "
+            "every --prom-every ticks"
+        )
+    )
+    parser.add_argument(
+        "--prom-every", required=False, default=export.PROM_EVERY, type=int,
+        metavar='TICKS', action=PositiveIntAction, help=(
+            "ticks between rewrites of the --prom-textfile (default {})"
+        ).format(export.PROM_EVERY)
+    )
+    parser.add_argument(
+        "--sensors", required=False, default=('thermal', 'throttle'),
+        metavar='BACKEND[,BACKEND...]', action=SensorsAction, help=(
+            "sensor backends sampled in the same tick: thermal (thermal "
+            "zones), hwmon (hwmon temperature inputs), cpufreq (mean CPU "
+            "frequency), rapl (package power from the RAPL energy counters) "
+            "and throttle (thermal throttle events, marked under the chart). "
+            "Only temperatures are charted and written to the raw file, the "
+            "others are summarised in the stats. Default: thermal,throttle"
+        )
+    )
+    parser.add_argument(
+        "--sysfs-root", required=False, default='/', metavar='PATH',
+        help="root the sensors are looked up below (default /)"
+    )
+    parser.add_argument(
+        "--cooldown-to", required=False, type=float, metavar='TEMP', help=(
+            "before running the program, waits (still sampling) until the "
+            "hottest zone is below TEMP, in °F with -f"
+        )
+    )
+    parser.add_argument(
+        "--repeat", required=False, default=1, type=int, metavar='N',
+        action=PositiveIntAction, help=(
+            "runs the program N times, each run behind the --cooldown-to "
+            "gate and with its own samples and report, followed by a summary "
+            "of per run and aggregate temperatures and wall times. Stops at "
+            "the first run that fails"
+        )
+    )
+    parser.add_argument(
+        "--guard", required=False, metavar='MAX[:RESUME]',
+        action=GuardAction, help=(
+            "pauses the program (SIGSTOP to its process group) when the "
+            "hottest zone reaches MAX and resumes it (SIGCONT) once it drops "
+            "below RESUME, by default {:g} °C below MAX. Temperatures are in "
+            "°F with -f. Paused intervals are marked under the chart and "
+            "reported. The program then runs in its own process group, so it "
+            "should not read from the terminal".format(guard.RESUME_MARGIN)
+        )
+    )
+    parser.add_argument(
+        "--tmond", required=False, action='store_true', help=(
+            "reads the samples of a running tmond, the sampling daemon "
+            "shared by concurrent invocations (see tmond -h), instead of the "
+            "sensors. Samples locally when there is no tmond running"
+        )
+    )
+    parser.add_argument(
+        "--output-dir", required=False, metavar='DIR', help=(
+            "directory the raw data is written to, created if needed "
+            "(default: the temporary directory, e.g. /tmp)"
+        )
+    )
+    parser.add_argument(
+        "--rotate-size", required=False, metavar='SIZE', action=SizeAction,
+        help=(
+            "bounds the raw data of long runs: starts a new segment of the "
+            "raw file once the current one holds SIZE bytes (e.g. 64M), "
+            "compressing the closed ones. The report is then built from "
+            "aggregates kept while sampling instead of from the raw data"
+        )
+    )
+    parser.add_argument(
+        "--rotate-time", required=False, metavar='DURATION',
+        action=DurationAction, help=(
+            "as --rotate-size, starting a new segment once the current one "
+            "is DURATION old (e.g. 12h, 7d)"
+        )
+    )
+    parser.add_argument(
+        "--rotate-keep", required=False, type=int, metavar='N',
+        action=PositiveIntAction, help=(
+            "with --rotate-size or --rotate-time, keeps only the last N "
+            "closed segments, removing older ones, so the raw data of runs "
+            "of any length takes bounded disk space (default: keeps all)"
+        )
+    )
+    parser.add_argument(
+        "--compress", required=False, default='gzip',
+        choices=sorted(rotate.COMPRESSORS), help=(
+            "compression of the closed segments of rotated raw data (default "
+            "gzip). Compressed files can be replayed as they are"
+        )
+    )
+    parser.add_argument(
+        "--replay", nargs='+', required=False, metavar='FILE', help=(
+            "re-renders the report of existing raw files (text or binary) "
+            "instead of running a program, e.g. with a different --xsize, "
+            "--ylim or -f. Files are streamed in a single pass"
+        )
+    )
+    parser.add_argument(
+        "--merge", nargs='+', required=False, metavar='FILE', help=(
+            "merges the raw files of many hosts (or the segments of rotated "
+            "runs) on the wall clock times of their samples, in a single "
+            "streaming pass, and reports the stats and chart of every host "
+            "and the stats of the whole fleet"
+        )
+    )
+    parser.add_argument(
+        "--bucket", required=False, metavar='DURATION',
+        action=DurationAction, help=(
+            "duration of the time aligned buckets of --merge, one chart point "
+            "each (default: the longest sampling interval of the files)"
+        )
+    )
     args = vars(parser.parse_args())
+    if args['adaptive'] is not None and args['adaptive'] < args['interval']:
+        parser.error("--adaptive must not be below the sampling interval")
+    if args['command'][:1] == ['--']:  # e.g. tmon --stats minmax -- CMD
+        args['command'] = args['command'][1:]
     return args
 
 
@@ -215,11 +568,50 @@ def main():
         """.format(platform.system())))
         return 1
 
+    if kwargs['replay']:
+        return tmon.replay(
+            kwargs['replay'],
+            xsize=kwargs['xsize'], ysize=kwargs['ysize'], ylim=kwargs['ylim'],
+            fahrenheit=kwargs['fahrenheit'], stats_only=kwargs['stats_only'],
+            chart_only=kwargs['chart_only'], path_only=kwargs['path_only'],
+            zones=kwargs['zones'], downsample=kwargs['downsample'],
+            show_stats=kwargs['stats'], thresholds=kwargs['above'],
+            output=kwargs['output'], chart=kwargs['chart'],
+            color=kwargs['color']
+        )
+
+    if kwargs['merge']:
+        return tmon.merge(
+            kwargs['merge'],
+            xsize=kwargs['xsize'], ysize=kwargs['ysize'], ylim=kwargs['ylim'],
+            fahrenheit=kwargs['fahrenheit'], stats_only=kwargs['stats_only'],
+            chart_only=kwargs['chart_only'], path_only=kwargs['path_only'],
+            zones=kwargs['zones'], downsample=kwargs['downsample'],
+            bucket=kwargs['bucket'], show_stats=kwargs['stats'],
+            thresholds=kwargs['above'], output=kwargs['output'],
+            chart=kwargs['chart'], color=kwargs['color']
+        )
+
     return tmon.run(
         cmd=kwargs['command'],
         xsize=kwargs['xsize'], ysize=kwargs['ysize'], ylim=kwargs['ylim'],
         fahrenheit=kwargs['fahrenheit'], stats_only=kwargs['stats_only'],
-        chart_only=kwargs['chart_only'], path_only=kwargs['path_only']
+        chart_only=kwargs['chart_only'], path_only=kwargs['path_only'],
+        interval=kwargs['interval'], raw_format=kwargs['raw_format'],
+        zones=kwargs['zones'], downsample=kwargs['downsample'],
+        live=kwargs['live'], refresh=kwargs['refresh'],
+        window=kwargs['window'], alt_screen=kwargs['alt_screen'],
+        overhead=kwargs['overhead'], sensors=kwargs['sensors'],
+        sysfs_root=kwargs['sysfs_root'], cooldown_to=kwargs['cooldown_to'],
+        repeat=kwargs['repeat'], guard=kwargs['guard'],
+        tmond=kwargs['tmond'], output_dir=kwargs['output_dir'],
+        rotate_size=kwargs['rotate_size'], rotate_time=kwargs['rotate_time'],
+        rotate_keep=kwargs['rotate_keep'], compressor=kwargs['compress'],
+        show_stats=kwargs['stats'], thresholds=kwargs['above'],
+        output=kwargs['output'],
+        prom_textfile=kwargs['prom_textfile'], prom_every=kwargs['prom_every'],
+        chart=kwargs['chart'], color=kwargs['color'],
+        adaptive=kwargs['adaptive']
     )
 
 
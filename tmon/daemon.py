@@ -0,0 +1,290 @@
+# -*- coding: utf-8 -*-
+
+"""tmond, a sampling daemon shared by concurrent tmon invocations.
+
+The daemon samples the temperature sensors into a ring buffer in a memory
+mapped file (in /dev/shm by default) and every `tmon --tmond` attaches to
+it, records the samples from the start to the exit of its program and
+reads no sensors itself. Clients fall back to local sampling when no daemon
+is running, or when it goes away.
+
+File layout: a header (`HEADER`), the number of samples written so far
+(`HEAD`), the zone names (as in binary raw files) and `capacity` records of
+the monotonic time of the tick and one int32 per zone, padded to 8 bytes.
+The single writer fills a record before advancing the head, and readers
+drop records that the writer may have overwritten while they were copying
+them, so no locking is needed.
+"""
+
+import argparse
+import mmap
+import os
+import signal
+import struct
+import sys
+import tempfile
+import time
+
+from tmon import raw
+from tmon.scheduler import Scheduler
+from tmon.sensors import Sensors
+
+MAGIC = b'TMOD'
+VERSION = 1
+# magic, version, number of zones, capacity, interval and pid of the daemon
+HEADER = struct.Struct('<4sHHIdi')
+HEAD = struct.Struct('<Q')
+HEAD_OFFSET = 24  # 8 byte aligned
+TIME = struct.Struct('<d')
+CAPACITY = 4096
+STALE_TICKS = 5  # a daemon that missed this many ticks is considered gone
+
+
+def default_path():
+    """Returns the path of the ring buffer file: `$TMOND_PATH`, or a per user
+    file in /dev/shm (or the temporary directory without /dev/shm).
+    """
+    if os.environ.get('TMOND_PATH'):
+        return os.environ['TMOND_PATH']
+    base = '/dev/shm' if os.path.isdir('/dev/shm') else tempfile.gettempdir()
+    return os.path.join(base, "tmond-{}".format(os.getuid()))
+
+
+def _layout(zones):
+    names = b''.join(
+        raw.NAME_LEN.pack(len(z.encode('utf-8'))) + z.encode('utf-8')
+        for z in zones
+    )
+    offset = HEAD_OFFSET + HEAD.size + len(names)
+    offset += -offset % 8
+    record = TIME.size + raw.ITEMSIZE * len(zones)
+    return names, offset, record + -record % 8
+
+
+class RingWriter:
+    """Writes samples to a new ring buffer file at `path`, replacing any
+    previous one atomically. Closing removes the file, unless another writer
+    has replaced it meanwhile.
+    """
+
+    def __init__(self, path, zones, interval, capacity=CAPACITY):
+        self.path = path
+        self.nzones = len(zones)
+        self.capacity = capacity
+        names, self.offset, self.record = _layout(zones)
+        self.fmt = struct.Struct('<d{}i'.format(self.nzones))
+        size = self.offset + capacity * self.record
+        fd, tmp = tempfile.mkstemp(dir=os.path.dirname(path) or '.')
+        try:
+            os.ftruncate(fd, size)
+            self._mm = mmap.mmap(fd, size)
+            st = os.fstat(fd)
+            self._id = st.st_dev, st.st_ino
+        finally:
+            os.close(fd)
+        HEADER.pack_into(
+            self._mm, 0, MAGIC, VERSION, self.nzones, capacity, interval,
+            os.getpid()
+        )
+        start = HEAD_OFFSET + HEAD.size
+        self._mm[start:start + len(names)] = names
+        self.head = 0
+        os.rename(tmp, path)
+
+    def append(self, t, values):
+        """Appends the `values` sampled at monotonic time `t`.
+        """
+        values = values[:self.nzones]
+        if len(values) < self.nzones:
+            values = values + [raw.MISSING] * (self.nzones - len(values))
+        slot = self.offset + (self.head % self.capacity) * self.record
+        self.fmt.pack_into(self._mm, slot, t, *values)
+        self.head += 1
+        HEAD.pack_into(self._mm, HEAD_OFFSET, self.head)
+
+    def close(self):
+        try:
+            st = os.stat(self.path)
+            if (st.st_dev, st.st_ino) == self._id:
+                os.unlink(self.path)
+        except FileNotFoundError:
+            pass
+        self._mm.close()
+
+
+class RingReader:
+    """Reads the samples a daemon writes to the ring buffer file at `path`.
+    Raises `OSError` or `ValueError` if there is no valid file.
+    """
+
+    def __init__(self, path):
+        with open(path, 'rb') as f:
+            self._mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        try:
+            magic, version, nzones, capacity, self.interval, self.pid = \
+                HEADER.unpack_from(self._mm)
+            if magic != MAGIC or version != VERSION:
+                raise ValueError("{}: not a tmond ring buffer".format(path))
+        except (struct.error, ValueError):
+            self._mm.close()
+            raise
+        self.nzones = nzones
+        self.capacity = capacity
+        self.zones = []
+        offset = HEAD_OFFSET + HEAD.size
+        for _ in range(nzones):
+            n, = raw.NAME_LEN.unpack_from(self._mm, offset)
+            offset += raw.NAME_LEN.size
+            self.zones.append(self._mm[offset:offset + n].decode('utf-8'))
+            offset += n
+        _, self.offset, self.record = _layout(self.zones)
+        self.fmt = struct.Struct('<d{}i'.format(nzones))
+        self.cursor = self._head()
+        self.lost = 0  # samples overwritten before they could be read
+
+    def _head(self):
+        return HEAD.unpack_from(self._mm, HEAD_OFFSET)[0]
+
+    def _slot(self, i):
+        return self.fmt.unpack_from(
+            self._mm, self.offset + (i % self.capacity) * self.record
+        )
+
+    def attach(self):
+        """Skips to the samples written from now on.
+        """
+        self.cursor = self._head()
+
+    def read(self):
+        """Returns the rows of the samples written since the last read.
+        """
+        return [row for _, row in self.read_timed()]
+
+    def read_timed(self):
+        """Returns the monotonic time and the row of the samples written
+        since the last read.
+        """
+        head = self._head()
+        start = max(self.cursor, head - self.capacity)
+        rows = []
+        for i in range(start, head):
+            slot = self._slot(i)
+            rows.append((slot[0], list(slot[1:])))
+        # records the writer may have been reusing while these were copied
+        overwritten = self._head() - self.capacity + 1 - start
+        if overwritten > 0:
+            rows = rows[overwritten:]
+            start += overwritten
+        self.lost += start - self.cursor
+        self.cursor = head
+        return rows
+
+    def latest(self):
+        """Returns the row of the last sample, or None if there is none.
+        """
+        head = self._head()
+        return list(self._slot(head - 1)[1:]) if head else None
+
+    def alive(self):
+        """Whether the daemon is still running and sampling.
+        """
+        try:
+            os.kill(self.pid, 0)
+        except ProcessLookupError:
+            return False
+        except PermissionError:  # someone else's process
+            pass
+        head = self._head()
+        if not head:
+            return True
+        last = self._slot(head - 1)[0]
+        stale = max(STALE_TICKS * self.interval, 1.0)
+        return time.monotonic() - last < stale
+
+    def close(self):
+        self._mm.close()
+
+
+def attach(path=None):
+    """Returns a `RingReader` attached to a running daemon, or None if there
+    is none.
+    """
+    try:
+        reader = RingReader(path or default_path())
+    except (OSError, ValueError, struct.error):
+        return None
+    if not reader.alive():
+        reader.close()
+        return None
+    return reader
+
+
+def serve(
+    path, interval=1.0, capacity=CAPACITY, sysfs_root='/',
+    sensors=('thermal',)
+):
+    """Samples the temperature sensors into the ring buffer at `path` until
+    SIGINT or SIGTERM.
+    """
+    def stop(sig, frame):
+        raise SystemExit(0)
+
+    signal.signal(signal.SIGTERM, stop)
+    scheduler = Scheduler(interval)
+    with Sensors(sysfs_root, sensors) as s:
+        writer = RingWriter(path, s.names, interval, capacity)
+        try:
+            scheduler.start()
+            while True:
+                scheduler.tick()
+                writer.append(scheduler.last, s.read()[:s.ntemps])
+                scheduler.sleep()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            writer.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        prog="tmond", description=(
+            "Samples the CPU temperature sensors into a shared ring buffer "
+            "that concurrent `tmon --tmond` invocations read from, instead "
+            "of each one polling the sensors."
+        )
+    )
+    parser.add_argument(
+        "-i", "--interval", default=1.0, type=float, metavar='SECONDS',
+        help="sampling interval in seconds (default 1.0)"
+    )
+    parser.add_argument(
+        "--capacity", default=CAPACITY, type=int, metavar='SAMPLES',
+        help="samples kept in the ring buffer (default {})".format(CAPACITY)
+    )
+    parser.add_argument(
+        "--path", default=None, metavar='PATH', help=(
+            "ring buffer file, by default $TMOND_PATH or {}".format(
+                default_path()
+            )
+        )
+    )
+    parser.add_argument(
+        "--sensors", default='thermal', metavar='BACKEND[,BACKEND...]',
+        help="temperature sensor backends: thermal (default) and hwmon"
+    )
+    parser.add_argument(
+        "--sysfs-root", default='/', metavar='PATH',
+        help="root the sensors are looked up below (default /)"
+    )
+    args = parser.parse_args()
+    if args.interval <= 0 or args.capacity < 2:
+        parser.error("the interval and capacity must be positive")
+    serve(
+        args.path or default_path(), args.interval, args.capacity,
+        args.sysfs_root, tuple(args.sensors.split(','))
+    )
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())  # pragma: no cover
@@ -0,0 +1,219 @@
+# -*- coding: utf-8 -*-
+
+"""Downsampling of temperature series to a fixed number of chart columns.
+
+The series is split in `width` consecutive buckets of (almost) equal size and
+every bucket is reduced to a single value, so the result has exactly `width`
+points and spikes are kept by the `max` (and `band`) modes instead of being
+skipped over by striding. NumPy is used when available.
+"""
+
+from bisect import bisect_right
+from operator import add
+
+from tmon.utils import import_numpy
+
+
+MODES = ('max', 'min', 'mean', 'lttb', 'band')
+
+
+def edges(n, width):
+    """Returns the `width + 1` bucket boundaries for a series of length `n`.
+    """
+    return [i * n // width for i in range(width + 1)]
+
+
+def columns(indices, n, width):
+    """Returns the set of buckets, of a series of length `n` split in `width`
+    buckets, holding the samples at `indices`.
+    """
+    e = edges(n, width) if n > width else range(n + 1)
+    return {bisect_right(e, i) - 1 for i in indices if 0 <= i < n}
+
+
+def time_positions(elapsed, steps):
+    """Returns a function mapping the index of a sample to its position in a
+    series of `steps` points evenly spaced in time, for samples ending
+    `elapsed[i]` seconds after the start (e.g. those of an adaptive run,
+    whose chart is evenly spaced in time), so that `columns()` can place
+    them. Indices past the last sample map to `steps`.
+    """
+    total = elapsed[-1] if elapsed else 0.0
+
+    def position(i):
+        if i >= len(elapsed) or not total:
+            return steps
+        start = elapsed[i - 1] if i else 0.0
+        return min(int(start / total * steps), steps - 1)
+    return position
+
+
+def _reduce(series, width, func):
+    e = edges(len(series), width)
+    return [func(series[a:b]) for a, b in zip(e, e[1:])]
+
+
+def _mean(xs):
+    return sum(xs) / len(xs)
+
+
+def _np_reduce(np, series, width, mode):
+    a = np.asarray(series, dtype=float)
+    starts = np.array(edges(len(a), width)[:-1])
+    if mode == 'max':
+        return np.maximum.reduceat(a, starts).tolist()
+    if mode == 'min':
+        return np.minimum.reduceat(a, starts).tolist()
+    counts = np.diff(np.append(starts, len(a)))
+    return (np.add.reduceat(a, starts) / counts).tolist()
+
+
+def bucket(series, width, mode='max'):
+    """Reduces every bucket of `series` to its max, min or mean (`mode`).
+    Series that already fit in `width` are returned as is.
+    """
+    if len(series) <= width:
+        return list(series)
+    np = import_numpy()
+    if np is not None:
+        return _np_reduce(np, series, width, mode)
+    func = {'max': max, 'min': min, 'mean': _mean}[mode]
+    return _reduce(series, width, func)
+
+
+def band(series, width):
+    """Returns the `(lower, upper)` envelopes of `series`, i.e. the per bucket
+    min and max.
+    """
+    return bucket(series, width, 'min'), bucket(series, width, 'max')
+
+
+def lttb(series, width):
+    """Largest-Triangle-Three-Buckets: keeps, from every bucket, the point that
+    forms the largest triangle with the point kept from the previous bucket
+    and the mean of the next bucket. The first and last points are kept.
+    """
+    n = len(series)
+    if n <= width or width < 3:
+        return bucket(series, width, 'max')
+    e = [1 + i * (n - 2) // (width - 2) for i in range(width - 1)]
+    ret = [series[0]]
+    ax, ay = 0, series[0]
+    for k in range(width - 2):
+        a, b = e[k], e[k + 1]
+        if k + 2 < len(e):
+            c, d = e[k + 1], e[k + 2]
+        else:
+            c, d = n - 1, n
+        cx = (c + d - 1) / 2
+        cy = sum(series[c:d]) / (d - c)
+        best, best_area = a, -1.0
+        for x in range(a, b):
+            area = abs((ax - cx) * (series[x] - ay) - (ax - x) * (cy - ay))
+            if area > best_area:
+                best, best_area = x, area
+        ax, ay = best, series[best]
+        ret.append(ay)
+    ret.append(series[-1])
+    return ret
+
+
+def downsample(series, width, mode='max'):
+    """Downsamples `series` to `width` points with one of `MODES` except
+    `band`, for which `band()` should be used.
+    """
+    if mode == 'lttb':
+        return lttb(series, width)
+    return bucket(series, width, mode)
+
+
+def _pairwise(func, xs):
+    return [func(a, b) for a, b in zip(xs[::2], xs[1::2])]
+
+
+class StreamingBucketer:
+    """Downsamples a series of unknown length in one pass and bounded memory.
+
+    Samples are aggregated (min, max, sum and count) in buckets of `per`
+    samples. When there are `2 * width` buckets, adjacent ones are merged
+    pairwise and `per` doubles, so there are never more than `2 * width`
+    buckets. `result()` then reduces these to the requested number of points.
+    LTTB needs the whole series and is not supported.
+
+    Samples taken at irregular intervals are pushed with the seconds they
+    stand for as their weight, and buckets then hold `per` seconds (starting
+    from `per`, e.g. the shortest interval) instead of `per` samples, a
+    sample spanning several buckets being pushed to each of them, so points
+    are evenly spaced in time.
+    """
+
+    __slots__ = ('width', 'per', 'mins', 'maxs', 'sums', 'counts')
+
+    def __init__(self, width, per=1):
+        self.width = width
+        self.per = per
+        self.mins = []
+        self.maxs = []
+        self.sums = []
+        self.counts = []
+
+    def __len__(self):
+        """The samples pushed, or their total weight (rounded down).
+        """
+        return int(sum(self.counts))
+
+    def push(self, x, w=1):
+        while True:
+            room = self.per - self.counts[-1] if self.counts else 0
+            if room > 1e-9 * self.per:
+                part = min(w, room)
+                if x < self.mins[-1]:
+                    self.mins[-1] = x
+                if x > self.maxs[-1]:
+                    self.maxs[-1] = x
+                self.sums[-1] += x * part
+                self.counts[-1] += part
+            else:
+                if len(self.counts) == 2 * self.width:
+                    self._halve()
+                part = min(w, self.per)
+                self.mins.append(x)
+                self.maxs.append(x)
+                self.sums.append(x * part)
+                self.counts.append(part)
+            w -= part
+            if w <= 0:
+                return
+
+    def add_bucket(self, mi, ma, total, count):
+        """Appends an already aggregated bucket, e.g. one reduced with NumPy.
+        Buckets added this way are never merged.
+        """
+        self.mins.append(mi)
+        self.maxs.append(ma)
+        self.sums.append(total)
+        self.counts.append(count)
+
+    def _halve(self):
+        self.mins = _pairwise(min, self.mins)
+        self.maxs = _pairwise(max, self.maxs)
+        self.sums = _pairwise(add, self.sums)
+        self.counts = _pairwise(add, self.counts)
+        self.per *= 2
+
+    def result(self, width, mode='max'):
+        """Returns at most `width` points reduced with `mode`, or the
+        `(lower, upper)` envelopes for the `band` mode.
+        """
+        if mode == 'band':
+            return self.result(width, 'min'), self.result(width, 'max')
+        n = len(self.counts)
+        e = edges(n, min(width, n))
+        if mode == 'min':
+            return [min(self.mins[a:b]) for a, b in zip(e, e[1:])]
+        if mode == 'mean':
+            return [
+                sum(self.sums[a:b]) / sum(self.counts[a:b])
+                for a, b in zip(e, e[1:])
+            ]
+        return [max(self.maxs[a:b]) for a, b in zip(e, e[1:])]
@@ -0,0 +1,145 @@
+# -*- coding: utf-8 -*-
+
+"""Machine readable outputs: the report as JSON or CSV, and a Prometheus
+textfile for the node_exporter textfile collector.
+"""
+
+import csv
+import io
+import json
+import os
+
+from tmon import raw
+
+
+FORMATS = ('text', 'json', 'csv')
+PROM_EVERY = 10  # ticks between rewrites of the textfile
+OVERHEAD_TEMPLATE = (
+    "# HELP tmon_sampler_ticks_total Sampling ticks.\n"
+    "# TYPE tmon_sampler_ticks_total counter\n"
+    "tmon_sampler_ticks_total {}\n"
+    "# HELP tmon_sampler_missed_ticks_total Deadlines skipped altogether.\n"
+    "# TYPE tmon_sampler_missed_ticks_total counter\n"
+    "tmon_sampler_missed_ticks_total {}\n"
+    "# HELP tmon_sampler_rate_hertz Achieved sampling rate.\n"
+    "# TYPE tmon_sampler_rate_hertz gauge\n"
+    "tmon_sampler_rate_hertz {}\n"
+    "# HELP tmon_sampler_read_p99_microseconds Upper bound of the 99th "
+    "percentile of sensor read latency.\n"
+    "# TYPE tmon_sampler_read_p99_microseconds gauge\n"
+    "tmon_sampler_read_p99_microseconds {}\n"
+    "# HELP tmon_sampler_jitter_p99_microseconds Upper bound of the 99th "
+    "percentile of tick lateness.\n"
+    "# TYPE tmon_sampler_jitter_p99_microseconds gauge\n"
+    "tmon_sampler_jitter_p99_microseconds {}\n"
+    "# HELP tmon_sampler_cpu_seconds_total CPU time used by tmon.\n"
+    "# TYPE tmon_sampler_cpu_seconds_total counter\n"
+    "tmon_sampler_cpu_seconds_total{{mode=\"user\"}} {}\n"
+    "tmon_sampler_cpu_seconds_total{{mode=\"system\"}} {}\n"
+)
+
+
+def to_json(summary):
+    return json.dumps(summary, indent=2, sort_keys=True)
+
+
+def _flatten(prefix, value):
+    if isinstance(value, dict):
+        for k, v in value.items():
+            yield from _flatten(prefix + (str(k),), v)
+    elif isinstance(value, (list, tuple)):
+        for i, v in enumerate(value):
+            yield from _flatten(prefix + (str(i),), v)
+    else:
+        yield '.'.join(prefix), value
+
+
+def to_csv(summary):
+    """Returns the summary as `key,value` rows, nested keys being joined
+    with dots, e.g. `stats.max` or `series.max.12`.
+    """
+    out = io.StringIO()
+    writer = csv.writer(out, lineterminator='\n')
+    writer.writerow(('key', 'value'))
+    for key, value in _flatten((), summary):
+        writer.writerow((key, '' if value is None else value))
+    return out.getvalue()
+
+
+def _label(value):
+    return value.replace('\\', r'\\').replace('\n', r'\n').replace('"', r'\"')
+
+
+class PromTextfile:
+    """Gauges of a run rewritten to the textfile at `path` every `every`
+    ticks. The file is replaced atomically, so the collector never reads a
+    partial one, and the ticks in between only count down.
+    """
+
+    def __init__(self, path, zones, every=PROM_EVERY):
+        self.path = path
+        self.every = every
+        self.countdown = 1  # the first tick is written right away
+        self._tmp = "{}.{}.tmp".format(path, os.getpid())
+        zone_lines = ''.join(
+            'tmon_temperature_celsius{{{{zone="{}"}}}} {{}}\n'.format(
+                _label(z).replace('{', '{{').replace('}', '}}')
+            ) for z in zones
+        )
+        self._template = (
+            "# HELP tmon_temperature_celsius Last temperature of a zone.\n"
+            "# TYPE tmon_temperature_celsius gauge\n" + zone_lines +
+            "# HELP tmon_temperature_max_celsius Hottest temperature of the "
+            "run.\n"
+            "# TYPE tmon_temperature_max_celsius gauge\n"
+            "tmon_temperature_max_celsius {}\n"
+            "# HELP tmon_temperature_mean_celsius Mean temperature of the "
+            "run.\n"
+            "# TYPE tmon_temperature_mean_celsius gauge\n"
+            "tmon_temperature_mean_celsius {}\n"
+            "# HELP tmon_samples_total Samples taken.\n"
+            "# TYPE tmon_samples_total counter\n"
+            "tmon_samples_total {}\n"
+            "# HELP tmon_last_sample_timestamp_seconds Time of the last "
+            "sample.\n"
+            "# TYPE tmon_last_sample_timestamp_seconds gauge\n"
+            "tmon_last_sample_timestamp_seconds {}\n"
+        )
+        self.nzones = len(zones)
+
+    def update(self, row, stats, wall, overhead=None):
+        """Counts a tick with the last `row` of millidegrees and the
+        `RunningStats` of the run, sampled at `wall` (unix time, s), and
+        rewrites the file every `every` ticks, with the sampler's own cost
+        if `overhead` (a callable returning the dict of
+        `Monitor.overhead()`) is given.
+        """
+        self.countdown -= 1
+        if self.countdown > 0:
+            return
+        self.countdown = self.every
+        self.write(row, stats, wall, None if overhead is None else overhead())
+
+    def write(self, row, stats, wall, overhead=None):
+        temps = [
+            'NaN' if v is None or v == raw.MISSING else v * 0.001
+            for v in (list(row) + [None] * self.nzones)[:self.nzones]
+        ]
+        text = self._template.format(
+            *temps, stats.max, stats.mean, stats.count, round(wall, 3)
+        )
+        if overhead is not None:
+            text += OVERHEAD_TEMPLATE.format(
+                overhead['ticks'], overhead['missed'], overhead['rate'],
+                overhead['read_us']['p99'], overhead['jitter_us']['p99'],
+                overhead['cpu_user_s'], overhead['cpu_sys_s']
+            )
+        with open(self._tmp, 'w') as f:
+            f.write(text)
+        os.replace(self._tmp, self.path)
+
+    def close(self):
+        try:
+            os.unlink(self._tmp)
+        except FileNotFoundError:
+            pass
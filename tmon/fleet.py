@@ -0,0 +1,146 @@
+# -*- coding: utf-8 -*-
+
+"""Fleet view of the raw files of many hosts.
+
+The samples of all the files are merged in wall clock order with a k-way
+merge that holds one sample per file, so files of any length are merged in
+bounded memory. Samples are aligned in buckets of a fixed duration, and the
+hottest sample of each host in a bucket makes the chart point of that host.
+Files of the same host, e.g. the segments of a rotated run, make one host.
+"""
+
+import contextlib
+import datetime
+import heapq
+import math
+import os
+
+from tmon import raw
+from tmon.replay import Streamed
+from tmon.series import select_zones
+
+
+def _samples(reader, host, selected, weighted):
+    """Yields the wall clock time, the host, the temperature (the hottest of
+    the `selected` zones, or of all of them), the seconds it stands for (the
+    sampling interval, or the time since the previous sample for adaptive
+    runs) and its weight in the stats (its seconds if `weighted`) of the
+    samples of `reader`.
+    """
+    adaptive = reader.ceiling is not None
+    last = None
+    for mono, wall, row in reader.timed_rows():
+        dt = reader.interval
+        if adaptive and last is not None:
+            dt = mono - last
+        last = mono
+        if selected is not None:
+            row = [row[i] for i in selected if i < len(row)]
+        t = max(row) if row else raw.MISSING
+        if t != raw.MISSING:
+            yield wall, host, t * 0.001, dt, dt if weighted else 1
+
+
+class _Aligner:
+    """Feeds the merged samples to the per host and fleet bucketers of a
+    `Streamed`, one point per bucket of `bucket` seconds.
+
+    Hosts get the value of their last bucket in buckets without samples,
+    and that of their first one in the buckets before it, so the lines of
+    all the hosts stay aligned. A run of empty buckets, e.g. between files
+    of different days, is pushed at once as a point of that many buckets.
+    """
+
+    def __init__(self, streamed, bucket):
+        self.streamed = streamed
+        self.bucket = bucket
+        self.index = None  # of the current bucket, in buckets since 1970
+        self.current = {}  # host: hottest sample in the current bucket
+        self.last = {}  # host: point of the last bucket
+        self.lead = {}  # host: buckets before its first sample
+        self.first = None  # wall clock times of the first and last samples
+        self.end = None
+
+    def push(self, wall, host, t, dt, w):
+        self.streamed.stats.push(t, w)
+        self.streamed.histogram.push(t, dt)
+        self.streamed.zone_stats[host].push(t, w)
+        k = math.floor(wall / self.bucket)
+        if self.index is None:
+            self.index = k
+            self.first = wall
+        if k > self.index:
+            self.close(k - self.index)
+        self.end = wall
+        if t > self.current.get(host, -math.inf):
+            self.current[host] = t
+
+    def close(self, n=1):
+        """Closes the current bucket and the `n - 1` empty ones after it,
+        pushing a point of every host.
+        """
+        points = []
+        for host, bucketer in self.streamed.zone_bucketers.items():
+            t = self.current.get(host, self.last.get(host))
+            if t is None:
+                self.lead[host] = self.lead.get(host, 0) + n
+                continue
+            lead = self.lead.pop(host, 0)
+            if lead:
+                bucketer.push(t, lead)
+            bucketer.push(t, n)
+            self.last[host] = t
+            points.append(t)
+        if points:
+            self.streamed.bucketer.push(max(points), n)
+        self.current = {}
+        self.index += n
+
+
+def merge(paths, width, bucket=None, zones=None):
+    """Merges the raw files at `paths` for a chart of `width` columns, in
+    buckets of `bucket` seconds (by default the longest sampling interval,
+    the ceiling for adaptive runs) and for the zones picked by `zones` (see
+    `select_zones`) in every file.
+
+    Returns the `Streamed` data, with one zone per host, the bucketer of the
+    hottest host at every bucket and the stats of the samples of all the
+    hosts (weighted by time if any file is of an adaptive run), and the
+    period covered. Raises `ValueError` for files whose
+    samples carry no times or in which a selector matches no zone, and if
+    there are no samples at all.
+    """
+    with contextlib.ExitStack() as stack:
+        hosts = []
+        sources = []
+        intervals = []
+        for path in paths:
+            reader = stack.enter_context(raw.open_raw(path))
+            if reader.interval is None:
+                raise ValueError("{}: samples without times".format(path))
+            host = reader.host or os.path.basename(path)
+            if host not in hosts:
+                hosts.append(host)
+            selected = None
+            if zones and reader.zones:
+                selected = select_zones(reader.zones, zones)
+            sources.append((reader, hosts.index(host), selected))
+            intervals.append(reader.ceiling or reader.interval)
+        weighted = any(reader.ceiling is not None for reader, _, _ in sources)
+        streams = [_samples(*source, weighted) for source in sources]
+        streamed = Streamed(
+            hosts, width, list(range(len(hosts))), weighted=weighted
+        )
+        aligner = _Aligner(streamed, bucket or max(intervals or [1.0]))
+        for sample in heapq.merge(*streams):
+            aligner.push(*sample)
+        if aligner.index is not None:
+            aligner.close()
+    if not streamed.stats.count:
+        raise ValueError("no samples to merge")
+    # hosts without samples have nothing to chart or report
+    streamed.selected = [
+        i for i, st in streamed.zone_stats.items() if st.count
+    ]
+    seconds = 0 if aligner.first is None else aligner.end - aligner.first
+    return streamed, str(datetime.timedelta(seconds=round(seconds)))
@@ -0,0 +1,95 @@
+# -*- coding: utf-8 -*-
+
+"""Thermal guard pausing the monitored program while it is too hot.
+"""
+
+import os
+import signal
+import time
+
+from tmon.downsample import columns
+from tmon.utils import eprint
+
+
+RESUME_MARGIN = 5.0  # default hysteresis, in °C
+
+
+class Guard:
+    """Pauses a process group with SIGSTOP when the temperature reaches
+    `pause_at` and resumes it with SIGCONT once it drops below `resume_at`
+    (by default `RESUME_MARGIN` below `pause_at`).
+
+    The guard is driven by the sampling loop, which passes every sample to
+    `update()`, so it reacts within one sampling interval. Paused intervals
+    are kept as `(first tick, last tick, start, duration)` tuples, with the
+    start relative to `attach()` and both times in seconds.
+    """
+
+    def __init__(self, pause_at, resume_at=None):
+        if resume_at is None:
+            resume_at = pause_at - RESUME_MARGIN
+        if resume_at > pause_at:
+            raise ValueError("resume temperature above the pause temperature")
+        self.pause_at = pause_at
+        self.resume_at = resume_at
+        self.pgid = None
+        self.t0 = None
+        self.paused_since = None  # (tick, time) the group was paused at
+        self.intervals = []
+
+    def attach(self, pgid):
+        self.pgid = pgid
+        self.t0 = time.monotonic()
+
+    @property
+    def paused(self):
+        return self.paused_since is not None
+
+    def _signal(self, sig):
+        try:
+            os.killpg(self.pgid, sig)
+        except ProcessLookupError:  # the group is gone
+            return False
+        return True
+
+    def update(self, tick, t):
+        """Pauses or resumes the group given the temperature `t` (°C) sampled
+        at `tick`.
+        """
+        if self.pgid is None:
+            return
+        if not self.paused and t >= self.pause_at:
+            if self._signal(signal.SIGSTOP):
+                self.paused_since = tick, time.monotonic()
+                eprint("tmon: {:.1f} °C, pausing the program".format(t))
+        elif self.paused and t < self.resume_at:
+            eprint("tmon: {:.1f} °C, resuming the program".format(t))
+            self.resume(tick)
+
+    def resume(self, tick):
+        """Resumes the group, if paused, closing the paused interval at
+        `tick`.
+        """
+        if not self.paused:
+            return
+        self._signal(signal.SIGCONT)
+        first, since = self.paused_since
+        now = time.monotonic()
+        self.intervals.append((first, tick, since - self.t0, now - since))
+        self.paused_since = None
+
+    @property
+    def paused_s(self):
+        return sum(duration for _, _, _, duration in self.intervals)
+
+    def columns(self, n, width, position=None):
+        """Returns the chart columns, of `width` columns for a series of `n`
+        samples downsampled to equal buckets, holding paused ticks. Ticks are
+        mapped through `position`, if given, see `time_positions`.
+        """
+        ret = set()
+        for first, last, _, _ in self.intervals:
+            if position is not None:
+                first, last = position(first), position(last + 1) - 1
+            ret |= columns(range(first, max(first, last) + 1), n, width)
+        return ret
@@ -0,0 +1,166 @@
+# -*- coding: utf-8 -*-
+
+"""Live dashboard redrawn in place while the child runs.
+"""
+
+from collections import deque
+import math
+import sys
+import time
+
+from tmon.asciichart import column
+from tmon.series import RingBuffer
+
+
+class Dashboard:
+    """Chart and stats of the last `window` samples, redrawn in place every
+    `refresh` seconds.
+
+    The samples sit in a fixed size `RingBuffer` and are folded, as they
+    arrive, into `xsize` chart columns holding the min and max of
+    `window / xsize` samples each. Columns start with one sample each, so
+    the chart is drawn from the first ticks on, and are widened (doubling,
+    up to `window / xsize` samples) from the buffer whenever they fill the
+    chart before the buffer is full. The rendered cells of every column are
+    cached, so a frame only recomputes the columns that changed since the
+    previous one, unless the y-axis range changed.
+    """
+
+    ALT_SCREEN_ON, ALT_SCREEN_OFF = '\x1b[?1049h', '\x1b[?1049l'
+    HIDE_CURSOR, SHOW_CURSOR = '\x1b[?25l', '\x1b[?25h'
+
+    def __init__(
+        self, xsize=70, ysize=15, refresh=0.5, window=600, fahrenheit=False,
+        stream=None, alt_screen=False
+    ):
+        self.xsize = xsize
+        self.rows = ysize - 1
+        self.refresh_interval = refresh
+        self.fahrenheit = fahrenheit
+        self.unit = "°F" if fahrenheit else "°C"
+        self.stream = stream or sys.stderr
+        self.alt_screen = alt_screen
+        self.ring = RingBuffer(window)
+        self.per_window = max(1, -(-window // xsize))  # samples per column
+        self.per_col = 1  # until the columns fill the chart
+        self.maxs = deque(maxlen=xsize)  # per column max, the last is partial
+        self.mins = deque(maxlen=xsize)  # per column min
+        self.filled = 0  # samples in the last column
+        self.started = 0  # columns started so far
+        self.seen = 0  # columns started when the last frame was drawn
+        self.scale = None
+        self.ys = deque(maxlen=xsize)  # row of every column
+        self.cells = deque(maxlen=xsize - 1)  # cells joining ys[x], ys[x+1]
+        self.frames = 0
+        self.lines = 0  # lines written by the last frame
+        self.next_draw = 0.0
+        if alt_screen:
+            self.stream.write(self.ALT_SCREEN_ON)
+        self.stream.write(self.HIDE_CURSOR)
+
+    def push(self, t):
+        if self.fahrenheit:
+            t = t*1.8 + 32
+        self.ring.append(t)
+        if self.filled in (0, self.per_col):
+            if len(self.maxs) == self.xsize and self.per_col < self.per_window:
+                self._widen()
+                return
+            self.maxs.append(t)
+            self.mins.append(t)
+            self.filled = 1
+            self.started += 1
+        else:
+            self.maxs[-1] = max(self.maxs[-1], t)
+            self.mins[-1] = min(self.mins[-1], t)
+            self.filled += 1
+
+    def _widen(self):
+        """Regroups the samples in the buffer in columns twice as wide.
+        """
+        self.per_col = min(2 * self.per_col, self.per_window)
+        samples = list(self.ring)
+        self.maxs.clear()
+        self.mins.clear()
+        for a in range(0, len(samples), self.per_col):
+            part = samples[a:a + self.per_col]
+            self.maxs.append(max(part))
+            self.mins.append(min(part))
+        self.filled = len(samples) - (len(self.maxs) - 1) * self.per_col
+        self.started = len(self.maxs)
+        self.seen = 0
+        self.ys.clear()  # redrawn in full
+        self.cells.clear()
+
+    def refresh(self, force=False):
+        """Draws a frame if `refresh` seconds went by since the last one.
+        """
+        now = time.monotonic()
+        if force or now >= self.next_draw:
+            self.next_draw = now + self.refresh_interval
+            self.draw()
+
+    def _rescale(self):
+        minimum = math.floor(min(self.mins))
+        maximum = math.ceil(max(self.maxs) + 0.1)
+        if (minimum, maximum) == self.scale and self.ys:
+            return False
+        self.scale = minimum, maximum
+        self.ratio = self.rows / (maximum - minimum)
+        self.min2 = math.floor(minimum * self.ratio)
+        return True
+
+    def _update_columns(self):
+        if self._rescale():
+            self.ys.clear()
+            self.cells.clear()
+            changed = len(self.maxs)
+        else:
+            # the previous last column may have been partial, redo it as well
+            changed = min(self.started - self.seen + 1, len(self.maxs))
+            self.ys.pop()
+            if self.cells:
+                self.cells.pop()
+        self.seen = self.started
+        for v in list(self.maxs)[len(self.maxs) - changed:]:
+            y = min(int(v * self.ratio) - self.min2, self.rows)
+            if self.ys:
+                self.cells.append(column(self.ys[-1], y, self.rows))
+            self.ys.append(y)
+
+    def draw(self):
+        if not self.maxs:
+            return
+        self._update_columns()
+        minimum, maximum = self.scale
+        interval = maximum - minimum
+        if self.cells:
+            body = [''.join(r) for r in zip(*self.cells)]
+        else:
+            body = [''] * (self.rows + 1)
+        lines = ["temp ({}), last {} samples".format(
+            self.unit, len(self.ring)
+        )]
+        for r, row in enumerate(body):
+            label = '{:8.2f} '.format(maximum - (r * interval / self.rows))
+            lines.append(label + ' ┤' + row)
+        lines.append(
+            "now: {:.1f} {u}  min: {:.1f} {u}  avg: {:.1f} {u}  "
+            "max: {:.1f} {u}".format(
+                self.ring.last, min(self.mins), self.ring.mean,
+                max(self.maxs), u=self.unit
+            )
+        )
+        out = '\x1b[{}F'.format(self.lines) if self.lines else ''
+        out += ''.join(line + '\x1b[K\n' for line in lines)
+        self.stream.write(out)
+        self.stream.flush()
+        self.lines = len(lines)
+        self.frames += 1
+
+    def close(self):
+        self.refresh(force=True)
+        self.stream.write(self.SHOW_CURSOR)
+        if self.alt_screen:
+            self.stream.write(self.ALT_SCREEN_OFF)
+        self.stream.flush()
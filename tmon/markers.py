@@ -0,0 +1,129 @@
+# -*- coding: utf-8 -*-
+
+"""Phase markers sent by the monitored program.
+
+tmon binds a Unix datagram socket and passes its path to the program in the
+`TMON_MARKERS` environment variable. Every datagram is the name of the phase
+starting then (e.g. `load`, `warmup`, `steady`), e.g. from a shell::
+
+    socat - UNIX-SENDTO:"$TMON_MARKERS" <<< steady
+
+or from Python with `mark()`. Sending never blocks: markers that find the
+socket queue full are dropped.
+"""
+
+import os
+import shutil
+import socket
+import tempfile
+
+from tmon.downsample import columns
+from tmon.stats import RunningStats
+
+
+ENV = 'TMON_MARKERS'
+MAX_NAME = 64  # longer phase names are truncated
+
+_sock = None
+
+
+def mark(name, path=None):
+    """Starts phase `name`, if running under tmon. Returns whether the marker
+    was sent.
+    """
+    global _sock
+    path = path or os.environ.get(ENV)
+    if not path:
+        return False
+    if _sock is None:
+        _sock = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+        _sock.setblocking(False)
+    try:
+        _sock.sendto(name.encode(), path)
+    except OSError:  # queue full, or tmon is gone
+        return False
+    return True
+
+
+class MarkerChannel:
+    """The socket markers are received on, in a private temporary directory.
+    """
+
+    def __init__(self):
+        self.dir = tempfile.mkdtemp(prefix="tmon-")
+        self.path = os.path.join(self.dir, "markers.sock")
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+        self.sock.setblocking(False)
+        self.sock.bind(self.path)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def env(self):
+        return dict(os.environ, **{ENV: self.path})
+
+    def receive(self):
+        """Returns the names of the markers received since the last call.
+        """
+        ret = []
+        while True:
+            try:
+                data = self.sock.recv(MAX_NAME)
+            except BlockingIOError:
+                return ret
+            name = data.decode(errors='replace').strip()
+            if name:
+                ret.append(name)
+
+    def close(self):
+        self.sock.close()
+        shutil.rmtree(self.dir, ignore_errors=True)
+
+
+class PhaseLog:
+    """Temperature stats per phase and the segments (phase name and first
+    tick) of the run. Samples before the first marker belong to no phase.
+    """
+
+    def __init__(self):
+        self.segments = []  # (name, first tick)
+        self.stats = {}  # name: RunningStats, in order of first appearance
+        self.current = None
+
+    def __len__(self):
+        return len(self.segments)
+
+    def start(self, name, tick):
+        """Starts phase `name` at `tick`, the index of its first sample.
+        """
+        if self.segments and self.segments[-1][1] == tick:
+            self.segments.pop()  # ended before any sample
+        self.segments.append((name, tick))
+        if name not in self.stats:
+            self.stats[name] = RunningStats()
+        self.current = self.stats[name]
+
+    def push(self, t, w=1):
+        """Adds a sample of temperature `t` weighing `w` (e.g. the seconds it
+        stands for) to the current phase, if any.
+        """
+        if self.current is not None:
+            self.current.push(t, w)
+
+    def label_line(self, n, width, position=None):
+        """Returns the phase names, each written from the chart column of the
+        first sample of its segment, for a series of `n` samples downsampled
+        to `width` columns. Ticks are mapped through `position`, if given,
+        see `time_positions`.
+        """
+        line = [' '] * width
+        for name, tick in self.segments:
+            if position is not None:
+                tick = position(tick)
+            for x in columns([tick], n, width):
+                label = '|' + name
+                line[x:x + len(label)] = label
+        return ''.join(line[:width]).rstrip()
@@ -0,0 +1,173 @@
+# -*- coding: utf-8 -*-
+
+"""CPU usage of the monitored process tree and of the whole system.
+"""
+
+import os
+
+from tmon.sensors import pread_into
+from tmon.stats import RunningCorrelation, RunningStats
+
+
+HZ = os.sysconf('SC_CLK_TCK')  # unit of the times in /proc
+STAT_SIZE = 1024  # more than the first line of /proc/stat or a /proc/PID/stat
+
+
+def _open(path):
+    try:
+        return os.open(path, os.O_RDONLY)
+    except OSError:  # gone already
+        return None
+
+
+class _Process:
+    """Cached file descriptors of a process: its stat file and the children
+    files of the tasks (threads) it had when first seen.
+    """
+
+    __slots__ = ('fds', 'stat', 'children')
+
+    def __init__(self, pid):
+        self.fds = []
+        self.children = []
+        self.stat = _open("/proc/{}/stat".format(pid))
+        if self.stat is None:
+            return
+        self.fds.append(self.stat)
+        try:
+            tids = os.listdir("/proc/{}/task".format(pid))
+        except OSError:
+            tids = []
+        for tid in tids:
+            fd = _open("/proc/{}/task/{}/children".format(pid, tid))
+            if fd is not None:
+                self.fds.append(fd)
+        self.children = self.fds[1:]
+
+    def close(self):
+        for fd in self.fds:
+            os.close(fd)
+        self.fds = []
+
+
+class CPUSampler:
+    """Samples, at every tick, the CPU time of a process and its descendants
+    and the CPU time of the whole system, both in CPUs busy since the
+    previous tick.
+
+    The tree is walked from the root process through the `children` files of
+    /proc (Linux >= 4.2 with CONFIG_PROC_CHILDREN), keeping the files of every
+    process open while it lives, so a tick costs a couple of preads per
+    process. The CPU time of a process includes that of its children it
+    already waited for, so descendants that exit are not lost. Children of
+    threads started after a process was first seen are missed.
+    """
+
+    def __init__(self):
+        self.root = None
+        self.procs = {}  # pid: _Process
+        self.times = {}  # pid: CPU time at the previous tick, in clock ticks
+        self.carry = 0
+        self.buf = bytearray(STAT_SIZE)
+        self.system_fd = os.open("/proc/stat", os.O_RDONLY)
+        self.prev = None  # previous (time, busy, total) of the system
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def attach(self, pid):
+        self.root = pid
+
+    def close(self):
+        for proc in self.procs.values():
+            proc.close()
+        self.procs = {}
+        if self.system_fd is not None:
+            os.close(self.system_fd)
+            self.system_fd = None
+
+    def _read(self, fd):
+        try:
+            return pread_into(fd, self.buf)
+        except OSError:  # the process is gone (ESRCH)
+            return None
+
+    def _system(self):
+        line = bytes(self._read(self.system_fd)).split(b'\n', 1)[0]
+        fields = [int(f) for f in line.split()[1:9]]
+        total = sum(fields)
+        return total - fields[3] - fields[4], total  # idle and iowait
+
+    def _tree(self):
+        """Returns the CPU time used by the tree since the previous tick, in
+        clock ticks, walking it and updating the cached processes.
+        """
+        times = {}
+        stack = [self.root]
+        while stack:
+            pid = stack.pop()
+            if pid in times:
+                continue
+            proc = self.procs.get(pid)
+            if proc is None:
+                proc = self.procs[pid] = _Process(pid)
+            data = None if proc.stat is None else self._read(proc.stat)
+            if not data:
+                continue
+            # fields after the command, which may hold spaces and ')'
+            fields = bytes(data).rsplit(b')', 1)[1].split()
+            times[pid] = sum(int(f) for f in fields[11:15])  # [us]time, c*
+            for fd in proc.children:
+                children = self._read(fd)
+                if children:
+                    stack.extend(int(c) for c in bytes(children).split())
+        for pid in set(self.procs) - set(times):
+            self.procs.pop(pid).close()
+        prev, self.times = self.times, times
+        used = sum(t - prev.get(pid, 0) for pid, t in times.items())
+        # the time of a reaped process moves to its parent's c[us]time, where
+        # it shows up again
+        used -= sum(t for pid, t in prev.items() if pid not in times)
+        used += self.carry
+        self.carry = min(used, 0)  # e.g. read the parent before the reaping
+        return max(used, 0)
+
+    def sample(self, now):
+        """Returns the CPUs used by the tree and by the whole system since
+        the previous tick, at time `now` (monotonic seconds), and the number
+        of CPUs, or None on the first tick.
+        """
+        tree = self._tree() if self.root is not None else 0
+        busy, total = self._system()
+        prev, self.prev = self.prev, (now, busy, total)
+        if prev is None or now <= prev[0] or total <= prev[2]:
+            return None
+        dt = now - prev[0]
+        ncpus = (total - prev[2]) / HZ / dt
+        return tree / HZ / dt, (busy - prev[1]) / HZ / dt, ncpus
+
+
+class CPUStats:
+    """CPU usage over a run, in CPUs, and how the temperature follows the
+    CPU usage of the child tree and of everything else.
+    """
+
+    def __init__(self):
+        self.child = RunningStats()
+        self.system = RunningStats()  # as a fraction of all the CPUs
+        self.ncpus = RunningStats()
+        self.temp_child = RunningCorrelation()
+        self.temp_others = RunningCorrelation()
+
+    def push(self, t, child, busy, ncpus):
+        """Adds the CPUs used by the child tree (`child`) and the system
+        (`busy`), out of `ncpus`, during a tick with temperature `t`.
+        """
+        self.child.push(child)
+        self.system.push(busy / ncpus if ncpus else 0.0)
+        self.ncpus.push(ncpus)
+        self.temp_child.push(child, t)
+        self.temp_others.push(max(busy - child, 0.0), t)
@@ -0,0 +1,374 @@
+# -*- coding: utf-8 -*-
+
+"""Readers and writers for the raw data files.
+
+Two formats are supported:
+
+* text: a `# zones:` line with the space separated sensor names, `# clock:`
+  and `# host:` lines (and an `# adaptive:` one for adaptive runs),
+  followed by one line per tick with the time of the sample and the space
+  separated sensor values, in millidegrees.
+* binary: a header with the sampling interval, the start time, the host and
+  the sensor names, followed by fixed width records of native-endian int32s,
+  the time of the sample and one per sensor. Readers memory-map the file so
+  columns are served without copying.
+
+Sample times are delta encoded (see `Clock`): how late each sample was
+against the sampling interval, in µs of the monotonic clock, and how much
+the wall clock moved against the monotonic one (e.g. set by NTP, or across a
+suspend), in ms, so wall clock times of different hosts can be lined up.
+Text files written before sample times were recorded (without a `# clock:`
+line) are read as well.
+
+Adaptive runs, whose interval varies with how fast the temperature changes,
+record their shortest interval as the sampling interval (samples are then
+late against it) and their longest one as the ceiling.
+
+Files compressed by the rotation of long runs (`.gz` or `.xz`, see
+`tmon.rotate`) are read as well, binary ones being decompressed to a
+temporary file first.
+"""
+
+from array import array
+import gzip
+import lzma
+import mmap
+import os
+import shutil
+import socket
+import struct
+import tempfile
+import time
+
+from tmon.utils import import_numpy
+
+
+MAGIC = b'TMON'
+VERSION = 1
+# magic, version, number of sensors, interval (s), start (unix time, s), the
+# monotonic time at the start (s) and the longest interval of adaptive runs
+# (s, 0 for fixed intervals)
+HEADER = struct.Struct('<4sHHdddd')
+NAME_LEN = struct.Struct('<H')
+TIME_SLOTS = 2  # int32s of the sample time leading every record
+ZONES_PREFIX = '# zones: '
+CLOCK_PREFIX = '# clock: '
+HOST_PREFIX = '# host: '
+ADAPTIVE_PREFIX = '# adaptive: '
+MISSING = -2**31  # value of a sensor that could not be read in a record
+ITEMSIZE = 4
+OPENERS = {'.gz': gzip.open, '.xz': lzma.open}  # of compressed files
+
+
+def _open(path, mode='rb'):
+    """Opens the raw file at `path`, decompressing it on the fly if needed.
+    """
+    opener = OPENERS.get(os.path.splitext(path)[1])
+    if opener is None:
+        return open(path, mode)
+    return opener(path, 'rt' if mode == 'r' else mode)
+
+
+def _clamp(x):
+    return max(min(x, 2**31 - 1), -2**31 + 1)
+
+
+class Clock:
+    """Delta encoding of sample times, both for writing and reading.
+
+    A sample is encoded as its lateness against the previous one plus the
+    interval, in µs of the monotonic clock, and the change of the offset of
+    the wall clock from the monotonic one, in ms. Changes of the offset
+    within `slack_ms` are measurement noise and are not recorded, so both
+    are small and usually the lateness is the only nonzero value.
+    """
+
+    def __init__(self, interval, start, mono=None, slack_ms=1):
+        if mono is None:  # now, for writing
+            mono = time.monotonic() - (time.time() - start)
+        self.step = round(interval * 1e6)
+        # when the previous sample would have been taken, in µs, so the
+        # first one is due at `mono`
+        self.t = round(mono * 1e6) - self.step
+        self.offset = round((start - mono) * 1e3)  # wall - monotonic, ms
+        self.slack_ms = slack_ms
+        self.start = start
+        self.mono = mono
+
+    def encode(self, t):
+        """Returns the lateness and offset change of a sample taken at
+        monotonic time `t` (s), and moves on to it.
+        """
+        late = _clamp(round(t * 1e6) - self.t - self.step)
+        # a clamped lateness is caught up with by the next samples
+        self.t += self.step + late
+        offset = round((time.time() - time.monotonic()) * 1e3)
+        change = offset - self.offset
+        if abs(change) <= self.slack_ms:
+            return late, 0
+        self.offset = offset
+        return late, _clamp(change)
+
+    def decode(self, late, change):
+        """Returns the monotonic and wall clock times (s) of the next sample,
+        given its lateness and offset change.
+        """
+        self.t += self.step + late
+        self.offset += change
+        mono = self.t * 1e-6
+        return mono, mono + self.offset * 1e-3
+
+
+class TextWriter:
+    """Writes one line per tick: the time of the sample, as `@LATENESS` or
+    `@LATENESS/OFFSET_CHANGE` (see `Clock`), and the space separated values.
+    """
+
+    suffix = '.txt'
+    mode = 'w+'
+
+    def __init__(self, f, zones, interval, start, host=None, ceiling=None):
+        self.f = f
+        self.clock = Clock(interval, start)
+        f.write(ZONES_PREFIX + ' '.join(z.replace(' ', '_') for z in zones))
+        f.write('\n{}{!r} {!r} {!r}\n'.format(
+            CLOCK_PREFIX, interval, start, self.clock.mono
+        ))
+        f.write(HOST_PREFIX + (host or socket.gethostname()) + '\n')
+        if ceiling is not None:
+            f.write('{}{!r}\n'.format(ADAPTIVE_PREFIX, ceiling))
+
+    def write(self, values, t=None):
+        """Appends the `values` sampled at monotonic time `t` (s), by default
+        now.
+        """
+        late, change = self.clock.encode(time.monotonic() if t is None else t)
+        stamp = '@{}/{} '.format(late, change) if change else '@{} '.format(
+            late
+        )
+        self.f.write(stamp + ' '.join(map(str, values)) + '\n')
+
+    def flush(self):
+        self.f.flush()
+
+
+class BinaryWriter:
+    """Writes a header and fixed width int32 records, batching `batch` ticks
+    per write.
+    """
+
+    suffix = '.bin'
+    mode = 'w+b'
+
+    def __init__(
+        self, f, zones, interval, start, batch=64, host=None, ceiling=None
+    ):
+        self.f = f
+        self.clock = Clock(interval, start)
+        self.nzones = len(zones)
+        self.batch = batch * (TIME_SLOTS + self.nzones)
+        self.buf = array('i')
+        header = HEADER.pack(
+            MAGIC, VERSION, self.nzones, interval, start, self.clock.mono,
+            ceiling or 0.0
+        )
+        for name in [host or socket.gethostname()] + list(zones):
+            name = name.encode('utf-8')
+            header += NAME_LEN.pack(len(name)) + name
+        header += b'\0' * (-len(header) % ITEMSIZE)  # align the records
+        f.write(header)
+
+    def write(self, values, t=None):
+        """Appends a record of the `values` sampled at monotonic time `t` (s),
+        by default now. Sensors that appeared after the header was written
+        are dropped, sensors that went away are stored as `MISSING`.
+        """
+        n = self.nzones
+        self.buf.extend(
+            self.clock.encode(time.monotonic() if t is None else t)
+        )
+        self.buf.extend(values[:n])
+        if len(values) < n:
+            self.buf.extend([MISSING] * (n - len(values)))
+        if len(self.buf) >= self.batch:
+            self.flush()
+
+    def flush(self):
+        self.f.write(self.buf.tobytes())
+        self.f.flush()
+        del self.buf[:]
+
+
+WRITERS = {'text': TextWriter, 'binary': BinaryWriter}
+
+
+class TextReader:
+    """Streams the rows of a text raw file.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.zones = None
+        self.interval = None
+        self.start = None
+        self.mono = None
+        self.host = None
+        self.ceiling = None  # longest interval, for adaptive runs
+        with _open(path, 'r') as f:
+            for line in f:
+                if not line.startswith('#'):
+                    break
+                if line.startswith(ZONES_PREFIX):
+                    self.zones = line[len(ZONES_PREFIX):].split()
+                elif line.startswith(CLOCK_PREFIX):
+                    self.interval, self.start, self.mono = map(
+                        float, line[len(CLOCK_PREFIX):].split()
+                    )
+                elif line.startswith(HOST_PREFIX):
+                    self.host = line[len(HOST_PREFIX):].strip()
+                elif line.startswith(ADAPTIVE_PREFIX):
+                    self.ceiling = float(line[len(ADAPTIVE_PREFIX):])
+
+    @property
+    def timed(self):
+        """Whether the samples carry their times.
+        """
+        return self.mono is not None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def close(self):
+        pass
+
+    def _lines(self):
+        with _open(self.path, 'r') as f:
+            for line in f:
+                line = line.strip()
+                if line and not line.startswith('#'):
+                    yield line.split(' ')
+
+    def rows(self):
+        for fields in self._lines():
+            if fields[0].startswith('@'):
+                fields = fields[1:]
+            yield [int(t) for t in fields]
+
+    def timed_rows(self):
+        """Yields the monotonic time, the wall clock time (both in s) and
+        the values of every sample. Raises `ValueError` if the samples
+        don't carry their times.
+        """
+        if not self.timed:
+            raise ValueError("{}: samples without times".format(self.path))
+        clock = Clock(self.interval, self.start, self.mono)
+        for fields in self._lines():
+            late, _, change = fields[0][1:].partition('/')
+            mono, wall = clock.decode(int(late), int(change or 0))
+            yield mono, wall, [int(t) for t in fields[1:]]
+
+
+class BinaryReader:
+    """Memory-maps a binary raw file.
+
+    `column(i)` returns a strided `memoryview` over the records of sensor `i`
+    and `numpy()` a `(samples, sensors)` array, both backed by the mapping.
+    """
+
+    timed = True  # binary records always carry the sample times
+
+    def __init__(self, path):
+        self.path = path
+        if os.path.splitext(path)[1] in OPENERS:
+            with _open(path) as src, tempfile.TemporaryFile() as f:
+                shutil.copyfileobj(src, f)
+                f.flush()
+                self._mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        else:
+            with open(path, 'rb') as f:
+                self._mm = mmap.mmap(
+                    f.fileno(), 0, access=mmap.ACCESS_READ
+                )
+        magic, version, nzones, self.interval, self.start, self.mono, \
+            ceiling = HEADER.unpack_from(self._mm)
+        if magic != MAGIC or version != VERSION:
+            self._mm.close()
+            raise ValueError("{} is not a tmon binary raw file".format(path))
+        self.ceiling = ceiling or None
+        offset = HEADER.size
+        names = []
+        for _ in range(nzones + 1):  # the host, then the zones
+            n, = NAME_LEN.unpack_from(self._mm, offset)
+            offset += NAME_LEN.size
+            names.append(self._mm[offset:offset + n].decode('utf-8'))
+            offset += n
+        self.host = names.pop(0)
+        self.zones = names
+        self.offset = offset + (-offset % ITEMSIZE)
+        self.nzones = nzones
+        self.width = TIME_SLOTS + nzones  # int32s per record
+        record = ITEMSIZE * self.width
+        self.nsamples = 0
+        if self.width:
+            self.nsamples = (len(self._mm) - self.offset) // record
+        end = self.offset + self.nsamples * record
+        self._mv = memoryview(self._mm)[self.offset:end].cast('i')
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def __len__(self):
+        return self.nsamples
+
+    def close(self):
+        self._mv.release()
+        self._mm.close()
+
+    def column(self, i):
+        return self._mv[TIME_SLOTS + i::self.width]
+
+    def columns(self):
+        return [self.column(i) for i in range(self.nzones)]
+
+    def rows(self):
+        width = self.width
+        for k in range(0, len(self._mv), width):
+            yield self._mv[k + TIME_SLOTS:k + width].tolist()
+
+    def timed_rows(self):
+        """Yields the monotonic time, the wall clock time (both in s) and
+        the values of every sample.
+        """
+        clock = Clock(self.interval, self.start, self.mono)
+        width = self.width
+        for k in range(0, len(self._mv), width):
+            mono, wall = clock.decode(self._mv[k], self._mv[k + 1])
+            yield mono, wall, self._mv[k + TIME_SLOTS:k + width].tolist()
+
+    def numpy(self):
+        return import_numpy().frombuffer(
+            self._mm, dtype='i4', count=self.nsamples * self.width,
+            offset=self.offset
+        ).reshape(self.nsamples, self.width)[:, TIME_SLOTS:]
+
+
+def open_raw(path):
+    """Returns a reader for a raw file of either format.
+    """
+    with _open(path) as f:
+        magic = f.read(len(MAGIC))
+    return BinaryReader(path) if magic == MAGIC else TextReader(path)
+
+
+def iter_max(path):
+    """Yields the hottest sensor of every tick, in degrees.
+    """
+    with open_raw(path) as reader:
+        for row in reader.rows():
+            yield max(row) * 0.001
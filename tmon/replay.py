@@ -0,0 +1,168 @@
+# -*- coding: utf-8 -*-
+
+"""Single pass, bounded memory reduction of existing raw files.
+"""
+
+import datetime
+
+from tmon import raw
+from tmon.downsample import StreamingBucketer, edges
+from tmon.series import select_zones
+from tmon.stats import RunningStats, TemperatureHistogram
+from tmon.utils import import_numpy
+
+
+CHUNK = 1 << 20  # rows reduced at once by the NumPy path
+
+
+class Streamed:
+    """Stats and downsampled chart data of a series reduced in one pass.
+
+    Holds the stats, a `TemperatureHistogram` and a `StreamingBucketer` of
+    the hottest selected zone at every tick and, when zones are selected,
+    the stats and bucketer of each selected zone. Samples stand for
+    `interval` seconds in the histogram, if known.
+
+    With `weighted`, for samples taken at irregular intervals, every sample
+    is pushed with the seconds since the previous one, and the stats and
+    chart data are weighted by time instead of by sample.
+    """
+
+    def __init__(
+        self, zones, width, selected=None, interval=None, weighted=False
+    ):
+        self.zones = zones
+        self.selected = selected
+        self.interval = interval or 0.0
+        self.weighted = weighted
+        per = self.interval if weighted and self.interval else 1
+        self.stats = RunningStats()
+        self.histogram = TemperatureHistogram(weighted=weighted)
+        self.bucketer = StreamingBucketer(width, per)
+        self.zone_stats = {i: RunningStats() for i in selected or []}
+        self.zone_bucketers = {
+            i: StreamingBucketer(width, per) for i in selected or []
+        }
+
+    def push(self, row, dt=None):
+        """Pushes the `row` of millidegrees of a sample taken `dt` seconds
+        after the previous one (by default `interval`).
+        """
+        w = dt if self.weighted and dt is not None else 1
+        if dt is None:
+            dt = self.interval
+        sel = self.selected
+        if sel is None:
+            t = max(row) * 0.001
+        else:
+            t = max(row[i] if i < len(row) else raw.MISSING for i in sel)
+            t *= 0.001
+            for i in sel:
+                if i < len(row) and row[i] != raw.MISSING:
+                    self.zone_stats[i].push(row[i] * 0.001, w)
+                    self.zone_bucketers[i].push(row[i] * 0.001, w)
+        self.stats.push(t, w)
+        self.histogram.push(t, dt)
+        self.bucketer.push(t, w)
+
+    def feed(self, rows):
+        for row in rows:
+            self.push(row)
+
+    def feed_numpy(self, data):
+        """Reduces a `(samples, zones)` NumPy array, e.g. the memory-mapped
+        records of a binary raw file, in chunks of at most `CHUNK` rows.
+        """
+        sel = self.selected
+        e = edges(len(data), min(2 * self.bucketer.width, len(data)))
+        for a, b in zip(e, e[1:]):
+            bucket = RunningStats()
+            zone_buckets = {i: RunningStats() for i in self.zone_stats}
+            for c in range(a, b, CHUNK):
+                block = data[c:min(c + CHUNK, b)]
+                if sel is not None:
+                    block = block[:, sel]
+                t = block.max(axis=1) * 0.001
+                bucket.merge(_moments(t))
+                self._histogram(t)
+                for j, i in enumerate(sel or []):
+                    col = block[:, j]
+                    col = col[col != raw.MISSING] * 0.001
+                    if len(col):
+                        zone_buckets[i].merge(_moments(col))
+            self.stats.merge(bucket)
+            _add_bucket(self.bucketer, bucket)
+            for i, zb in zone_buckets.items():
+                self.zone_stats[i].merge(zb)
+                if zb.count:
+                    _add_bucket(self.zone_bucketers[i], zb)
+
+    def _histogram(self, t):
+        np = import_numpy()
+        hist = self.histogram
+        bins = np.floor((t - hist.low) / hist.resolution + 1e-9)
+        bins = np.clip(bins, 0, len(hist.counts) - 1).astype(np.intp)
+        counts = np.bincount(bins, minlength=len(hist.counts))
+        low, high = float(t.min()), float(t.max())
+        for k in np.flatnonzero(counts):
+            n = int(counts[k])
+            hist.add(int(k), n, n * self.interval, low, high)
+
+
+def _moments(a):
+    return RunningStats.from_moments(
+        len(a), float(a.mean()), float(a.var()), float(a.min()),
+        float(a.max())
+    )
+
+
+def _add_bucket(bucketer, stats):
+    bucketer.add_bucket(
+        stats.min, stats.max, stats.mean * stats.count, stats.count
+    )
+
+
+def reduce(path, width, zones=None, every_zone=False):
+    """Reduces the raw file at `path` in a single pass, for a chart of
+    `width` columns and the zones picked by `zones` (see `select_zones`), or
+    all of them with `every_zone` (e.g. for a heatmap). Samples of adaptive
+    runs are weighted by time. Returns the `Streamed` data and the period
+    covered by the file. Raises `ValueError` if a selector matches no zone.
+    """
+    with raw.open_raw(path) as reader:
+        rows = reader.rows()
+        names = reader.zones
+        first = None
+        if names is None:  # text file without a zones line
+            first = next(rows, [])
+            names = ["zone{}".format(i) for i in range(len(first))]
+        selected = select_zones(names, zones) if zones else None
+        if selected is None and every_zone:
+            selected = list(range(len(names)))
+        weighted = reader.ceiling is not None and reader.timed
+        streamed = Streamed(
+            names, width, selected, reader.interval, weighted
+        )
+        if weighted:
+            first = last = None
+            for mono, _, row in reader.timed_rows():
+                if first is None:
+                    first = last = mono - reader.interval
+                streamed.push(row, mono - last)
+                last = mono
+            seconds = 0 if first is None else last - first - reader.interval
+            period = str(datetime.timedelta(seconds=round(seconds)))
+            return streamed, period
+        if isinstance(reader, raw.BinaryReader) and import_numpy() is not None:
+            if len(reader):
+                streamed.feed_numpy(reader.numpy())
+        else:
+            if first:
+                streamed.push(first)
+            streamed.feed(rows)
+        if reader.interval is not None and streamed.stats.count:
+            seconds = round(reader.interval * (streamed.stats.count - 1))
+            period = str(datetime.timedelta(seconds=seconds))
+        else:
+            period = "{} samples".format(streamed.stats.count)
+    return streamed, period
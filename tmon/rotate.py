@@ -0,0 +1,209 @@
+# -*- coding: utf-8 -*-
+
+"""Rotation of the raw output for long running monitors.
+
+The raw data goes to numbered segments, each one a complete raw file with
+its own header, and a new segment is started once the current one reaches a
+size or an age. Closed segments are compressed in a background thread, so
+the sampling loop never waits for the compressor, and the uncompressed
+segment is removed once its compressed copy is complete. The number of
+closed segments kept may be bounded too, the oldest ones being removed, so
+a run of any length takes a bounded amount of disk.
+"""
+
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+import gzip
+import lzma
+import os
+import re
+import shutil
+import tempfile
+import time
+
+
+# compressor: (suffix, open function)
+COMPRESSORS = {
+    'gzip': ('.gz', gzip.open),
+    'lzma': ('.xz', lzma.open),
+    'none': ('', None),
+}
+CHUNK = 1 << 16  # bytes compressed at once
+SIZE_UNITS = {'': 1, 'k': 1 << 10, 'm': 1 << 20, 'g': 1 << 30}
+TIME_UNITS = {'': 1, 's': 1, 'm': 60, 'h': 3600, 'd': 86400}
+
+
+def _parse(value, units):
+    match = re.fullmatch(r'\s*([0-9.]+)\s*([a-z]?)\s*', value.lower())
+    if match is None or match.group(2) not in units:
+        raise ValueError("invalid value: {!r}".format(value))
+    ret = float(match.group(1)) * units[match.group(2)]
+    if ret <= 0:
+        raise ValueError("invalid value: {!r}".format(value))
+    return ret
+
+
+def parse_size(value):
+    """Returns the bytes of a size like `4096`, `512k`, `64M` or `1G`.
+    """
+    return int(_parse(value, SIZE_UNITS))
+
+
+def parse_duration(value):
+    """Returns the seconds of a duration like `90`, `30m`, `12h` or `7d`.
+    """
+    return _parse(value, TIME_UNITS)
+
+
+def compress(path, compressor):
+    """Compresses the file at `path` with `compressor` (see `COMPRESSORS`)
+    in a streaming pass, then removes it. Returns the compressed path.
+    """
+    suffix, open_ = COMPRESSORS[compressor]
+    if open_ is None:
+        return path
+    dst = path + suffix
+    tmp = dst + '.part'
+    with open(path, 'rb') as src, open_(tmp, 'wb') as out:
+        shutil.copyfileobj(src, out, CHUNK)
+    os.replace(tmp, dst)
+    os.unlink(path)
+    return dst
+
+
+class _Counted:
+    """File wrapper counting the characters (bytes, for binary files)
+    written to it.
+    """
+
+    def __init__(self, f):
+        self.f = f
+        self.size = 0
+
+    def write(self, data):
+        self.size += len(data)
+        return self.f.write(data)
+
+    def flush(self):
+        self.f.flush()
+
+
+class RotatingWriter:
+    """Raw writer (see `tmon.raw.WRITERS`) spreading the samples over
+    segments `<prefix>XXXXXXXX-NNNN<suffix>` in `directory`, started once the
+    current one holds `max_bytes` or is `max_seconds` old, whichever comes
+    first. The random part is picked as by `tempfile.mkstemp` and segments
+    are created exclusively, so writers started with the same prefix (e.g.
+    in the same second) never overwrite each other's segments.
+    `ceiling` is the longest interval of adaptive runs, see `tmon.raw`.
+    With `keep`, only the last `keep` closed segments are kept, older ones
+    being removed once the next one is compressed.
+
+    `name` is a glob pattern of the segments and `segments` the paths of the
+    closed ones, compressed or not yet (once closed, of those kept).
+    `removed` counts the segments removed.
+    """
+
+    def __init__(
+        self, directory, prefix, writer_cls, zones, interval, start,
+        max_bytes=None, max_seconds=None, compressor='gzip', ceiling=None,
+        keep=None
+    ):
+        self.directory = directory
+        self.prefix = prefix
+        self.writer_cls = writer_cls
+        self.zones = zones
+        self.interval = interval
+        self.max_bytes = max_bytes
+        self.max_seconds = max_seconds
+        self.compressor = compressor
+        self.ceiling = ceiling
+        self.keep = keep
+        self.removed = 0
+        ext = COMPRESSORS[compressor][0]
+        # the first segment picks the random part of the names
+        fd, path = tempfile.mkstemp(
+            prefix=prefix, suffix='-0000' + writer_cls.suffix, dir=directory
+        )
+        self._stem = path[:-len('0000' + writer_cls.suffix)]
+        self.name = self._stem + '*' + writer_cls.suffix + ext
+        self.segments = []
+        self._pending = []  # compressions in progress
+        self._kept = deque()  # compressed segments, by the compressor thread
+        self._executor = ThreadPoolExecutor(1)
+        self._start = start  # wall clock time of the first segment
+        self._t0 = time.monotonic()
+        self._f = None
+        self._open(fd, path)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def _open(self, fd=None, path=None):
+        mode = self.writer_cls.mode
+        if fd is None:
+            path = "{}{:04d}{}".format(
+                self._stem, len(self.segments), self.writer_cls.suffix
+            )
+            fd = os.open(path, os.O_RDWR | os.O_CREAT | os.O_EXCL, 0o600)
+        self._path = path
+        self._f = open(fd, mode, buffering=-1 if 'b' in mode else 1)
+        self._opened = time.monotonic()
+        self._counted = _Counted(self._f)
+        self._writer = self.writer_cls(
+            self._counted, self.zones, self.interval,
+            self._start + self._opened - self._t0, ceiling=self.ceiling
+        )
+
+    def _close(self):
+        self._writer.flush()
+        self._f.close()
+        self.segments.append(self._path)
+        self._pending.append(self._executor.submit(self._compress, self._path))
+        self._f = None
+
+    def _compress(self, path):
+        path = compress(path, self.compressor)
+        self._kept.append(path)
+        while self.keep is not None and len(self._kept) > self.keep:
+            os.unlink(self._kept.popleft())
+            self.removed += 1
+        return path
+
+    def _due(self):
+        size, age = self._counted.size, time.monotonic() - self._opened
+        return (
+            (self.max_bytes is not None and size >= self.max_bytes)
+            or (self.max_seconds is not None and age >= self.max_seconds)
+        )
+
+    def write(self, values, t=None):
+        if self._due():
+            self.rotate()
+        self._writer.write(values, t)
+
+    def rotate(self):
+        """Closes the current segment, queueing it for compression, and
+        starts the next one.
+        """
+        self._close()
+        self._open()
+
+    def flush(self):
+        if self._f is not None:
+            self._writer.flush()
+
+    def close(self):
+        """Closes the last segment and waits for all the compressions.
+        Returns the paths of the compressed segments kept.
+        """
+        if self._f is not None:
+            self._close()
+        self._executor.shutdown()
+        for p in self._pending:
+            p.result()  # raises the errors of the compressor thread
+        self.segments = list(self._kept)
+        return self.segments
@@ -0,0 +1,143 @@
+# -*- coding: utf-8 -*-
+
+"""Drift-free sampling scheduler.
+"""
+
+import time
+
+from tmon import raw
+from tmon.stats import LatencyHistogram
+
+
+ADAPTIVE_STEP = 0.5  # °C between samples adaptive intervals aim for
+ADAPTIVE_GROWTH = 1.5  # largest growth of an adaptive interval per tick
+
+
+class Scheduler:
+    """Deadline based scheduler on the monotonic clock.
+
+    Ticks are kept on an absolute schedule, `start + n * interval`, so the
+    time spent reading sensors does not add up to the sampling period. When a
+    tick runs past one or more deadlines these are counted as missed and the
+    schedule skips ahead to the next deadline in the future. With `ceiling`,
+    the interval is retimed between `interval` and `ceiling` (s) while
+    running, see `AdaptiveInterval`, overruns and missed ticks being counted
+    against the interval in force at each tick.
+    """
+
+    def __init__(self, interval=1.0, ceiling=None):
+        self.interval = interval
+        self.floor = interval
+        self.ceiling = ceiling
+        self.first = None  # time of the first tick
+        self.last = None  # time of the last tick
+        self.deadline = None
+        self.ticks = 0
+        self.overruns = 0  # ticks that were late for the next deadline
+        self.missed = 0  # deadlines skipped altogether
+        self.total_late = 0.0
+        self.max_late = 0.0
+        self.histogram = LatencyHistogram()  # lateness of ticks, in µs
+
+    def start(self):
+        self.deadline = time.monotonic()
+
+    def timeout(self):
+        """Returns the time left until the next deadline, in seconds.
+        """
+        return max(self.deadline - time.monotonic(), 0.0)
+
+    def tick(self):
+        """Records a tick and moves the deadline forward.
+        """
+        now = time.monotonic()
+        if self.first is None:
+            self.first = now
+        self.last = now
+        late = max(now - self.deadline, 0.0)
+        self.ticks += 1
+        self.total_late += late
+        self.max_late = max(self.max_late, late)
+        self.histogram.push(late * 1e6)
+        skip = int(late // self.interval)
+        self.missed += skip
+        self.deadline += (skip + 1) * self.interval
+
+    def next_timeout(self):
+        """Returns the time left until the next deadline, in seconds, counting
+        an overrun if the deadline has already passed.
+        """
+        timeout = self.timeout()
+        if timeout == 0.0:
+            self.overruns += 1
+        return timeout
+
+    def sleep(self):
+        time.sleep(self.next_timeout())
+
+    def retime(self, interval):
+        """Changes the interval from the next deadline on, which is then the
+        one of the last tick plus `interval`.
+        """
+        self.deadline += interval - self.interval
+        self.interval = interval
+
+    @property
+    def rate(self):
+        """Achieved sampling rate in Hz.
+        """
+        if self.ticks < 2 or self.last == self.first:
+            return 0.0
+        return (self.ticks - 1) / (self.last - self.first)
+
+    @property
+    def mean_interval(self):
+        """Achieved mean interval between ticks in seconds, e.g. of adaptive
+        intervals.
+        """
+        rate = self.rate
+        return 1 / rate if rate else self.interval
+
+    @property
+    def jitter(self):
+        """Mean and max lateness of ticks relative to schedule, in seconds.
+        """
+        mean = self.total_late / self.ticks if self.ticks else 0.0
+        return mean, self.max_late
+
+
+class AdaptiveInterval:
+    """Sampling interval following how fast the temperature changes.
+
+    The interval aims at `step` °C between consecutive samples of every
+    zone: it drops at once, down to `floor`, when the temperature changes
+    faster, so ramps and peaks are sampled finely, and grows by at most
+    `growth` times per tick, up to `ceiling`, while it is stable.
+    """
+
+    def __init__(
+        self, floor, ceiling, step=ADAPTIVE_STEP, growth=ADAPTIVE_GROWTH
+    ):
+        self.floor = floor
+        self.ceiling = ceiling
+        self.step = step
+        self.growth = growth
+        self.interval = floor
+        self._last = None  # previous row
+
+    def update(self, row, dt):
+        """Returns the interval after a sample `row` of millidegrees taken
+        `dt` seconds after the previous one.
+        """
+        last, self._last = self._last, row
+        if last is None or dt <= 0:
+            return self.interval
+        change = max((
+            abs(a - b) for a, b in zip(row, last)
+            if a != raw.MISSING and b != raw.MISSING
+        ), default=0) * 0.001
+        target = self.step * dt / change if change else self.ceiling
+        if target > self.interval:
+            target = min(target, self.interval * self.growth)
+        self.interval = min(max(target, self.floor), self.ceiling)
+        return self.interval
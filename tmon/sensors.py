@@ -0,0 +1,405 @@
+# -*- coding: utf-8 -*-
+
+"""Sensor discovery and low overhead sensor reads.
+"""
+
+import glob
+import os
+import re
+import time
+
+from tmon.raw import MISSING
+from tmon.stats import LatencyHistogram
+
+
+# sysfs attributes are tiny, this is more than enough for any integer value
+READ_SIZE = 32
+BLANK = b' ' * READ_SIZE
+
+
+def pread_into(fd, buf):
+    """Reads the file `fd` from offset 0 into `buf`, returning the bytes read.
+    """
+    return buf[:os.preadv(fd, [buf], 0)]
+
+
+def pread_int(fd, iov):
+    """Reads the integer attribute `fd` from offset 0 into the buffer of the
+    one item list `iov` (of `READ_SIZE` bytes, initially `BLANK`) and parses
+    it in place: `int()` skips the blanks past the bytes read, so nothing is
+    allocated but the result.
+    """
+    n = os.preadv(fd, iov, 0)
+    buf = iov[0]
+    if n < READ_SIZE and buf[n] != 32:  # the tail of a longer earlier value
+        buf[n:] = BLANK[n:]
+    return int(buf)
+
+
+if not hasattr(os, 'preadv'):  # pragma: no cover, python < 3.7
+    def pread_into(fd, buf):  # noqa: F811
+        return os.pread(fd, len(buf), 0)
+
+    def pread_int(fd, iov):  # noqa: F811
+        return int(os.pread(fd, READ_SIZE, 0))
+
+
+def _natural_key(path):
+    return [int(t) if t.isdigit() else t for t in re.split(r'(\d+)', path)]
+
+
+def _read_attr(path, default=None):
+    try:
+        with open(path) as f:
+            return f.read().strip() or default
+    except OSError:
+        return default
+
+
+BACKENDS = {}
+# temperatures come first in every read
+KINDS = ('temp', 'freq', 'power', 'throttle')
+
+
+def register_backend(cls):
+    """Class decorator registering a sensor backend under `cls.name`.
+    """
+    BACKENDS[cls.name] = cls
+    return cls
+
+
+class Backend:
+    """A family of sysfs attributes sampled by `Sensors`.
+
+    `pattern` is a glob relative to the sysfs root. Temperature backends
+    (`kind` 'temp') feed the temperature series. The values of other backends
+    are summarised per tick by `reduce()`.
+    """
+
+    name = None
+    kind = None
+    unit = None
+    pattern = None
+
+    def discover(self, root):
+        """Returns the paths of the attributes to sample and their labels.
+        """
+        paths = sorted(
+            glob.glob(os.path.join(root, self.pattern)), key=_natural_key
+        )
+        return paths, [self.label(p) for p in paths]
+
+    def label(self, path):
+        return os.path.basename(os.path.dirname(path))
+
+    def reduce(self, values, now):
+        """Summarises the raw `values` read at time `now` (monotonic seconds)
+        in `unit`, or returns None if there is nothing to report yet.
+        """
+        raise NotImplementedError
+
+
+@register_backend
+class ThermalBackend(Backend):
+    """Thermal zones, labelled by type (e.g. `x86_pkg_temp`), in millidegrees.
+    """
+
+    name = 'thermal'
+    kind = 'temp'
+    pattern = 'sys/class/thermal/thermal_zone*/temp'
+
+    def label(self, path):
+        zone = os.path.dirname(path)
+        return _read_attr(
+            os.path.join(zone, 'type'), os.path.basename(zone)
+        )
+
+
+@register_backend
+class HwmonBackend(Backend):
+    """hwmon temperature inputs, labelled `<chip>:<label>` (e.g.
+    `coretemp:Core 0`), in millidegrees.
+    """
+
+    name = 'hwmon'
+    kind = 'temp'
+    pattern = 'sys/class/hwmon/hwmon*/temp*_input'
+
+    def label(self, path):
+        chip = os.path.dirname(path)
+        attr = os.path.basename(path)[:-len('_input')]
+        return "{}:{}".format(
+            _read_attr(os.path.join(chip, 'name'), os.path.basename(chip)),
+            _read_attr(os.path.join(chip, attr + '_label'), attr)
+        )
+
+
+@register_backend
+class CpufreqBackend(Backend):
+    """Current CPU frequencies, reported as the mean over CPUs, in MHz.
+    """
+
+    name = 'cpufreq'
+    kind = 'freq'
+    unit = 'MHz'
+    pattern = 'sys/devices/system/cpu/cpu[0-9]*/cpufreq/scaling_cur_freq'
+
+    def label(self, path):
+        return os.path.basename(os.path.dirname(os.path.dirname(path)))
+
+    def reduce(self, values, now):
+        return sum(values) / len(values) / 1000 if values else None
+
+
+@register_backend
+class RaplBackend(Backend):
+    """RAPL energy counters of the top level power zones (packages), turned
+    into the total power since the previous tick, in W.
+    """
+
+    name = 'rapl'
+    kind = 'power'
+    unit = 'W'
+    pattern = 'sys/class/powercap/intel-rapl:*/energy_uj'
+
+    def __init__(self):
+        self.prev = None
+        self.prev_t = None
+        self.ranges = []
+
+    def discover(self, root):
+        paths, labels = Backend.discover(self, root)
+        top = [
+            i for i, label in enumerate(labels) if label.count(':') == 1
+        ]  # e.g. intel-rapl:0, but not its subzones like intel-rapl:0:0
+        paths = [paths[i] for i in top]
+        self.ranges = [
+            int(_read_attr(
+                os.path.join(os.path.dirname(p), 'max_energy_range_uj'), 0
+            )) for p in paths
+        ]
+        self.prev = self.prev_t = None
+        return paths, [labels[i] for i in top]
+
+    def reduce(self, values, now):
+        prev, prev_t = self.prev, self.prev_t
+        self.prev, self.prev_t = values, now
+        if prev is None or now <= prev_t or len(prev) != len(values):
+            return None
+        energy = 0
+        for e0, e1, rng in zip(prev, values, self.ranges):
+            energy += e1 - e0 if e1 >= e0 else e1 + rng - e0  # wrapped
+        return energy * 1e-6 / (now - prev_t)
+
+
+@register_backend
+class ThrottleBackend(Backend):
+    """Thermal throttle counters of every CPU (core throttling) and of every
+    package (read from its first CPU), reported per tick as the number of new
+    throttle events and, on kernels with `*_throttle_total_time_ms`, the time
+    spent throttled since the previous tick, in s (the increase of the
+    longest throttled time of any core or package), or None.
+    """
+
+    name = 'throttle'
+    kind = 'throttle'
+    pattern = 'sys/devices/system/cpu/cpu[0-9]*/thermal_throttle'
+
+    def __init__(self):
+        self.prev = None
+        self.ncounts = 0
+
+    def discover(self, root):
+        dirs = sorted(
+            glob.glob(os.path.join(root, self.pattern)), key=_natural_key
+        )
+        counters, packages = [], set()
+        for d in dirs:
+            counters.append(os.path.join(d, 'core_throttle_{}'))
+            package = _read_attr(
+                os.path.join(os.path.dirname(d), 'topology',
+                             'physical_package_id')
+            )
+            if package not in packages:
+                packages.add(package)
+                counters.append(os.path.join(d, 'package_throttle_{}'))
+        counts = [c.format('count') for c in counters]
+        counts = [c for c in counts if os.path.exists(c)]
+        times = [c.format('total_time_ms') for c in counters]
+        if not all(os.path.exists(t) for t in times):
+            times = []
+        self.ncounts = len(counts)
+        self.prev = None
+        paths = counts + times
+        return paths, [self.label(p) for p in paths]
+
+    def label(self, path):
+        cpu = os.path.basename(os.path.dirname(os.path.dirname(path)))
+        return "{}:{}".format(cpu, os.path.basename(path))
+
+    def reduce(self, values, now):
+        prev, self.prev = self.prev, values
+        if prev is None or len(prev) != len(values):
+            return None
+        n = self.ncounts
+        events = max(sum(values[:n]) - sum(prev[:n]), 0)
+        seconds = None
+        if len(values) > n:
+            seconds = max(max(values[n:]) - max(prev[n:]), 0) * 1e-3
+        return events, seconds
+
+
+class Sensors:
+    """Keeps sensor files open and re-reads them on every tick.
+
+    Discovery (globbing sysfs below `root`, for each of the `backends`) is done
+    once, on construction, and repeated only on an explicit `rescan()`, e.g.
+    after a hotplug event. Values of all backends are read in a single batched
+    pass, with `pread` at offset 0 (which makes sysfs regenerate the
+    attribute) into per sensor buffers that are reused across ticks and
+    parsed in place, see `pread_int`.
+    Temperature sensors come first, the first `ntemps` values of every read.
+
+    When a read fails, e.g. because a sensor went away, the sensors are
+    reopened at the same paths, so every value stays at the position of its
+    sensor in `names` (which writers store the rows under), sensors that
+    can't be read being `raw.MISSING` until they can again.
+    """
+
+    def __init__(self, root='/', backends=('thermal', 'throttle')):
+        self.root = root
+        unknown = set(backends) - set(BACKENDS)
+        if unknown:
+            raise ValueError("unknown sensor backends: {}".format(
+                ', '.join(sorted(unknown))
+            ))
+        self.backends = sorted(
+            (BACKENDS[name]() for name in backends),
+            key=lambda b: KINDS.index(b.kind)
+        )
+        self.spans = []  # (backend, start, end) of every backend's values
+        self.ntemps = 0
+        self.paths = []
+        self.names = []  # names of the temperature sensors
+        self.fds = []
+        self.iovs = []  # one item lists of the buffer of every sensor
+        self.ticks = 0
+        self.tick_us = 0.0  # cost of the last read
+        self.total_us = 0.0  # cumulative cost of all reads
+        self.histogram = LatencyHistogram()
+        self.rescan()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def __len__(self):
+        return len(self.fds)
+
+    def rescan(self):
+        self.close()
+        self.paths, self.names, self.spans = [], [], []
+        for backend in self.backends:
+            paths, labels = backend.discover(self.root)
+            start = len(self.paths)
+            self.paths += paths
+            self.spans.append((backend, start, len(self.paths)))
+            if backend.kind == 'temp':
+                self.names += labels
+        self.ntemps = len(self.names)
+        for path in self.paths:
+            self.fds.append(os.open(path, os.O_RDONLY))
+            self.iovs.append([bytearray(BLANK)])
+        self.degraded = False  # whether some sensors could not be read
+
+    def close(self):
+        for fd in self.fds:
+            if fd is not None:
+                os.close(fd)
+        self.fds = []
+        self.iovs = []
+
+    def _reopen(self):
+        """Reopens the sensors at the same paths, None for those gone.
+        """
+        self.close()
+        for path in self.paths:
+            try:
+                self.fds.append(os.open(path, os.O_RDONLY))
+            except OSError:
+                self.fds.append(None)
+            self.iovs.append([bytearray(BLANK)])
+        self.degraded = True
+
+    def _read_all(self):
+        return [pread_int(fd, iov) for fd, iov in zip(self.fds, self.iovs)]
+
+    def _read_each(self):
+        """As `_read_all`, with `MISSING` for the sensors that can't be read,
+        retrying to open those gone.
+        """
+        values = []
+        for i, (fd, iov) in enumerate(zip(self.fds, self.iovs)):
+            try:
+                if fd is None:
+                    fd = self.fds[i] = os.open(self.paths[i], os.O_RDONLY)
+                values.append(pread_int(fd, iov))
+            except (OSError, ValueError):
+                values.append(MISSING)
+        return values
+
+    def read(self):
+        """Returns the current raw values of all sensors, in the order of
+        `paths`. Raises `OSError` if no temperature sensor can be read.
+        """
+        t0 = time.perf_counter()
+        try:
+            values = self._read_each() if self.degraded else self._read_all()
+        except (OSError, ValueError):
+            self._reopen()
+            values = self._read_each()
+        if self.degraded:
+            if self.ntemps and all(
+                v == MISSING for v in values[:self.ntemps]
+            ):
+                raise OSError("no temperature sensor can be read")
+            if MISSING not in values:
+                self.degraded = False  # back to the batched reads
+        self.tick_us = (time.perf_counter() - t0) * 1e6
+        self.total_us += self.tick_us
+        self.histogram.push(self.tick_us)
+        self.ticks += 1
+        return values
+
+    def summaries(self, values, now):
+        """Returns `{kind: value}` with the per tick summary of every non
+        temperature backend, as returned by `Backend.reduce`, leaving out
+        the backends with sensors that could not be read.
+        """
+        ret = {}
+        for backend, start, end in self.spans:
+            if backend.kind == 'temp' or MISSING in values[start:end]:
+                continue
+            value = backend.reduce(values[start:end], now)
+            if value is not None:
+                ret[backend.kind] = value
+        return ret
+
+    @property
+    def units(self):
+        return {
+            backend.kind: backend.unit for backend in self.backends
+            if backend.kind != 'temp'
+        }
+
+    @property
+    def kinds(self):
+        """Kinds of the sensors found, e.g. `{'temp', 'freq'}`.
+        """
+        return {backend.kind for backend, a, b in self.spans if b > a}
+
+    @property
+    def mean_tick_us(self):
+        return self.total_us / self.ticks if self.ticks else 0.0
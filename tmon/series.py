@@ -0,0 +1,190 @@
+# -*- coding: utf-8 -*-
+
+"""Columnar per-zone sample storage.
+"""
+
+from array import array
+import fnmatch
+
+from tmon import raw
+from tmon.downsample import columns
+from tmon.stats import RunningStats
+from tmon.utils import import_numpy
+
+
+def select_zones(zones, selectors):
+    """Returns the indices of the `zones` picked by `selectors`, each being
+    either a zone index or a zone name, possibly a glob pattern.
+    Raises `ValueError` if a selector matches no zone.
+    """
+    ret = []
+    for sel in selectors:
+        if sel.isdigit():
+            idx = [int(sel)] if int(sel) < len(zones) else []
+        else:
+            idx = [
+                i for i, z in enumerate(zones) if fnmatch.fnmatchcase(z, sel)
+            ]
+        if not idx:
+            raise ValueError("no zone matches '{}'".format(sel))
+        ret.extend(i for i in idx if i not in ret)
+    return ret
+
+
+class Series:
+    """Samples of every zone, one `array('i')` column of millidegrees per
+    zone.
+
+    Columns of binary raw files are memory-mapped views, so loading them does
+    not copy the samples.
+    """
+
+    __slots__ = ('zones', 'columns', '_reader')
+
+    def __init__(self, zones, columns=None):
+        self.zones = list(zones)
+        if columns is None:
+            columns = [array('i') for _ in self.zones]
+        self.columns = columns
+        self._reader = None
+
+    def __len__(self):
+        return len(self.columns[0]) if self.columns else 0
+
+    def append(self, row):
+        for col, v in zip(self.columns, row):
+            col.append(v)
+        for col in self.columns[len(row):]:
+            col.append(raw.MISSING)
+
+    @classmethod
+    def load(cls, path):
+        """Loads the series stored in a raw file of either format.
+        """
+        reader = raw.open_raw(path)
+        if isinstance(reader, raw.BinaryReader):
+            ret = cls(reader.zones, reader.columns())
+            ret._reader = reader  # keeps the mapping alive
+            return ret
+        rows = reader.rows()
+        first = next(rows, [])
+        zones = reader.zones or [
+            "zone{}".format(i) for i in range(len(first))
+        ]
+        ret = cls(zones)
+        if first:
+            ret.append(first)
+        for row in rows:
+            ret.append(row)
+        return ret
+
+    def matrix(self):
+        """Returns the `(samples, zones)` NumPy array of millidegrees the
+        columns are views of, for series loaded from binary raw files (and
+        with NumPy), or None.
+        """
+        if self._reader is None or import_numpy() is None:
+            return None
+        return self._reader.numpy()
+
+    def select(self, selectors):
+        """Returns the indices of the zones picked by `selectors`, see
+        `select_zones`.
+        """
+        return select_zones(self.zones, selectors)
+
+    def stats(self, i):
+        """Returns the `RunningStats` of zone `i`, in degrees.
+        """
+        ret = RunningStats()
+        for v in self.columns[i]:
+            if v != raw.MISSING:
+                ret.push(v * 0.001)
+        return ret
+
+    def max(self, indices):
+        """Returns the per tick maximum of the zones in `indices`, in degrees.
+        """
+        cols = [self.columns[i] for i in indices]
+        return array('d', (max(vs) * 0.001 for vs in zip(*cols)))
+
+
+class RingBuffer:
+    """Fixed size buffer of the last `size` samples, backed by an
+    `array('d')`, so memory stays flat however long the run is.
+    """
+
+    __slots__ = ('data', 'size', 'head', 'count', 'total')
+
+    def __init__(self, size):
+        self.data = array('d', bytes(8 * size))
+        self.size = size
+        self.head = 0  # index of the next write
+        self.count = 0
+        self.total = 0.0  # sum of the samples in the buffer
+
+    def __len__(self):
+        return self.count
+
+    def append(self, x):
+        if self.count == self.size:
+            self.total -= self.data[self.head]
+        else:
+            self.count += 1
+        self.data[self.head] = x
+        self.total += x
+        self.head = (self.head + 1) % self.size
+
+    def __iter__(self):
+        """Iterates from the oldest to the newest sample.
+        """
+        start = (self.head - self.count) % self.size
+        if start + self.count <= self.size:
+            return iter(self.data[start:start + self.count])
+        return iter(self.data[start:] + self.data[:self.head])
+
+    @property
+    def last(self):
+        return self.data[self.head - 1]
+
+    @property
+    def mean(self):
+        return self.total / self.count if self.count else 0.0
+
+
+class ThrottleLog:
+    """Thermal throttle events of a run, kept sparsely: only the ticks that
+    saw new events are stored.
+    """
+
+    __slots__ = ('ticks', 'events', 'total', 'seconds', 'timed')
+
+    def __init__(self):
+        self.ticks = array('L')  # indices of the ticks with events
+        self.events = array('L')  # new events at each of these ticks
+        self.total = 0
+        self.seconds = 0.0
+        self.timed = False  # whether the kernel reports throttled time
+
+    def push(self, tick, events, seconds=None):
+        if seconds is not None:
+            self.timed = True
+            self.seconds += seconds
+        if events:
+            self.ticks.append(tick)
+            self.events.append(events)
+            self.total += events
+
+    def throttled(self, interval):
+        """Returns the time spent throttled, in s, estimated as the number of
+        ticks with events times `interval` if the kernel does not report it.
+        """
+        return self.seconds if self.timed else len(self.ticks) * interval
+
+    def columns(self, n, width, position=None):
+        """Returns the chart columns, of `width` columns for a series of `n`
+        samples downsampled to equal buckets, holding throttle events. Ticks
+        are mapped through `position`, if given, see `time_positions`.
+        """
+        ticks = self.ticks if position is None else map(position, self.ticks)
+        return columns(ticks, n, width)
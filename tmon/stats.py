@@ -0,0 +1,291 @@
+# -*- coding: utf-8 -*-
+
+"""Streaming statistics.
+"""
+
+from array import array
+import math
+
+
+class RunningStats:
+    """Count, min, max, mean and variance updated one sample at a time.
+
+    Uses Welford's algorithm (West's weighted variant) so the samples never
+    have to be kept around. Samples weigh 1 unless given a weight, e.g. the
+    seconds they stand for when sampled at irregular intervals, which
+    weights the mean and variance by time.
+    """
+
+    __slots__ = ('count', 'weight', 'min', 'max', 'mean', '_m2')
+
+    def __init__(self):
+        self.count = 0
+        self.weight = 0  # of all the samples
+        self.min = math.inf
+        self.max = -math.inf
+        self.mean = 0.0
+        self._m2 = 0.0
+
+    def push(self, x, w=1):
+        self.count += 1
+        if x < self.min:
+            self.min = x
+        if x > self.max:
+            self.max = x
+        if w <= 0:  # counted, but has no say in the moments
+            return
+        self.weight += w
+        delta = x - self.mean
+        self.mean += delta * w / self.weight
+        self._m2 += w * delta * (x - self.mean)
+
+    def merge(self, other):
+        """Merges the stats of another set of samples into these (Chan et
+        al.'s parallel algorithm).
+        """
+        if not other.count:
+            return
+        self.count += other.count
+        self.min = min(self.min, other.min)
+        self.max = max(self.max, other.max)
+        if not other.weight:
+            return
+        w = self.weight + other.weight
+        delta = other.mean - self.mean
+        self._m2 += other._m2 + delta * delta * self.weight * other.weight / w
+        self.mean += delta * other.weight / w
+        self.weight = w
+
+    @classmethod
+    def from_moments(cls, count, mean, variance, minimum, maximum):
+        """Builds the stats of `count` samples from their moments, e.g. as
+        computed with NumPy.
+        """
+        ret = cls()
+        ret.count, ret.mean, ret._m2 = count, mean, variance * count
+        ret.weight = count
+        ret.min, ret.max = minimum, maximum
+        return ret
+
+    @property
+    def variance(self):
+        return self._m2 / self.weight if self.weight else 0.0
+
+    @property
+    def std(self):
+        return math.sqrt(self.variance)
+
+    def scaled(self, a, b=0.0):
+        """Returns the stats of the samples mapped through `a * x + b`, with
+        `a > 0`, e.g. for unit conversions.
+        """
+        ret = RunningStats()
+        ret.count = self.count
+        ret.weight = self.weight
+        ret.min = a * self.min + b
+        ret.max = a * self.max + b
+        ret.mean = a * self.mean + b
+        ret._m2 = a * a * self._m2
+        return ret
+
+
+class RunningCorrelation:
+    """Least squares slope and correlation coefficient of `y` against `x`,
+    updated one `(x, y)` pair at a time (Welford's algorithm for the
+    co-moment).
+    """
+
+    __slots__ = ('count', 'mean_x', 'mean_y', '_m2x', '_m2y', '_cxy')
+
+    def __init__(self):
+        self.count = 0
+        self.mean_x = 0.0
+        self.mean_y = 0.0
+        self._m2x = 0.0
+        self._m2y = 0.0
+        self._cxy = 0.0
+
+    def push(self, x, y):
+        self.count += 1
+        dx = x - self.mean_x
+        self.mean_x += dx / self.count
+        dy = y - self.mean_y
+        self.mean_y += dy / self.count
+        self._m2x += dx * (x - self.mean_x)
+        self._m2y += dy * (y - self.mean_y)
+        self._cxy += dx * (y - self.mean_y)
+
+    @property
+    def slope(self):
+        """Change of `y` per unit of `x`, or None if `x` never changed.
+        """
+        return self._cxy / self._m2x if self._m2x else None
+
+    @property
+    def r(self):
+        """Pearson's correlation coefficient, or None if `x` or `y` never
+        changed.
+        """
+        if not (self._m2x and self._m2y):
+            return None
+        return self._cxy / math.sqrt(self._m2x * self._m2y)
+
+
+class LatencyHistogram:
+    """Counts of durations in power of two buckets of microseconds: bucket 0
+    holds durations under 1 µs and bucket k those in [2**(k-1), 2**k) µs.
+    """
+
+    __slots__ = ('counts', 'count', 'total', 'max')
+
+    def __init__(self, nbuckets=32):
+        self.counts = array('L', [0] * nbuckets)
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def push(self, us):
+        self.counts[min(int(us).bit_length(), len(self.counts) - 1)] += 1
+        self.count += 1
+        self.total += us
+        if us > self.max:
+            self.max = us
+
+    @property
+    def mean(self):
+        return self.total / self.count if self.count else 0.0
+
+    def buckets(self):
+        """Yields `(low, high, count)` for every non empty bucket.
+        """
+        for k, n in enumerate(self.counts):
+            if n:
+                yield (2**(k - 1) if k else 0), 2**k, n
+
+    def percentile(self, q):
+        """Returns an upper bound of the `q` quantile (0 <= q <= 1), i.e. the
+        upper end of the bucket it falls in.
+        """
+        rank = q * self.count
+        seen = 0
+        for _, high, n in self.buckets():
+            seen += n
+            if seen >= rank:
+                return high
+        return 0
+
+    def as_dict(self):
+        return {
+            'count': self.count, 'mean': self.mean, 'max': self.max,
+            'p50': self.percentile(0.5), 'p99': self.percentile(0.99),
+            'buckets': [list(b) for b in self.buckets()],
+        }
+
+
+class TemperatureHistogram:
+    """Samples and seconds per fixed width bin of temperatures: bin k holds
+    temperatures in `[low + k * resolution, low + (k + 1) * resolution)`,
+    the first and last bins also those below and above the range.
+
+    Memory is constant (two arrays of `(high - low) / resolution` items)
+    however long the run, and the quantiles and the time spent above any
+    temperature are exact to a bin, the quantiles being kept within the
+    extremes of the samples, which are tracked exactly. The quantiles are
+    those of the samples or, if `weighted` (for samples taken at irregular
+    intervals), of the time.
+    """
+
+    __slots__ = (
+        'low', 'resolution', 'counts', 'seconds', 'count', 'weighted', 'min',
+        'max'
+    )
+
+    def __init__(self, low=-40.0, high=150.0, resolution=0.1, weighted=False):
+        n = round((high - low) / resolution)
+        self.low = low
+        self.resolution = resolution
+        self.counts = array('L', [0] * n)
+        self.seconds = array('d', [0.0] * n)
+        self.count = 0
+        self.weighted = weighted
+        self.min = math.inf
+        self.max = -math.inf
+
+    def bin(self, t):
+        k = math.floor((t - self.low) / self.resolution + 1e-9)
+        return min(max(k, 0), len(self.counts) - 1)
+
+    def edge(self, k):
+        """Returns the lower end of bin `k`.
+        """
+        return self.low + k * self.resolution
+
+    def push(self, t, dt=0.0):
+        """Adds a sample of temperature `t` (°C) standing for `dt` seconds.
+        """
+        k = self.bin(t)
+        self.counts[k] += 1
+        self.seconds[k] += dt
+        self.count += 1
+        if t < self.min:
+            self.min = t
+        if t > self.max:
+            self.max = t
+
+    def add(self, k, count, seconds, low=None, high=None):
+        """Adds `count` samples, standing for `seconds`, to bin `k`, e.g. as
+        counted with NumPy, the lowest and highest of them being `low` and
+        `high` (by default the edges of the bin).
+        """
+        self.counts[k] += count
+        self.seconds[k] += seconds
+        self.count += count
+        self.min = min(self.min, self.edge(k) if low is None else low)
+        self.max = max(
+            self.max, self.edge(k + 1) if high is None else high
+        )
+
+    def merge(self, other):
+        for k, n in enumerate(other.counts):
+            if n:
+                self.add(k, n, other.seconds[k], other.min, other.max)
+
+    @property
+    def total_seconds(self):
+        return sum(self.seconds)
+
+    def percentile(self, q):
+        """Returns the `q` quantile (0 <= q <= 1) as the middle of the bin it
+        falls in, or None without samples.
+        """
+        if not self.count:
+            return None
+        weights = self.seconds if self.weighted else self.counts
+        rank = q * sum(weights)
+        seen = 0
+        for k, n in enumerate(weights):
+            seen += n
+            if n and seen >= rank:
+                mid = self.edge(k) + self.resolution / 2
+                return min(max(mid, self.min), self.max)
+        return None  # pragma: no cover
+
+    def above(self, t):
+        """Returns the samples and the seconds at or above temperature `t`,
+        rounded down to a bin edge.
+        """
+        k = self.bin(t)
+        return sum(self.counts[k:]), sum(self.seconds[k:])
+
+    def rows(self, nrows=10):
+        """Yields `(low, high, count)` for at most `nrows` rows of whole bins
+        spanning the bins with samples.
+        """
+        used = [k for k, n in enumerate(self.counts) if n]
+        if not used:
+            return
+        first, last = used[0], used[-1] + 1
+        per = -(-(last - first) // nrows)  # bins per row, rounded up
+        for a in range(first, last, per):
+            b = min(a + per, last)
+            yield self.edge(a), self.edge(b), sum(self.counts[a:b])
@@ -2,28 +2,115 @@
 
 """Main module."""
 
+from array import array
 import contextlib
 import datetime
-import glob
 import math
-import pathlib
+import os
+import resource
+import select
 import signal
 from subprocess import Popen, TimeoutExpired
 import sys
-import time
 import tempfile
 import textwrap
+import time
 
+from tmon import daemon, downsample, export, fleet, heatmap, raw
 from tmon.asciichart import plot
+from tmon.guard import Guard
+from tmon.live import Dashboard
+from tmon.markers import MarkerChannel, PhaseLog
+from tmon.procstat import CPUSampler, CPUStats
+from tmon.replay import Streamed, reduce
+from tmon.rotate import RotatingWriter
+from tmon.scheduler import AdaptiveInterval, Scheduler
+from tmon.sensors import Sensors
+from tmon.series import Series, ThrottleLog, select_zones
+from tmon.stats import RunningStats, TemperatureHistogram
 from tmon.utils import eprint
 
 
+# sections of the temperature stats: min/avg/max, p50/p90/p99, time above
+# the thresholds and a histogram
+STATS = ('minmax', 'percentiles', 'above', 'histogram')
+DEFAULT_STATS = ('minmax', 'percentiles', 'above')
+CHARTS = ('line', 'heatmap')
+PERCENTILES = (0.5, 0.9, 0.99)
+MARK_STEPS = 100  # positions per chart column of the marks of adaptive runs
+
+# signals that should reach the child even when paused by the guard
+TERMINATING = {
+    signal.SIGHUP, signal.SIGINT, signal.SIGQUIT, signal.SIGTERM
+}
+
+
 class Monitor:
 
-    def __init__(self):
+    def __init__(
+        self, interval=1.0, raw_format='text', dashboard=None, read_hooks=None,
+        sensors=('thermal', 'throttle'), sysfs_root='/', cooldown_to=None,
+        guard=None, tmond=False, output_dir=None, rotate_size=None,
+        rotate_time=None, compressor='gzip', rotate_keep=None, aggregate=None,
+        prom_textfile=None, prom_every=export.PROM_EVERY, adaptive=None,
+        overhead=False
+    ):
         self.keep_running = True
+        self.interrupted = False  # whether a SIGINT was received
+        self.cooldown_to = cooldown_to  # °C the child waits for, if any
+        self.cooldown = 0.0  # time spent waiting for it, in s
+        self.child_wall = None  # wall time of the child, in s
+        # CPU and wall time of the run, in s, once stopped
+        self.cpu_user = self.cpu_sys = self.wall = None
+        # Guard pausing the child, which then runs in its own process group
+        self.guard = guard
+        self.backends = sensors
+        self.sysfs_root = sysfs_root
+        self.raw_format = raw_format
+        self.dashboard = dashboard
         self.tf = None
         self.proc = None
+        self.sensors = None
+        self.scheduler = Scheduler(interval, adaptive)
+        # the interval varies between `interval` and `adaptive` (s), if set,
+        # with how fast the temperature changes, see AdaptiveInterval, and
+        # samples are then weighted by time
+        self.adaptive = None
+        self.elapsed = None  # seconds from the start to the end of samples
+        if adaptive is not None:
+            self.adaptive = AdaptiveInterval(interval, adaptive)
+            self.elapsed = array('d')
+        self.stats = RunningStats()
+        self.histogram = TemperatureHistogram(weighted=adaptive is not None)
+        self.extra_stats = {}  # per tick summaries of non temperature sensors
+        self.throttle = None  # ThrottleLog, if there are throttle counters
+        self.cpu = None
+        self.cpu_stats = CPUStats()
+        self.markers = None
+        self.phases = PhaseLog()
+        self.tmond = tmond  # whether to use the samples of a running tmond
+        self.ring = None  # its ring buffer, if there is one
+        self.output_dir = output_dir  # of the raw data, by default /tmp
+        # the raw data is rotated once a segment holds rotate_size bytes or
+        # is rotate_time s old, keeping the last rotate_keep closed segments
+        # if set, see tmon.rotate
+        self.rotate_size = rotate_size
+        self.rotate_time = rotate_time
+        self.compressor = compressor
+        self.rotate_keep = rotate_keep
+        # (chart width, zone selectors) the samples are reduced to as they
+        # are taken, for a report that doesn't load the raw data back
+        self.aggregate = aggregate
+        self.streamed = None
+        # node_exporter textfile rewritten every prom_every ticks, if any
+        self.prom_textfile = prom_textfile
+        self.prom_every = prom_every
+        self.prom = None
+        # whether the textfile holds the sampler's own cost as well
+        self.prom_overhead = overhead
+        # callables returning context managers entered around every sensor
+        # read, e.g. to let an external profiler wrap the read phase
+        self.read_hooks = list(read_hooks or [])
 
     def _setup_signal_handlers(self):
         catchable_sigs = set(signal.Signals) - {signal.SIGKILL, signal.SIGSTOP}
@@ -31,49 +118,362 @@ class Monitor:
             signal.signal(sig, self._signal_handler)
 
     def _signal_handler(self, sig, frame):
+        if sig == signal.Signals.SIGINT:
+            self.interrupted = True
         if sig == signal.Signals.SIGCHLD:
             # tmon returns only when child process exits, i.e sends SIGCHLD
-            # back to parent
-            self.keep_running = False
+            # back to parent, but SIGCHLD is sent as well when the child is
+            # stopped or continued, e.g. by the guard
+            if self._child_exited():
+                self._stop()
         else:
             # all the other signals should be injected to the child process
             try:
-                self.proc.send_signal(sig)
+                self._forward(sig)
             except AttributeError:
                 # Just in case a signal is sent before the process is spawned
                 # or no child process was executed at all, i.e when tmon is run
                 # with no arguments
                 if sig == signal.Signals.SIGINT:
+                    self._stop()
+
+    def _child_exited(self):
+        try:
+            info = os.waitid(
+                os.P_PID, self.proc.pid,
+                os.WEXITED | os.WNOHANG | os.WNOWAIT  # leaves it to Popen
+            )
+        except (AttributeError, ChildProcessError):
+            return True
+        return info is not None
+
+    def _forward(self, sig):
+        if self.guard is None:
+            self.proc.send_signal(sig)
+            return
+        # the child has its own process group, which doesn't get the signals
+        # of the terminal, e.g. SIGINT on Ctrl-C
+        try:
+            os.killpg(self.proc.pid, sig)
+        except ProcessLookupError:
+            return
+        if self.guard.paused and sig in TERMINATING:
+            os.killpg(self.proc.pid, signal.SIGCONT)  # to act on it
+
+    def _stop(self):
+        self.keep_running = False
+        # wakes up the main loop, which is otherwise blocked in poll() until
+        # the next tick as poll() is resumed after signal handlers return
+        try:
+            os.write(self._wakeup_w, b'\0')
+        except (AttributeError, BlockingIOError):
+            pass
+
+    def _setup_wakeup(self, stack):
+        """Sets up the file descriptors the main loop waits on between ticks:
+        a self-pipe written by the signal handlers and, see `_watch_child`, a
+        pidfd that becomes readable as soon as the child exits.
+        """
+        self._poll = select.poll()
+        self._wakeup_r, self._wakeup_w = os.pipe()
+        for fd in (self._wakeup_r, self._wakeup_w):
+            os.set_blocking(fd, False)
+            stack.callback(os.close, fd)
+        self._poll.register(self._wakeup_r, select.POLLIN)
+        self._pidfd = None
+
+    def _watch_child(self, stack):
+        """Waits on a pidfd of the child (Linux >= 5.3, Python >= 3.9).
+        """
+        if self.proc is not None and hasattr(os, 'pidfd_open'):
+            try:
+                self._pidfd = os.pidfd_open(self.proc.pid)
+            except OSError:  # pragma: no cover, kernel without pidfd support
+                pass
+            else:
+                stack.callback(os.close, self._pidfd)
+                self._poll.register(self._pidfd, select.POLLIN)
+
+    def _wait(self, scheduler=None):
+        """Blocks until the next tick of `scheduler` (by default the sampling
+        one) is due or the monitor is stopped, whichever comes first.
+        """
+        scheduler = scheduler or self.scheduler
+        timeout = scheduler.next_timeout()
+        while self.keep_running and timeout > 0:
+            if timeout < 1e-3:  # below poll() resolution
+                time.sleep(timeout)
+                break
+            for fd, _ in self._poll.poll(int(timeout * 1e3)):
+                if fd == self._pidfd:
                     self.keep_running = False
+                else:
+                    os.read(fd, 512)
+            timeout = scheduler.timeout()
+
+    def _cool_down(self):
+        """Samples the sensors, without recording, until the hottest zone is
+        below `cooldown_to` or the monitor is stopped.
+        """
+        scheduler = Scheduler(self.scheduler.interval)
+        scheduler.start()
+        t0 = time.monotonic()
+        while self.keep_running:
+            scheduler.tick()
+            t = max(self._latest()) * 0.001
+            if t < self.cooldown_to:
+                break
+            if scheduler.ticks == 1:
+                eprint("tmon: cooling down to {:.1f} °C, now {:.1f} °C".format(
+                    self.cooldown_to, t
+                ))
+            self._wait(scheduler)
+        self.cooldown = time.monotonic() - t0
 
     def _start_timer(self):
         self.start = datetime.datetime.now()
         self.cdt = self.start.strftime("%Y%m%d@%Hh%Mm%S")
+        self._rusage0 = resource.getrusage(resource.RUSAGE_SELF)
+        self._t0 = time.monotonic()
 
     def _stop_timer(self):
         self.period = str(datetime.datetime.now() - self.start).split('.')[0]
+        self.cpu_user, self.cpu_sys, self.wall = self._usage()
+
+    def _usage(self):
+        """Returns the user and system CPU time and the wall time, in s,
+        since the start of the run.
+        """
+        ru0, ru1 = self._rusage0, resource.getrusage(resource.RUSAGE_SELF)
+        return (
+            ru1.ru_utime - ru0.ru_utime, ru1.ru_stime - ru0.ru_stime,
+            time.monotonic() - self._t0
+        )
+
+    def _read(self):
+        if not self.read_hooks:
+            return self.sensors.read()
+        with contextlib.ExitStack() as stack:
+            for hook in self.read_hooks:
+                stack.enter_context(hook())
+            return self.sensors.read()
+
+    def _latest(self):
+        if self.ring is not None and self.ring.alive():
+            latest = self.ring.latest()
+            if latest is not None:
+                return latest
+        return self.sensors.read()[:self.sensors.ntemps]
+
+    def _samples(self):
+        """Returns the monotonic time and the row of the temperatures sampled
+        since the previous tick: those written by tmond, if attached to one,
+        or a local sample.
+        """
+        if self.ring is not None:
+            rows = self.ring.read_timed()
+            if rows:
+                return rows
+            if not self.ring.alive():
+                eprint("tmon: tmond is gone, sampling locally")
+                self.ring.close()
+                self.ring = None
+            elif self.stats.count:
+                return rows
+            # otherwise the run starts with a local sample
+        values = self._read()
+        tmps = values[:self.sensors.ntemps]
+        if len(tmps) < len(values):
+            self._push_extras(values)
+        return [(self.scheduler.last, tmps)]
+
+    def _attach_tmond(self, stack):
+        self.ring = daemon.attach()
+        if self.ring is None:
+            eprint("tmon: no tmond running, sampling locally")
+        else:
+            stack.callback(lambda: self.ring and self.ring.close())
+
+    def _push_extras(self, values):
+        extras = self.sensors.summaries(values, self.scheduler.last)
+        throttle = extras.pop('throttle', None)
+        if throttle is not None and self.throttle is not None:
+            self.throttle.push(self.stats.count, *throttle)
+        for kind, value in extras.items():
+            if kind not in self.extra_stats:
+                self.extra_stats[kind] = RunningStats()
+            self.extra_stats[kind].push(value)
+
+    def _open_writer(self, stack):
+        """Opens the raw output, rotated if `rotate_size` or `rotate_time`
+        is set, and sets up the rolling aggregates if `aggregate` is set.
+        Returns the raw writer.
+        """
+        writer_cls = raw.WRITERS[self.raw_format]
+        ring = self.ring
+        zones = ring.zones if ring else self.sensors.names
+        interval = ring.interval if ring else self.scheduler.interval
+        ceiling = None if self.adaptive is None else self.adaptive.ceiling
+        prefix = "tmon-{}-".format(self.cdt)
+        if self.output_dir is not None:
+            os.makedirs(self.output_dir, exist_ok=True)
+        if self.aggregate is not None:
+            width, selectors = self.aggregate
+            selected = None
+            if selectors:
+                try:
+                    selected = select_zones(zones, selectors)
+                except ValueError:  # reported by Report.zone_stats()
+                    pass
+            self.streamed = Streamed(
+                zones, width, selected, interval,
+                weighted=self.adaptive is not None
+            )
+        if self.rotate_size is None and self.rotate_time is None:
+            self.tf = stack.enter_context(tempfile.NamedTemporaryFile(
+                mode=writer_cls.mode, prefix=prefix, suffix=writer_cls.suffix,
+                dir=self.output_dir, delete=False,
+                buffering=1 if writer_cls is raw.TextWriter else -1
+            ))
+            writer = writer_cls(
+                self.tf, zones, interval, self.start.timestamp(),
+                ceiling=ceiling
+            )
+        else:
+            self.tf = writer = stack.enter_context(RotatingWriter(
+                self.output_dir or tempfile.gettempdir(), prefix, writer_cls,
+                zones, interval, self.start.timestamp(),
+                max_bytes=self.rotate_size, max_seconds=self.rotate_time,
+                compressor=self.compressor, ceiling=ceiling,
+                keep=self.rotate_keep
+            ))
+        stack.callback(writer.flush)
+        return writer
+
+    def overhead(self):
+        """Returns the sampler's own cost: sensor read latency and tick
+        lateness histograms (µs) and the CPU time used while monitoring, so
+        far while running.
+        """
+        if self.wall is None:
+            cpu_user, cpu_sys, wall = self._usage()
+        else:
+            cpu_user, cpu_sys, wall = self.cpu_user, self.cpu_sys, self.wall
+        return {
+            'ticks': self.scheduler.ticks,
+            'interval': self.scheduler.floor,
+            'ceiling': self.scheduler.ceiling,
+            'mean_interval': self.scheduler.mean_interval,
+            'rate': self.scheduler.rate,
+            'overruns': self.scheduler.overruns,
+            'missed': self.scheduler.missed,
+            'read_us': self.sensors.histogram.as_dict(),
+            'jitter_us': self.scheduler.histogram.as_dict(),
+            'cpu_user_s': cpu_user,
+            'cpu_sys_s': cpu_sys,
+            'wall_s': wall,
+        }
 
     def start(self, args):
         self._setup_signal_handlers()
-        self._start_timer()
 
         with contextlib.ExitStack() as stack:
+            self._setup_wakeup(stack)
+            self.sensors = stack.enter_context(
+                Sensors(self.sysfs_root, self.backends)
+            )
+            if self.tmond:
+                self._attach_tmond(stack)
+            if self.ring is not None and self.adaptive is not None:
+                eprint("tmon: sampling at the interval of tmond")
+                self.adaptive = self.elapsed = None
+                self.scheduler.ceiling = None
+            if self.cooldown_to is not None:
+                self._cool_down()
+                if not self.keep_running:  # interrupted while cooling down
+                    args = None
+            if 'throttle' in self.sensors.kinds and self.ring is None:
+                self.throttle = ThrottleLog()
+            self.cpu = stack.enter_context(CPUSampler())
+            self._start_timer()
             if args:
-                self.proc = stack.enter_context(
-                    Popen(args, stdout=sys.stdout, stderr=sys.stderr)
+                self.markers = stack.enter_context(MarkerChannel())
+                self.proc = stack.enter_context(Popen(
+                    args, stdout=sys.stdout, stderr=sys.stderr,
+                    env=self.markers.env(),
+                    preexec_fn=os.setpgrp if self.guard is not None else None
+                ))
+                self._watch_child(stack)
+                self.cpu.attach(self.proc.pid)
+                if self.guard is not None:
+                    self.guard.attach(self.proc.pid)
+            if self.ring is not None:
+                self.ring.attach()
+            writer = self._open_writer(stack)
+            if self.prom_textfile is not None:
+                self.prom = export.PromTextfile(
+                    self.prom_textfile,
+                    self.ring.zones if self.ring else self.sensors.names,
+                    self.prom_every
                 )
-            self.tf = stack.enter_context(tempfile.NamedTemporaryFile(
-                mode='w+', prefix="tmon-{}-".format(self.cdt),
-                suffix=".txt", delete=False, buffering=1
-            ))
+                stack.callback(self.prom.close)
+            if self.dashboard is not None:
+                stack.callback(self.dashboard.close)
 
+            last = None  # time of the previous sample
+            self.scheduler.start()
             while True:  # do-while() loop to ensure it runs at least once
-                tmp_files = glob.glob("/sys/class/thermal/thermal_zone*/temp")
-                tmps = [pathlib.Path(p).read_text().strip() for p in tmp_files]
-                self.tf.write((' '.join(tmps) + '\n'))
+                self.scheduler.tick()
+                rows = self._samples()
+                if self.markers is not None:
+                    for name in self.markers.receive():
+                        self.phases.start(name, self.stats.count)
+                for now, tmps in rows:
+                    if last is None:
+                        last = now - self.scheduler.interval
+                    dt, last = now - last, now
+                    writer.write(tmps, now)
+                    if self.streamed is not None:
+                        self.streamed.push(tmps, dt)
+                    t = max(tmps) * 0.001
+                    weight = 1
+                    if self.adaptive is not None:
+                        weight = dt
+                        self.elapsed.append(
+                            (self.elapsed[-1] if self.elapsed else 0.0) + dt
+                        )
+                    self.phases.push(t, weight)
+                    self.stats.push(t, weight)
+                    self.histogram.push(t, dt)
+                    if self.dashboard is not None:
+                        self.dashboard.push(t)
+                if rows:
+                    usage = self.cpu.sample(self.scheduler.last)
+                    if usage is not None:
+                        self.cpu_stats.push(t, *usage)
+                    if self.guard is not None:
+                        self.guard.update(self.stats.count - 1, t)
+                    if self.prom is not None:
+                        self.prom.update(
+                            tmps, self.stats, time.time(),
+                            self.overhead if self.prom_overhead else None
+                        )
+                    if self.adaptive is not None:
+                        self.scheduler.retime(self.adaptive.update(tmps, dt))
+                if self.dashboard is not None:
+                    self.dashboard.refresh()
                 if not self.keep_running:
                     break
-                time.sleep(1)
+                self._wait()
+            if self.prom is not None and self.stats.count:
+                self.prom.write(
+                    tmps, self.stats, time.time(),
+                    self.overhead() if self.prom_overhead else None
+                )
+            if self.guard is not None:
+                # e.g. the child was killed while paused, the rest of its
+                # group shouldn't stay stopped
+                self.guard.resume(self.stats.count - 1)
             ret = 0
             if args:
                 try:
@@ -81,12 +481,9 @@ class Monitor:
                 except TimeoutExpired:
                     self.proc.kill()
                     self.proc.communicate()  # we don't care about stdout/err
+                self.child_wall = time.monotonic() - self._t0
                 ret = self.proc.returncode
             self._stop_timer()
-
-            lines = pathlib.Path(self.tf.name).read_text().splitlines()
-            self.ds = [max([float(t)
-                       for t in l.split(' ')])*0.001 for l in lines]
         return ret
 
 
@@ -94,12 +491,123 @@ class Report:
     """Temperature Reporter
     """
 
-    def __init__(self, ds, tfname, period, fahrenheit=False):
-        self.ds = ds if not fahrenheit else [t*1.8 + 32 for t in ds]
+    def __init__(
+        self, stats, tfname, period, fahrenheit=False, tick_us=None,
+        scheduler=None, zones=None, downsample='max', overhead=None,
+        streamed=None, extras=None, throttle=None, guard=None, cpu=None,
+        phases=None, series=None, tmond=None, histogram=None,
+        show=DEFAULT_STATS, thresholds=(), returncode=None, chart='line',
+        color=False, paths=None, elapsed=None
+    ):
+        self.fahrenheit = fahrenheit
+        self.temp_stats = self._convert(stats)
+        self.zones = zones
+        self.downsample = downsample
+        self._ds = None
+        # samples already in memory, loaded from the raw file `tfname`
+        # otherwise (which may then be None)
+        self._series = series
+        self._charts = {}
         self.tfname = tfname
+        # the raw files, e.g. the segments of a rotated run whose `tfname` is
+        # a glob pattern
+        self.paths = paths or ([tfname] if tfname is not None else [])
         self.period = period
+        self.tick_us = tick_us
+        self.scheduler = scheduler
+        self.overhead = overhead
+        # data already reduced in one pass (see tmon.replay), used instead of
+        # loading the raw file
+        self.streamed = streamed
+        # {kind: (stats, unit)} of the non temperature sensors, e.g. CPU
+        # frequency and power
+        self.extras = extras or {}
+        self.throttle = throttle
+        self.guard = guard
+        self.cpu = cpu  # CPUStats, with child stats if there was a child
+        self.phases = phases
+        self.tmond = tmond  # the RingReader samples were read from, if any
+        # TemperatureHistogram of the hottest zone at every tick, if any
+        if histogram is None and streamed is not None:
+            histogram = streamed.histogram
+        self.histogram = histogram
+        self.show = show  # sections of the temperature stats, see STATS
+        self.thresholds = thresholds  # °C the time above is reported for
+        self.returncode = returncode  # of the child, if there was one
+        # seconds from the start to the end of every sample of adaptive runs,
+        # whose chart is evenly spaced in time, for placing the marks
+        self.elapsed = elapsed
+        # a line chart of the hottest zone (or of the selected zones), or a
+        # heatmap of the zones, in 256 colours with `color`
+        self.chart_kind = chart
+        self.color = color
         self.unit = "°F" if fahrenheit else "°C"
 
+    def _convert(self, ts):
+        return ts.scaled(1.8, 32) if self.fahrenheit else ts
+
+    @property
+    def series(self):
+        """The per-zone series, loaded from the raw file on first use.
+        """
+        if self._series is None:
+            self._series = Series.load(self.tfname)
+        return self._series
+
+    def selected(self):
+        """Returns the indices of the zones picked with `zones`, or None if
+        there is no selection. Raises `ValueError` for unknown zones.
+        """
+        if not self.zones:
+            return None
+        return select_zones(self.zone_names, self.zones)
+
+    @property
+    def zone_names(self):
+        if self.streamed is not None:
+            return self.streamed.zones
+        return self.series.zones
+
+    def _zone_stats(self, i):
+        if self.streamed is not None:
+            return self.streamed.zone_stats[i]
+        return self.series.stats(i)
+
+    def _selected_or_none(self):
+        try:
+            return self.selected()
+        except ValueError:  # reported by zone_stats()
+            return None
+
+    def zone_ds(self, i):
+        """Returns the series of zone `i` in the report unit.
+        """
+        ret = array('d')
+        t = 0.0
+        for v in self.series.columns[i]:
+            if v != raw.MISSING:  # otherwise repeat the last value
+                t = v * 0.001 * 1.8 + 32 if self.fahrenheit else v * 0.001
+            ret.append(t)
+        return ret
+
+    @property
+    def ds(self):
+        """The temperature series (the hottest of the selected zones at each
+        tick), loaded from the raw file on first use.
+        """
+        if self._ds is None:
+            selected = self._selected_or_none()
+            if selected is None and self.tfname is None:
+                ds = self.series.max(range(len(self.series.zones)))
+            elif selected is None:
+                ds = raw.iter_max(self.tfname)
+            else:
+                ds = self.series.max(selected)
+            if self.fahrenheit:
+                ds = (t*1.8 + 32 for t in ds)
+            self._ds = array('d', ds)
+        return self._ds
+
     def header(self):
         return textwrap.dedent("""
             ===================
@@ -111,66 +619,719 @@ class Report:
             ===================
         """)
 
+    def _series_to_plot(self, xsize):
+        """Returns the downsampled series to chart and the lower envelope of
+        the min-max band, if any.
+        """
+        if self.streamed is not None:
+            return self._streamed_to_plot(xsize)
+        if self.downsample == 'band':
+            lower, upper = downsample.band(self.ds, xsize)
+            return [upper, lower], lower
+        selected = self._selected_or_none()
+        if selected is not None and len(selected) > 1:
+            return [
+                downsample.downsample(self.zone_ds(i), xsize, self.downsample)
+                for i in selected
+            ], None
+        return [downsample.downsample(self.ds, xsize, self.downsample)], None
+
+    def _streamed_to_plot(self, xsize):
+        mode = self.downsample if self.downsample != 'lttb' else 'max'
+        selected = self.streamed.selected
+        if mode == 'band':
+            lines = list(self.streamed.bucketer.result(xsize, 'band'))[::-1]
+        elif selected is not None and len(selected) > 1:
+            lines = [
+                self.streamed.zone_bucketers[i].result(xsize, mode)
+                for i in selected
+            ]
+        else:
+            lines = [self.streamed.bucketer.result(xsize, mode)]
+        if self.fahrenheit:
+            lines = [[t*1.8 + 32 for t in line] for line in lines]
+        return lines, lines[1] if mode == 'band' else None
+
     def chart(self, xsize, ysize, ylim):
-        ds = self.ds
-        ratio = int(len(ds) / xsize)
-        if ratio > 1:
-            ds = ds[::ratio]
-        ret = "temp ({}) for a period of {}\n".format(self.unit, self.period)
-        if len(ds) > 1:
-            try:
-                minimum, maximum = ylim
-            except TypeError:
-                minimum = math.floor(min(ds))
-                maximum = math.ceil(max(ds) + 0.1)
+        """Returns the rendered chart, which is cached per chart size and view
+        limits.
+        """
+        key = (xsize, ysize, tuple(ylim) if ylim else None)
+        if key not in self._charts:
+            self._charts[key] = self._chart(xsize, ysize, ylim)
+        return self._charts[key]
+
+    def _heatmap_rows(self, xsize):
+        """Returns the rows of the heatmap, in the report unit, and their
+        labels: the selected zones, or all of them.
+        """
+        mode = self.downsample if self.downsample in ('min', 'mean') else 'max'
+        if self.streamed is not None:
+            selected = self.streamed.selected
+            if not selected:  # only the hottest zone was kept
+                rows = [self.streamed.bucketer.result(xsize, mode)]
+                labels = ['max']
             else:
-                minimum = min(minimum, math.floor(min(ds)))
-                maximum = max(maximum, math.ceil(max(ds) + 0.1))
-
-            ret += plot(ds, {
-                'height': ysize - 1,
-                'minimum': minimum,
-                'maximum': maximum,
-            })
+                rows = [
+                    self.streamed.zone_bucketers[i].result(xsize, mode)
+                    for i in selected
+                ]
+                labels = [self.zone_names[i] for i in selected]
         else:
-            ret = ""
+            selected = self._selected_or_none()
+            indices = range(len(self.zone_names))
+            if selected is not None:
+                indices = selected
+            matrix = self.series.matrix()
+            if matrix is not None:
+                rows = heatmap.bucket_rows(matrix, xsize, mode, selected)
+            else:
+                rows = heatmap.bucket(
+                    [self.series.columns[i] for i in indices], xsize, mode
+                )
+            labels = [self.zone_names[i] for i in indices]
+        if self.fahrenheit:
+            rows = [
+                [None if t is None else t * 1.8 + 32 for t in row]
+                for row in rows
+            ]
+        return rows, labels
+
+    def _heatmap(self, xsize, ylim):
+        rows, labels = self._heatmap_rows(xsize)
+        minimum, maximum = ylim if ylim else (None, None)
+        ret = "temp ({}) per zone for a period of {}\n".format(
+            self.unit, self.period
+        )
+        ret += heatmap.render(rows, labels, minimum, maximum, self.color)
+        for marks in self._marks(max(len(row) for row in rows)):
+            ret += "\n" + marks
         return ret
 
+    def _chart(self, xsize, ysize, ylim):
+        if self.temp_stats.count < 2:
+            return ""
+        if self.chart_kind == 'heatmap':
+            return self._heatmap(xsize, ylim)
+        lines, lower = self._series_to_plot(xsize)
+        if len(lines[0]) < 2:
+            return ""
+        cfg = {'height': ysize - 1}
+        if lower is not None:
+            cfg['lower'] = lower
+        lowest = min(map(min, lines))
+        highest = max(map(max, lines))
+        try:
+            minimum, maximum = ylim
+        except TypeError:
+            minimum = math.floor(lowest)
+            maximum = math.ceil(highest + 0.1)
+        else:
+            minimum = min(minimum, math.floor(lowest))
+            maximum = max(maximum, math.ceil(highest + 0.1))
+        cfg['minimum'], cfg['maximum'] = minimum, maximum
+
+        ret = "temp ({}){} for a period of {}\n".format(
+            self.unit, self._zones_label(), self.period
+        )
+        ret += plot(lines, cfg)
+        for marks in self._marks(len(lines[0])):
+            ret += "\n" + marks
+        return ret
+
+    def _zones_label(self):
+        selected = self._selected_or_none()
+        if selected is None:
+            return ""
+        return " of " + ", ".join(self.zone_names[i] for i in selected)
+
     def stats(self):
-        mi = round(min(self.ds), 1)
-        av = round(sum(self.ds) / len(self.ds), 1)
-        ma = round(max(self.ds), 1)
-        ret = "min: {0} {3}\navg: {1} {3}\nmax: {2} {3}".format(
-            mi, av, ma, self.unit
+        temps = []
+        if 'minmax' in self.show:
+            mi = round(self.temp_stats.min, 1)
+            av = round(self.temp_stats.mean, 1)
+            ma = round(self.temp_stats.max, 1)
+            temps.append("min: {0} {3}\navg: {1} {3}\nmax: {2} {3}".format(
+                mi, av, ma, self.unit
+            ))
+        hist = self.histogram
+        if hist is not None and hist.count:
+            if 'percentiles' in self.show:
+                temps.append(self.percentiles())
+            if 'above' in self.show and self.thresholds:
+                temps.append(self.time_above())
+        sections = ["\n".join(temps)] if temps else []
+        if 'histogram' in self.show and hist is not None and hist.count:
+            sections.append(self.temp_histogram())
+        if self.zones:
+            sections.append(self.zone_stats())
+        if self.phases:
+            sections.append(self.phase_stats())
+        if self.extras:
+            sections.append(self.extra_stats())
+        if self.throttle is not None:
+            sections.append(self.throttle_stats())
+        if self.guard is not None:
+            sections.append(self.guard_stats())
+        if self.cpu is not None and self.cpu.system.count:
+            sections.append(self.cpu_usage())
+        return "\n\n".join(sections)
+
+    def _to_unit(self, t):
+        return t * 1.8 + 32 if self.fahrenheit else t
+
+    def percentiles(self):
+        return ", ".join(
+            "p{:g}: {:.1f}".format(
+                100 * q, self._to_unit(self.histogram.percentile(q))
+            ) for q in PERCENTILES
+        ) + " " + self.unit
+
+    def time_above(self):
+        """Returns the time spent at or above every threshold, in seconds
+        and as a share of the run.
+        """
+        hist = self.histogram
+        total_s = hist.total_seconds
+        row = "above {:.1f} {}: {:.1f} s, {} samples ({:.1f}%)"
+        lines = []
+        for t in self.thresholds:
+            n, seconds = hist.above(t)
+            share = seconds / total_s if total_s else n / hist.count
+            lines.append(row.format(
+                self._to_unit(t), self.unit, seconds, n, 100 * share
+            ))
+        return "\n".join(lines)
+
+    def temp_histogram(self, width=30):
+        """Returns the histogram of the temperatures in rows of whole bins.
+        """
+        rows = list(self.histogram.rows())
+        top = max(n for _, _, n in rows) or 1
+        ret = "histogram ({}):".format(self.unit)
+        for low, high, n in rows:
+            ret += "\n    [{:>6.1f}, {:>6.1f}) {} {}".format(
+                self._to_unit(low), self._to_unit(high),
+                '█' * max(1 if n else 0, round(width * n / top)), n
+            )
+        return ret
+
+    def phase_stats(self):
+        row = "[{}] min {:.1f}, avg {:.1f}, max {:.1f} {} ({} samples)"
+        lines = []
+        for name, st in self.phases.stats.items():
+            if not st.count:
+                continue
+            ts = self._convert(st)
+            lines.append(row.format(
+                name, ts.min, ts.mean, ts.max, self.unit, ts.count
+            ))
+        return "\n".join(lines)
+
+    def extra_stats(self):
+        lines = []
+        for kind, (st, unit) in sorted(self.extras.items()):
+            lines.append("{}: min {:.1f}, avg {:.1f}, max {:.1f} {}".format(
+                kind, st.min, st.mean, st.max, unit
+            ))
+        return "\n".join(lines)
+
+    def zone_stats(self):
+        try:
+            selected = self.selected()
+        except ValueError as e:
+            return "zones: {}".format(e)
+        lines = []
+        for i in selected:
+            ts = self._convert(self._zone_stats(i))
+            lines.append(
+                "[{}] {}: min {:.1f}, avg {:.1f}, max {:.1f} {}".format(
+                    i, self.zone_names[i], ts.min, ts.mean, ts.max,
+                    self.unit
+                )
+            )
+        return "\n".join(lines)
+
+    def throttle_stats(self):
+        th = self.throttle
+        interval = self.scheduler.mean_interval if self.scheduler else 1.0
+        return "throttle: {} events in {} ticks, {}{:.1f} s throttled".format(
+            th.total, len(th.ticks), '' if th.timed else '~',
+            th.throttled(interval)
+        )
+
+    def guard_stats(self):
+        """Returns the time the child was paused by the guard, in total and
+        per paused interval.
+        """
+        guard = self.guard
+        wall = self.scheduler.last - self.scheduler.first
+        ret = "guard: paused {} times for {:.1f} s ({:.1f}% of the run)"
+        ret = ret.format(
+            len(guard.intervals), guard.paused_s,
+            100 * guard.paused_s / wall if wall else 0.0
+        )
+        for _, _, start, duration in guard.intervals:
+            ret += "\n    at {} for {:.1f} s".format(
+                datetime.timedelta(seconds=round(start)), duration
+            )
+        return ret
+
+    def _per_cpu(self, corr):
+        slope, r = corr.slope, corr.r
+        if slope is None:
+            return "n/a"
+        return "{:+.2f} {} (r {})".format(
+            slope * 1.8 if self.fahrenheit else slope, self.unit,
+            'n/a' if r is None else '{:.2f}'.format(r)
+        )
+
+    def cpu_usage(self):
+        """Returns the CPU usage of the child tree and of the system, and how
+        much the temperature rises per CPU used by the child tree and by
+        everything else (a hot workload or a hot neighbour).
+        """
+        cpu = self.cpu
+        ret = "system cpu: {:.1f}% avg, {:.1f}% max of {:.0f} CPUs".format(
+            100 * cpu.system.mean, 100 * cpu.system.max, cpu.ncpus.mean
+        )
+        if cpu.child.max > 0 or cpu.child.min < 0:
+            ret += "\nchild cpu: {:.2f} CPUs avg, {:.2f} max".format(
+                cpu.child.mean, cpu.child.max
+            )
+            ret += "\ntemp per CPU: child {}, others {}".format(
+                self._per_cpu(cpu.temp_child), self._per_cpu(cpu.temp_others)
+            )
+        return ret
+
+    def _marks(self, width):
+        """Returns lines marking the chart columns, of a chart `width` points
+        wide, holding throttle events (▲) or paused by the guard (■), and the
+        phases of the run.
+        """
+        n = self.temp_stats.count
+        position = None
+        if self.elapsed is not None:
+            n = width * MARK_STEPS
+            position = downsample.time_positions(self.elapsed, n)
+        marks = []
+        if self.throttle is not None and self.throttle.total:
+            marks.append((
+                'throttle', '▲', self.throttle.columns(n, width, position)
+            ))
+        if self.guard is not None and self.guard.intervals:
+            marks.append((
+                'paused', '■', self.guard.columns(n, width, position)
+            ))
+        ret = [
+            '{:>9} {}'.format(label, ''.join(
+                mark if x in cols else ' ' for x in range(width)
+            ).rstrip()) for label, mark, cols in marks
+        ]
+        if self.phases:
+            ret.append('{:>9} {}'.format(
+                'phases', self.phases.label_line(n, width, position)
+            ))
+        return ret
+
+    def sampler(self):
+        if self.tmond is not None:
+            ret = "source: tmond (pid {}, interval {:g} s, {} lost)\n".format(
+                self.tmond.pid, self.tmond.interval, self.tmond.lost
+            )
+        else:
+            ret = ""
+        ret += "tick: {:.1f} µs".format(self.tick_us)
+        sched = self.scheduler
+        if sched is not None and sched.ticks > 1:
+            mean, worst = sched.jitter
+            if sched.ceiling is None:
+                interval = "interval {:g} s".format(sched.floor)
+                of = ""
+            else:
+                interval = "adaptive interval {:g}-{:g} s, {:.3g} s mean"
+                interval = interval.format(
+                    sched.floor, sched.ceiling, sched.mean_interval
+                )
+                of = " of the interval in force"
+            ret += (
+                "\nrate: {:.2f} Hz ({})"
+                "\njitter: {:.2f} ms avg, {:.2f} ms max"
+                "\novershoot: {} overruns, {} missed ticks{}"
+            ).format(
+                sched.rate, interval, mean * 1e3, worst * 1e3,
+                sched.overruns, sched.missed, of
+            )
+        return ret
+
+    @staticmethod
+    def _histogram(name, hist, width=30):
+        ret = "{}: p50 < {} µs, p99 < {} µs, max {:.1f} µs".format(
+            name, hist['p50'], hist['p99'], hist['max']
+        )
+        top = max([n for _, _, n in hist['buckets']] or [1])
+        for low, high, n in hist['buckets']:
+            ret += "\n    [{:>6}, {:>6}) µs {} {}".format(
+                low, high, '█' * max(1, round(width * n / top)), n
+            )
+        return ret
+
+    def sampler_overhead(self):
+        """Returns the sampler overhead section: CPU time used by tmon while
+        monitoring and the sensor read latency and tick lateness histograms.
+        """
+        oh = self.overhead
+        cpu = oh['cpu_user_s'] + oh['cpu_sys_s']
+        ret = "sampler overhead:\n"
+        lines = "cpu: {:.3f} s user, {:.3f} s sys ({:.2f}% of {:.1f} s)"
+        lines = lines.format(
+            oh['cpu_user_s'], oh['cpu_sys_s'],
+            100 * cpu / oh['wall_s'] if oh['wall_s'] else 0.0, oh['wall_s']
         )
+        lines += "\n" + self._histogram("read latency", oh['read_us'])
+        lines += "\n" + self._histogram("tick lateness", oh['jitter_us'])
+        return ret + textwrap.indent(lines, '    ')
+
+    def _series_labels(self, nlines):
+        if self.downsample == 'band' and nlines == 2:
+            return ['upper', 'lower']
+        selected = self._selected_or_none()
+        if selected is not None and len(selected) == nlines > 1:
+            return [self.zone_names[i] for i in selected]
+        return ['max']
+
+    def as_dict(self, xsize):
+        """Returns the report as plain data, for the JSON and CSV outputs:
+        the stats, in the report unit, the series downsampled to `xsize`
+        points, the sampling, the sampler's own cost if measured and the exit
+        status of the child.
+        """
+        ts = self.temp_stats
+        ret = {
+            'unit': self.unit,
+            'period': self.period,
+            'raw': self.tfname,
+            'exit_code': self.returncode,
+            'stats': {
+                'count': ts.count,
+                'min': ts.min if ts.count else None,
+                'mean': ts.mean if ts.count else None,
+                'max': ts.max if ts.count else None,
+                'std': ts.std,
+            },
+        }
+        hist = self.histogram
+        if hist is not None and hist.count:
+            for q in PERCENTILES:
+                ret['stats']['p{:g}'.format(100 * q)] = self._to_unit(
+                    hist.percentile(q)
+                )
+            ret['above'] = [
+                dict(zip(('temp', 'samples', 'seconds'), (
+                    self._to_unit(t),) + hist.above(t)
+                )) for t in self.thresholds
+            ]
+        if self.zones:
+            try:
+                selected = self.selected()
+            except ValueError:
+                selected = []
+            ret['zones'] = {}
+            for i in selected:
+                zs = self._convert(self._zone_stats(i))
+                ret['zones'][self.zone_names[i]] = {
+                    'min': zs.min, 'mean': zs.mean, 'max': zs.max
+                }
+        ret['series'] = {}
+        if ts.count:
+            lines, _ = self._series_to_plot(xsize)
+            for label, line in zip(self._series_labels(len(lines)), lines):
+                ret['series'][label] = [round(t, 3) for t in line]
+        if self.scheduler is not None:
+            ret['sampler'] = {
+                'interval': self.scheduler.floor,
+                'ceiling': self.scheduler.ceiling,
+                'mean_interval': self.scheduler.mean_interval,
+                'rate': self.scheduler.rate,
+                'ticks': self.scheduler.ticks,
+                'missed': self.scheduler.missed,
+            }
+        if self.extras:
+            ret['extras'] = {
+                kind: {'unit': unit, 'min': st.min, 'mean': st.mean,
+                       'max': st.max}
+                for kind, (st, unit) in self.extras.items()
+            }
+        if self.overhead is not None:
+            ret['overhead'] = self.overhead
+        if self.throttle is not None:
+            ret['throttle_events'] = self.throttle.total
+        if self.guard is not None:
+            ret['paused_s'] = self.guard.paused_s
         return ret
 
     def report(self, xsize, ysize, ylim):
         ret = self.header() + "\n"
         chart = self.chart(xsize, ysize, ylim)
         if chart != "":
-            ret += textwrap.indent(self.chart(xsize, ysize, ylim), '    ')
+            ret += textwrap.indent(chart, '    ')
             ret += "\n\n"
         ret += textwrap.indent(self.stats(), '    ') + "\n\n"
-        ret += textwrap.indent("raw: " + self.tfname, '    ')
+        if self.tick_us is not None:
+            ret += textwrap.indent(self.sampler(), '    ') + "\n"
+        if self.overhead is not None:
+            ret += textwrap.indent(self.sampler_overhead(), '    ') + "\n"
+        if self.tfname is not None:
+            ret += textwrap.indent("raw: " + self.tfname, '    ')
         ret += self.footer()
         return ret
 
 
+class RepeatReport:
+    """Per run and aggregate stats of repeated runs, each one a tuple of the
+    temperature stats, the wall time of the child (None without a child) and
+    the time spent cooling down before it, in s.
+    """
+
+    def __init__(self, runs, fahrenheit=False):
+        self.runs = runs
+        self.fahrenheit = fahrenheit
+        self.unit = "°F" if fahrenheit else "°C"
+
+    def _convert(self, ts):
+        return ts.scaled(1.8, 32) if self.fahrenheit else ts
+
+    @staticmethod
+    def _aggregate(name, values, unit):
+        st = RunningStats()
+        for v in values:
+            st.push(v)
+        return "{}: mean {:.2f}, std {:.2f}, min {:.2f}, max {:.2f} {}".format(
+            name, st.mean, st.std, st.min, st.max, unit
+        )
+
+    def runs_table(self):
+        row = "{:>3}  {:>8}  {:>12}  {:>5}  {:>5}  {:>6}"
+        lines = [row.format(
+            'run', 'wall (s)', 'cooldown (s)', 'min', 'avg',
+            'max ' + self.unit
+        )]
+        for i, (stats, wall, cooldown) in enumerate(self.runs, 1):
+            ts = self._convert(stats)
+            lines.append(row.format(
+                i, '-' if wall is None else '{:.2f}'.format(wall),
+                '{:.2f}'.format(cooldown), '{:.1f}'.format(ts.min),
+                '{:.1f}'.format(ts.mean), '{:.1f}'.format(ts.max)
+            ))
+        return "\n".join(lines)
+
+    def aggregate(self):
+        temps = [self._convert(stats) for stats, _, _ in self.runs]
+        walls = [wall for _, wall, _ in self.runs if wall is not None]
+        lines = []
+        if walls:
+            lines.append(self._aggregate("wall", walls, "s"))
+        lines.append(self._aggregate(
+            "avg temp", [ts.mean for ts in temps], self.unit
+        ))
+        lines.append(self._aggregate(
+            "max temp", [ts.max for ts in temps], self.unit
+        ))
+        return "\n".join(lines)
+
+    def report(self):
+        ret = textwrap.dedent("""
+            ===================
+            Repeat Summary
+        """) + "\n"
+        ret += textwrap.indent(self.runs_table(), '    ') + "\n\n"
+        ret += textwrap.indent(self.aggregate(), '    ')
+        ret += textwrap.dedent("""
+            ===================
+        """)
+        return ret
+
+
 def run(
     cmd=None, xsize=70, ysize=15, ylim=None, fahrenheit=False,
-    stats_only=False, chart_only=False, path_only=False
+    stats_only=False, chart_only=False, path_only=False, interval=1.0,
+    raw_format='text', zones=None, downsample='max', live=False,
+    refresh=0.5, window=600, alt_screen=False, overhead=False,
+    read_hooks=None, sensors=('thermal', 'throttle'), sysfs_root='/',
+    cooldown_to=None, repeat=1, guard=None, tmond=False, output_dir=None,
+    rotate_size=None, rotate_time=None, compressor='gzip', rotate_keep=None,
+    show_stats=DEFAULT_STATS, thresholds=(), output='text',
+    prom_textfile=None, prom_every=export.PROM_EVERY, chart='line',
+    color=False, adaptive=None
+):
+    """Runs `cmd` `repeat` times while monitoring, each run waiting first
+    for the hottest zone to fall below `cooldown_to` (in °F if `fahrenheit`)
+    if given, and outputs the report of every run and, for repeated runs, a
+    summary. Stops at the first run that fails or is interrupted and
+    returns its exit status. With `guard`, a `(pause_at, resume_at)` tuple
+    (in °F if `fahrenheit`, `resume_at` may be None), the child is paused
+    while too hot, see `Guard`. With `tmond`, samples are read from a
+    running tmond, if any, see `tmon.daemon`. The raw data goes to
+    `output_dir` (by default the temporary directory) and, with `rotate_size`
+    (bytes) or `rotate_time` (s), to compressed segments, see `tmon.rotate`,
+    of which only the last `rotate_keep` are kept if set, the report then
+    being built from aggregates kept while sampling.
+    `show_stats` picks the sections of the temperature stats (see `STATS`)
+    and `thresholds` the temperatures (in °F if `fahrenheit`) the time
+    spent above is reported for. The report is text, JSON or CSV depending
+    on `output`, see `tmon.export`. With `prom_textfile`, gauges of the run
+    are written to that node_exporter textfile every `prom_every` ticks.
+    `chart` and `color` pick the chart, see `Report`. With `adaptive`, the
+    sampling interval varies between `interval` and `adaptive` (s) with how
+    fast the temperature changes, see `AdaptiveInterval`, and the report is
+    built from aggregates weighted by time kept while sampling.
+    """
+    if fahrenheit:
+        thresholds = [(t - 32) / 1.8 for t in thresholds]
+    if cooldown_to is not None and fahrenheit:
+        cooldown_to = (cooldown_to - 32) / 1.8
+    if guard is not None and fahrenheit:
+        guard = tuple(None if t is None else (t - 32) / 1.8 for t in guard)
+    aggregate = None
+    if not (rotate_size is None and rotate_time is None and adaptive is None):
+        # every zone is kept for a heatmap
+        selectors = zones or (['*'] if chart == 'heatmap' else None)
+        aggregate = (xsize, selectors)
+    runs = []
+    ret = 0
+    for _ in range(repeat):
+        dashboard = None
+        if live:
+            dashboard = Dashboard(
+                xsize=xsize, ysize=ysize, refresh=refresh, window=window,
+                fahrenheit=fahrenheit, alt_screen=alt_screen
+            )
+        monitor = Monitor(
+            interval=interval, raw_format=raw_format, dashboard=dashboard,
+            read_hooks=read_hooks, sensors=sensors, sysfs_root=sysfs_root,
+            cooldown_to=cooldown_to,
+            guard=Guard(*guard) if guard is not None and cmd else None,
+            tmond=tmond, output_dir=output_dir, rotate_size=rotate_size,
+            rotate_time=rotate_time, compressor=compressor,
+            rotate_keep=rotate_keep, aggregate=aggregate,
+            prom_textfile=prom_textfile, prom_every=prom_every,
+            adaptive=adaptive, overhead=overhead
+        )
+        ret = monitor.start(cmd)
+        stats, tfname, period = monitor.stats, monitor.tf.name, monitor.period
+        report = Report(
+            stats, tfname, period, fahrenheit=fahrenheit,
+            tick_us=monitor.sensors.mean_tick_us, scheduler=monitor.scheduler,
+            zones=zones, downsample=downsample,
+            overhead=monitor.overhead() if overhead else None,
+            extras={
+                kind: (st, monitor.sensors.units[kind])
+                for kind, st in monitor.extra_stats.items()
+            },
+            throttle=monitor.throttle, guard=monitor.guard,
+            cpu=monitor.cpu_stats, phases=monitor.phases, tmond=monitor.ring,
+            streamed=monitor.streamed, histogram=monitor.histogram,
+            show=show_stats, thresholds=thresholds,
+            returncode=ret if cmd else None, chart=chart, color=color,
+            paths=(
+                monitor.tf.segments
+                if isinstance(monitor.tf, RotatingWriter) else None
+            ),
+            elapsed=monitor.elapsed
+        )
+        _output(
+            report, xsize, ysize, ylim, stats_only, chart_only, path_only,
+            output
+        )
+        runs.append((stats, monitor.child_wall, monitor.cooldown))
+        if ret != 0 or monitor.interrupted:
+            break
+    if repeat > 1 and not (chart_only or path_only) and output == 'text':
+        eprint(RepeatReport(runs, fahrenheit).report())
+    return ret
+
+
+def _output(
+    report, xsize, ysize, ylim, stats_only, chart_only, path_only,
+    output='text'
 ):
-    monitor = Monitor()
-    ret = monitor.start(cmd)
-    ds, tfname, period = monitor.ds, monitor.tf.name, monitor.period
-    report = Report(ds, tfname, period, fahrenheit=fahrenheit)
-    if stats_only:
+    if output == 'json':
+        eprint(export.to_json(report.as_dict(xsize)))
+    elif output == 'csv':
+        eprint(export.to_csv(report.as_dict(xsize)), end='')
+    elif stats_only:
         eprint('\n' + report.stats())
     elif chart_only:
         eprint('\n' + report.chart(xsize, ysize, ylim))
     elif path_only:
-        eprint('\n' + tfname)
+        eprint('\n' + '\n'.join(report.paths))
     else:
         eprint(report.report(xsize, ysize, ylim))
+
+
+def replay(
+    files, xsize=70, ysize=15, ylim=None, fahrenheit=False,
+    stats_only=False, chart_only=False, path_only=False, zones=None,
+    downsample='max', show_stats=DEFAULT_STATS, thresholds=(),
+    output='text', chart='line', color=False
+):
+    """Re-renders the reports of existing raw files, each one reduced in a
+    single streaming pass. Returns 1 if any file could not be read, 0
+    otherwise.
+    """
+    if fahrenheit:
+        thresholds = [(t - 32) / 1.8 for t in thresholds]
+    ret = 0
+    for path in files:
+        try:
+            streamed, period = reduce(
+                path, xsize, zones, every_zone=chart == 'heatmap'
+            )
+        except (OSError, ValueError) as e:
+            eprint("tmon: {}: {}".format(path, e))
+            ret = 1
+            continue
+        report = Report(
+            streamed.stats, path, period, fahrenheit=fahrenheit, zones=zones,
+            downsample=downsample, streamed=streamed, show=show_stats,
+            thresholds=thresholds, chart=chart, color=color
+        )
+        _output(
+            report, xsize, ysize, ylim, stats_only, chart_only, path_only,
+            output
+        )
     return ret
+
+
+def merge(
+    files, xsize=70, ysize=15, ylim=None, fahrenheit=False,
+    stats_only=False, chart_only=False, path_only=False, zones=None,
+    downsample='max', bucket=None, show_stats=DEFAULT_STATS, thresholds=(),
+    output='text', chart='line', color=False
+):
+    """Renders the fleet report of the raw files of many hosts, merged in a
+    single streaming pass in time aligned buckets of `bucket` seconds, see
+    `tmon.fleet`. The stats and chart lines are those of every host, and
+    the overall stats those of all the samples. Returns 1 if the files could
+    not be merged, 0 otherwise.
+    """
+    if path_only:
+        eprint('\n' + '\n'.join(files))
+        return 0
+    if fahrenheit:
+        thresholds = [(t - 32) / 1.8 for t in thresholds]
+    try:
+        streamed, period = fleet.merge(files, xsize, bucket, zones)
+    except (OSError, ValueError) as e:
+        eprint("tmon: {}".format(e))
+        return 1
+    report = Report(
+        streamed.stats, None, period, fahrenheit=fahrenheit,
+        zones=[str(i) for i in streamed.selected], downsample=downsample,
+        streamed=streamed, show=show_stats, thresholds=thresholds,
+        chart=chart, color=color
+    )
+    _output(
+        report, xsize, ysize, ylim, stats_only, chart_only, path_only, output
+    )
+    return 0
@@ -5,3 +5,20 @@ import sys
 
 def eprint(*args, **kwargs):
     print(*args, file=sys.stderr, **kwargs)
+
+
+_numpy = False  # not imported yet
+
+
+def import_numpy():
+    """Returns the numpy module, or None if it isn't installed. Imported on
+    first use rather than with tmon, as it takes a good part of the start up
+    time of the command and only some paths need it.
+    """
+    global _numpy
+    if _numpy is False:
+        try:
+            import numpy as _numpy
+        except ImportError:
+            _numpy = None
+    return _numpy